@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     'plans',
     'timeline',
     'chat',
+    'blobs',
 ]
 
 MIDDLEWARE = [
@@ -138,6 +139,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'users.CustomUser'
 
 CORS_ALLOW_ALL_ORIGINS = True
+# 一覧APIのページングカーソルを Web クライアントからも読めるようにする
+CORS_EXPOSE_HEADERS = ['X-Next-Cursor']
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),      # ← アクセストークン（通常は短く）
@@ -174,6 +177,17 @@ SPECTACULAR_SETTINGS = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# アップロードは内容のハッシュで1回だけ保存する（同じ画像の再アップロード・転送はディスクを消費しない）
+# 参照されなくなったファイルは manage.py gc_blobs で削除する
+STORAGES = {
+    'default': {
+        'BACKEND': 'blobs.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Channels を使うための ASGI アプリ設定
 ASGI_APPLICATION = 'backend.asgi.application'
 
@@ -193,6 +207,25 @@ CACHES = {
         "LOCATION": "redis://127.0.0.1:6379/0",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # Redis が落ちていてもリクエストを長く止めない（閲覧中判定は無しで続ける）
+            "SOCKET_CONNECT_TIMEOUT": 1,
+            "SOCKET_TIMEOUT": 1,
         }
     }
-}
\ No newline at end of file
+}
+
+# チャット画面の閲覧中判定の有効期限（秒）
+# クライアントはこれより短い間隔で {"type": "ping"} を送る
+CHAT_PRESENCE_TTL = 90
+
+# WebSocket 配信（アウトボックス）の送り方
+#   "thread"  … コミット後にプロセス内のスレッドが送る
+#   "command" … manage.py dispatch_outbox を別プロセスで常駐させる
+CHAT_OUTBOX_DISPATCH = 'thread'
+
+# 画像の縮小版（投稿画像のサムネイル・アイコンの小サイズなど）の作り方
+#   "process" … コミット後にプロセスプール（IMAGE_VARIANT_WORKERS 個）で作る
+#   "inline"  … コミット後にその場で作る（テスト・開発用）
+#   "off"     … 作らない。build_image_variants / build_avatar_variants でまとめて作る
+IMAGE_VARIANTS_MODE = 'process'
+IMAGE_VARIANT_WORKERS = 2
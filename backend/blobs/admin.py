@@ -0,0 +1,10 @@
+from django.contrib import admin
+from .models import MediaBlob
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'ref_count', 'created_at', 'last_saved_at')
+    list_filter = ('ref_count',)
+    search_fields = ('sha256', 'name')
+    readonly_fields = ('sha256', 'name', 'size', 'created_at', 'last_saved_at')
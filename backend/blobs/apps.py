@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class BlobsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'blobs'
+
+    def ready(self):
+        from .references import connect_signals
+        connect_signals()
@@ -0,0 +1,51 @@
+# blobs/gc.py
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import MediaBlob
+from .references import recount_references
+from .storage import BLOB_DIR, ContentAddressedStorage
+
+
+def collect_garbage(grace, dry_run: bool = False) -> dict:
+    """
+    参照数を数え直し、参照されていないまま `grace` 以上経った blob を削除する。
+    DB に行の無いファイル（保存後にロールバックされた分など）も同じ条件で消す。
+    `dry_run` では数え直しの結果も書き込まず、件数だけを返す。
+    """
+    corrected = recount_references(dry_run=dry_run)
+    result = {"recounted": len(corrected), "blobs": 0, "orphans": 0}
+    if not isinstance(default_storage, ContentAddressedStorage):
+        return result
+
+    cutoff = timezone.now() - grace
+    if dry_run:
+        # 数え直しの結果は書き込んでいないので、直した後の参照数で数える
+        rows = MediaBlob.objects.filter(last_saved_at__lt=cutoff).values_list('name', 'ref_count')
+        result["blobs"] = sum(1 for name, ref_count in rows.iterator() if corrected.get(name, ref_count) <= 0)
+    else:
+        unreferenced = MediaBlob.objects.filter(ref_count__lte=0, last_saved_at__lt=cutoff)
+        for blob in unreferenced.only('pk', 'name').iterator():
+            # 数え直しの後に参照された行・同じ内容が保存し直された行は残す
+            deleted, _ = MediaBlob.objects.filter(pk=blob.pk, ref_count__lte=0, last_saved_at__lt=cutoff).delete()
+            if deleted:
+                default_storage.delete_blob(blob.name)
+                result["blobs"] += 1
+
+    root = default_storage.path(BLOB_DIR)
+    known = set(MediaBlob.objects.values_list('name', flat=True))
+    expires = time.time() - grace.total_seconds()
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, default_storage.location).replace(os.sep, '/')
+            if name in known or os.path.getmtime(path) >= expires:
+                continue
+            if not dry_run:
+                os.remove(path)
+            result["orphans"] += 1
+
+    return result
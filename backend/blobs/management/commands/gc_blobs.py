@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from blobs.gc import collect_garbage
+
+
+class Command(BaseCommand):
+    help = "参照数を数え直し、どこからも参照されていないメディアファイルを削除する（cron で実行）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=int, default=24, help="最後に保存されてから削除するまでの猶予（時間）")
+        parser.add_argument('--dry-run', action='store_true', help="削除せずに件数だけ表示する")
+
+    def handle(self, *args, **options):
+        result = collect_garbage(timedelta(hours=options['grace_hours']), dry_run=options['dry_run'])
+        self.stdout.write(
+            f"参照数を {result['recounted']} 件修正 / "
+            f"未参照 {result['blobs']} 件・孤立ファイル {result['orphans']} 件を削除"
+            + ("（dry-run）" if options['dry_run'] else "")
+        )
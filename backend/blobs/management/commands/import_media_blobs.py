@@ -0,0 +1,56 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import FileField
+
+from blobs.references import recount_references, reference_fields
+from blobs.storage import BLOB_DIR, ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    help = (
+        "導入前に post_images/ などへ保存したファイルを内容アドレスの blob へ移し、"
+        "各レコードの参照を書き換える。同じ内容のファイルは1つにまとまる"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-originals', action='store_true', help="移し終えた元のファイルを削除する")
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError("STORAGES['default'] が blobs.storage.ContentAddressedStorage ではありません")
+
+        moved = {}
+        missing = 0
+        for model, field in reference_fields():
+            if not isinstance(field, FileField):
+                continue
+            attname = field.attname
+            rows = (
+                model._default_manager
+                .exclude(**{f"{attname}__isnull": True})
+                .exclude(**{attname: ""})
+                .exclude(**{f"{attname}__startswith": f"{BLOB_DIR}/"})
+                .order_by()
+                .values_list('pk', attname)
+            )
+            for pk, name in rows.iterator():
+                if name not in moved:
+                    if not default_storage.exists(name):
+                        missing += 1
+                        self.stderr.write(f"見つかりません: {model._meta.label}.{field.name} pk={pk} {name}")
+                        continue
+                    with default_storage.open(name) as f:
+                        moved[name] = default_storage.save(name, f)
+
+                model._default_manager.filter(pk=pk, **{attname: name}).update(**{attname: moved[name]})
+
+        recount_references()
+
+        if options['delete_originals']:
+            for name in moved:
+                default_storage.delete(name)
+
+        self.stdout.write(
+            f"{len(moved)} ファイルを {len(set(moved.values()))} 個の blob へ移しました"
+            + (f"（見つからないファイル {missing} 件）" if missing else "")
+        )
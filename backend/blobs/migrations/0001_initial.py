@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='保存名')),
+                ('size', models.PositiveBigIntegerField(verbose_name='サイズ（バイト）')),
+                ('ref_count', models.IntegerField(default=0, verbose_name='参照数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('last_saved_at', models.DateTimeField(auto_now_add=True, verbose_name='最終保存日時')),
+            ],
+            options={
+                'verbose_name': 'メディアファイル',
+                'verbose_name_plural': 'メディアファイル',
+                'indexes': [models.Index(condition=models.Q(('ref_count__lte', 0)), fields=['last_saved_at'], name='blob_unreferenced_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+# 内容のハッシュで1回だけ保存したメディアファイル（blobs.storage.ContentAddressedStorage が作る）
+# 同じバイト列のアップロードはすべてこの1ファイルを指し、参照数が 0 になったものは gc_blobs で消す
+class MediaBlob(models.Model):
+
+    sha256 = models.CharField(_("SHA-256"), max_length=64, unique=True)
+
+    # ストレージ上の名前（FileField に入る値）"blobs/ab/cd/<sha256>.jpg"
+    name = models.CharField(_("保存名"), max_length=255, unique=True)
+
+    size = models.PositiveBigIntegerField(_("サイズ（バイト）"))
+
+    # FileField からの参照数（保存・削除のシグナルで増減し、gc_blobs で数え直す）
+    ref_count = models.IntegerField(_("参照数"), default=0)
+
+    created_at = models.DateTimeField(_("作成日時"), auto_now_add=True)
+    # 最後に同じ内容が保存された日時。直後の GC で消さないための目安
+    last_saved_at = models.DateTimeField(_("最終保存日時"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("メディアファイル")
+        verbose_name_plural = _("メディアファイル")
+        indexes = [
+            # 参照されていないものだけを古い順に拾う
+            models.Index(
+                fields=("last_saved_at",),
+                condition=models.Q(ref_count__lte=0),
+                name="blob_unreferenced_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.ref_count})"
@@ -0,0 +1,159 @@
+# blobs/references.py
+from collections import Counter
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F, FileField, TextField
+from django.db.models.functions import Cast
+from django.db.models.signals import post_delete, post_init, post_save
+
+from .models import MediaBlob
+from .storage import BLOB_DIR, ContentAddressedStorage, is_blob_name
+
+# インスタンスに覚えておく「読み込み時（前回保存時）のファイル名」
+ORIGINAL_NAMES = '_blob_original_names'
+
+
+# ContentAddressedStorage を使っている FileField / ImageField と、
+# モデルの `blob_json_fields` に挙げた JSONField（画像の派生ファイルの保存名などを入れる）の一覧
+def reference_fields():
+    fields = []
+    for model in apps.get_models():
+        json_fields = getattr(model, 'blob_json_fields', ())
+        for field in model._meta.concrete_fields:
+            if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage):
+                fields.append((model, field))
+            elif field.name in json_fields:
+                fields.append((model, field))
+    return fields
+
+
+def _adjust(names, delta: int) -> None:
+    counts = Counter(name for name in names if is_blob_name(name))
+    for name, count in counts.items():
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + delta * count)
+
+
+def add_references(names) -> None:
+    _adjust(names, 1)
+
+
+def remove_references(names) -> None:
+    _adjust(names, -1)
+
+
+# JSON の中の文字列のうち blob の保存名であるもの
+def _json_names(value):
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, list):
+        return [value] if isinstance(value, str) and is_blob_name(value) else []
+    return [name for item in value for name in _json_names(item)]
+
+
+def field_names(field, value) -> list:
+    if isinstance(field, FileField):
+        name = getattr(value, 'name', value)
+        return [name] if name else []
+    return _json_names(value)
+
+
+def _current_names(instance, field) -> list:
+    return field_names(field, instance.__dict__.get(field.attname))
+
+
+# --- シグナル ---
+# QuerySet.update() / bulk_create() はシグナルを通らないので、ずれは gc_blobs の数え直しで直す
+def _remember(sender, instance, **kwargs):
+    instance.__dict__[ORIGINAL_NAMES] = {
+        field.attname: _current_names(instance, field)
+        for field in sender._blob_fields
+        if field.attname in instance.__dict__  # only() で読み込んでいない列は追わない
+    }
+
+
+def _on_save(sender, instance, created, update_fields=None, **kwargs):
+    originals = instance.__dict__.setdefault(ORIGINAL_NAMES, {})
+    added, removed = Counter(), Counter()
+
+    for field in sender._blob_fields:
+        if update_fields is not None and field.name not in update_fields:
+            continue
+        if not created and field.attname not in originals:
+            continue
+
+        old = Counter([] if created else originals[field.attname])
+        new = Counter(_current_names(instance, field))
+        added.update(new - old)
+        removed.update(old - new)
+        originals[field.attname] = list(new.elements())
+
+    add_references(added.elements())
+    remove_references(removed.elements())
+
+
+def _on_delete(sender, instance, **kwargs):
+    remove_references(
+        name for field in sender._blob_fields for name in _current_names(instance, field)
+    )
+
+
+def connect_signals() -> None:
+    fields_by_model = {}
+    for model, field in reference_fields():
+        fields_by_model.setdefault(model, []).append(field)
+
+    for model, fields in fields_by_model.items():
+        model._blob_fields = fields
+        post_init.connect(_remember, sender=model, dispatch_uid=f"blobs_init_{model._meta.label}")
+        post_save.connect(_on_save, sender=model, dispatch_uid=f"blobs_save_{model._meta.label}")
+        post_delete.connect(_on_delete, sender=model, dispatch_uid=f"blobs_delete_{model._meta.label}")
+
+
+# 全モデルの参照を数え直す（gc_blobs から呼ぶ）
+# ずれていた blob の {保存名: 正しい参照数} を返す。`dry_run` なら書き込まない
+def recount_references(dry_run: bool = False) -> dict:
+    counts = Counter()
+    for model, field in reference_fields():
+        rows = model._default_manager.order_by()
+        if isinstance(field, FileField):
+            rows = rows.filter(**{f"{field.attname}__startswith": f"{BLOB_DIR}/"})
+        for value in rows.values_list(field.attname, flat=True).iterator():
+            counts.update(field_names(field, value))
+
+    corrected = {}
+    for blob in MediaBlob.objects.only('pk', 'name', 'ref_count').iterator():
+        actual = counts.get(blob.name, 0)
+        if blob.ref_count == actual:
+            continue
+        if dry_run:
+            corrected[blob.name] = actual
+            continue
+        # 全体を数えている間にシグナルで増減した分を上書きしないよう、
+        # 行をロックしてこの blob だけ数え直してから直す（シグナルの増減はこのロックを待つ）
+        with transaction.atomic():
+            locked = MediaBlob.objects.select_for_update().filter(pk=blob.pk).only('pk', 'ref_count').first()
+            if locked is None:
+                continue
+            actual = count_references(blob.name)
+            if locked.ref_count != actual:
+                MediaBlob.objects.filter(pk=blob.pk).update(ref_count=actual)
+                corrected[blob.name] = actual
+    return corrected
+
+
+# 1つの blob を参照している数
+def count_references(name: str) -> int:
+    total = 0
+    for model, field in reference_fields():
+        rows = model._default_manager.order_by()
+        if isinstance(field, FileField):
+            total += rows.filter(**{field.attname: name}).count()
+            continue
+        values = (
+            rows.annotate(_blob_text=Cast(field.attname, TextField()))
+            .filter(_blob_text__contains=name)
+            .values_list(field.attname, flat=True)
+        )
+        total += sum(field_names(field, value).count(name) for value in values.iterator())
+    return total
@@ -0,0 +1,83 @@
+# blobs/storage.py
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+# 内容アドレスのファイルを置くディレクトリ（MEDIA_ROOT 配下）
+BLOB_DIR = 'blobs'
+
+
+def blob_name(sha256: str, original_name: str) -> str:
+    """
+    "blobs/ab/cd/<sha256>.jpg"。拡張子は元のファイル名から引き継ぐ（配信時の Content-Type 用）
+    """
+    ext = os.path.splitext(original_name or "")[1].lower()[:10]
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def is_blob_name(name) -> bool:
+    return bool(name) and str(name).startswith(f"{BLOB_DIR}/")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    アップロードを読みながら SHA-256 を求め、内容のハッシュを名前にして1回だけ保存する。
+    同じ内容がすでにあればディスクには書かず、既存の名前を返す。
+    参照数は blobs.references がモデルの保存・削除に合わせて数える。
+    blobs/ 以外の名前（導入前に保存したファイル）は通常の FileSystemStorage として扱う。
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # 保存先は _save で内容から決めるので、ここで重複を避ける必要はない
+        return name
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        tmp_dir = self.path(os.path.join(BLOB_DIR, 'tmp'))
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # 一時ファイルへ書きながらハッシュを求める（全体をメモリに載せない）
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            sha256 = digest.hexdigest()
+            blob, created = MediaBlob.objects.get_or_create(
+                sha256=sha256,
+                defaults={'name': blob_name(sha256, name), 'size': size},
+            )
+            if not created:
+                MediaBlob.objects.filter(pk=blob.pk).update(last_saved_at=timezone.now())
+
+            full_path = self.path(blob.name)
+            if os.path.exists(full_path):
+                return blob.name
+
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            os.replace(tmp_path, full_path)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+            return blob.name
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, name):
+        # 他のレコードからも参照されているかもしれないので、ここでは消さない（gc_blobs が消す）
+        if is_blob_name(name):
+            return
+        super().delete(name)
+
+    # gc_blobs 用。参照が無いことを確認済みのファイルを消す
+    def delete_blob(self, name):
+        super().delete(name)
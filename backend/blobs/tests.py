@@ -0,0 +1,73 @@
+import os
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase
+
+from chat.models import Conversation
+from utils.testing import CompanyMemberMixin, TempMediaRootMixin
+from .gc import collect_garbage
+from .references import recount_references
+from .models import MediaBlob
+
+
+class ContentAddressedStorageTests(TempMediaRootMixin, CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+
+    def test_identical_uploads_share_one_blob(self):
+        self.me.iconimg.save('SNOW_1.jpg', ContentFile(b'same bytes'))
+        self.conversation.icon.save('scaled_SNOW_1.jpg', ContentFile(b'same bytes'))
+
+        self.assertEqual(self.me.iconimg.name, self.conversation.icon.name)
+        self.assertTrue(self.me.iconimg.name.startswith('blobs/'))
+        blob = MediaBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.size, len(b'same bytes'))
+
+        # 片方を差し替えても、もう片方が参照している間は残る
+        self.conversation.icon.save('other.png', ContentFile(b'other bytes'))
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+
+        self.me.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+
+    def test_gc_removes_unreferenced_blobs_after_grace(self):
+        self.me.iconimg.save('a.jpg', ContentFile(b'old icon'))
+        old_name = self.me.iconimg.name
+        self.me.iconimg.save('b.jpg', ContentFile(b'new icon'))
+
+        # 猶予期間内は消さない
+        collect_garbage(timedelta(hours=1))
+        self.assertTrue(default_storage.exists(old_name))
+
+        # シグナルを通らない更新でずれた参照数も数え直す
+        MediaBlob.objects.update(ref_count=0)
+        result = collect_garbage(timedelta(0))
+
+        self.assertEqual(result['blobs'], 1)
+        self.assertFalse(default_storage.exists(old_name))
+        self.assertTrue(os.path.exists(default_storage.path(self.me.iconimg.name)))
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+
+    def test_gc_dry_run_writes_nothing(self):
+        self.me.iconimg.save('a.jpg', ContentFile(b'old icon'))
+        old_name = self.me.iconimg.name
+        self.me.iconimg.save('b.jpg', ContentFile(b'new icon'))
+        MediaBlob.objects.update(ref_count=0)
+
+        result = collect_garbage(timedelta(0), dry_run=True)
+
+        self.assertEqual(result['recounted'], 1)
+        self.assertEqual(result['blobs'], 1)
+        self.assertEqual(list(MediaBlob.objects.values_list('ref_count', flat=True)), [0, 0])
+        self.assertTrue(default_storage.exists(old_name))
+
+        # 書き込むときは行ごとに数え直した値で直す
+        self.assertEqual(recount_references(), {self.me.iconimg.name: 1})
+        self.assertEqual(MediaBlob.objects.get(name=self.me.iconimg.name).ref_count, 1)
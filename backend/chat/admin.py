@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import Conversation, Participant, Message, MessageRead, InvitationConversation
+from .models import Conversation, Participant, Message, InvitationConversation, OutboxEvent, FileUpload
 
 admin.site.register(Conversation)
 admin.site.register(Participant)
 admin.site.register(Message)
-admin.site.register(MessageRead)
 admin.site.register(InvitationConversation)
+admin.site.register(OutboxEvent)
+admin.site.register(FileUpload)
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        from .search import ensure_search_triggers
+
+        # SQLite でテーブルを作り直すマイグレーションの後に、検索索引のトリガーを張り直す
+        post_migrate.connect(ensure_search_triggers, sender=self)
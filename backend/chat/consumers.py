@@ -1,6 +1,18 @@
 import json
+import logging
+import uuid
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django_redis import get_redis_connection
+from django.db import transaction
+from . import payloads
+from .models import Conversation, Message, Participant
+from .presence import aregister_connection, arefresh_connection, aunregister_connection
+from .services import publish_new_message, reactivate_participants, record_last_message, user_group_name
+
+logger = logging.getLogger(__name__)
+
+# WebSocket で送れる本文の上限（文字数）
+MAX_MESSAGE_LENGTH = 5000
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -10,12 +22,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.room_group_name = f'chat_{self.room_id}'
 
         if self.user.is_authenticated:
-            # Redis にオンライン状態を記録（有効期限 5分）
-            redis_conn = get_redis_connection('default')
-            # 接続中状態
-            redis_conn.set(f"online_user:{self.user.id}", "1", ex=300)
-            # 特定のチャット画面を開いている状態
-            redis_conn.set(f"chat_open:{self.user.id}", self.room_id, ex=300)
+            # 特定のチャット画面を開いている状態を接続単位で記録
+            await aregister_connection(self.room_id, self.user.id, self.channel_name)
 
         # グループに参加
         await self.channel_layer.group_add(
@@ -27,10 +35,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         if self.user.is_authenticated:
-            # Redis から削除
-            redis_conn = get_redis_connection('default')
-            redis_conn.delete(f"online_user:{self.user.id}")
-            redis_conn.delete(f"chat_open:{self.user.id}")
+            await aunregister_connection(self.room_id, self.user.id, self.channel_name)
 
         # グループから離脱
         await self.channel_layer.group_discard(
@@ -38,15 +43,216 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data or "{}")
+        except json.JSONDecodeError:
+            data = None
+        # 壊れた JSON や、配列・文字列などオブジェクト以外の JSON は受け付けない
+        if not isinstance(data, dict):
+            return await self.send_error(None, "不正なフレームです")
+
+        # ハートビート: 閲覧中エントリの有効期限を延ばす
+        if data.get("type") in ("ping", "heartbeat"):
+            if self.user.is_authenticated:
+                await arefresh_connection(self.room_id, self.user.id, self.channel_name)
+            await self.send(text_data=json.dumps({"type": "pong"}))
+
+        # メッセージ送信: 保存 → ルームへ配信 → 送信元へ ack
+        elif data.get("type") == "send":
+            await self.send_chat_message(data)
+
+    async def send_chat_message(self, data):
+        client_id = data.get("client_id")
+        body = data.get("body")
+        text = body.get("text") if isinstance(body, dict) else body
+
+        if not self.user.is_authenticated:
+            return await self.send_error(client_id, "認証されていません")
+
+        if not isinstance(text, str) or not text.strip():
+            return await self.send_error(client_id, "本文を入力してください")
+
+        if len(text) > MAX_MESSAGE_LENGTH:
+            return await self.send_error(client_id, f"本文は{MAX_MESSAGE_LENGTH}文字以内で入力してください")
+
+        conversation = await (
+            Conversation.objects
+            .filter(
+                id=self.room_id,
+                company_id=self.user.company_id,
+                participants__user=self.user,
+                participants__left_at__isnull=True,
+            )
+            .afirst()
+        )
+        if conversation is None:
+            return await self.send_error(client_id, "この会話に参加していません")
+
+        message, payload = await self.save_message(conversation, text)
+
+        # payload はエンコード済み。再エンコードせずに埋め込む
+        await self.send(text_data=payloads.envelope(
+            {"type": "ack", "client_id": client_id, "id": message.id},
+            "message",
+            payload,
+        ))
+
+    # 参加者の復帰・メッセージ保存・会話の最新メッセージ更新・配信イベントの記録を1トランザクションで行う
+    @database_sync_to_async
+    def save_message(self, conversation, text):
+        with transaction.atomic():
+            partners = reactivate_participants(conversation, self.user)
+            message = Message.objects.create(
+                conversation=conversation,
+                sender=self.user,
+                kind=Message.Kind.TEXT,
+                body={"text": text},
+            )
+            record_last_message(message)
+
+            payload = publish_new_message(
+                message,
+                [partner.user_id for partner in partners],
+                {"user": self.user},
+            )
+        return message, payload
+
+    async def send_error(self, client_id, detail):
+        await self.send(text_data=json.dumps({
+            "type": "error",
+            "client_id": client_id,
+            "detail": detail,
+        }))
+
     async def chat_message(self, event):
-        print("✅ 全体送信: ", event['message'])
-        message = event['message']
+        # publish_new_message でエンコード済みの文字列をそのまま送る
+        text = event['text']
+        logger.debug("chat_message to %s: %d bytes", self.room_group_name, len(text))
 
-        await self.send(text_data=json.dumps(message))
+        await self.send(text_data=text)
 
     async def chat_read(self, event):
+        # 「last_read_id までを既読」のまとめ通知
+        # message_id は1件ずつ通知していた頃のクライアント向けに残している
+        await self.send(text_data=json.dumps({
+            "type": "read",
+            "last_read_id": event["last_read_id"],
+            "message_id": event["last_read_id"],
+            "reader_id": event["reader_id"],
+        }))
+
+
+
+class InboxConsumer(AsyncWebsocketConsumer):
+    """
+    ユーザーごとに1本張る WebSocket（ws/inbox/）
+    参加中の全会話のメッセージ・既読・招待イベントを user_<id> グループで受け取る
+    開いている会話は subscribe で通知すると「閲覧中」として扱われ、届いたメッセージはその場で既読になる
+      {"type": "subscribe", "conversation_id": "..."}
+      {"type": "unsubscribe", "conversation_id": "..."}
+      {"type": "ping"}
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.user_group_name = user_group_name(self.user.id)
+        self.subscriptions = set()
+
+        await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if not self.user.is_authenticated:
+            return
+
+        for conversation_id in self.subscriptions:
+            await aunregister_connection(conversation_id, self.user.id, self.channel_name)
+        self.subscriptions.clear()
+
+        await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data or "{}")
+        except json.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict):
+            return await self.send_error(None, "不正なフレームです")
+
+        frame_type = data.get("type")
+
+        # ハートビート: 閲覧中の会話すべての有効期限を延ばす
+        if frame_type in ("ping", "heartbeat"):
+            for conversation_id in self.subscriptions:
+                await arefresh_connection(conversation_id, self.user.id, self.channel_name)
+            await self.send(text_data=json.dumps({"type": "pong"}))
+
+        elif frame_type == "subscribe":
+            await self.subscribe(data.get("conversation_id"))
+
+        elif frame_type == "unsubscribe":
+            await self.unsubscribe(data.get("conversation_id"))
+
+    async def subscribe(self, conversation_id):
+        try:
+            conversation_id = str(uuid.UUID(str(conversation_id)))
+        except ValueError:
+            return await self.send_error(conversation_id, "不正な会話IDです")
+
+        is_member = await (
+            Participant.objects
+            .filter(conversation_id=conversation_id, user=self.user, left_at__isnull=True)
+            .aexists()
+        )
+        if not is_member:
+            return await self.send_error(conversation_id, "この会話に参加していません")
+
+        await aregister_connection(conversation_id, self.user.id, self.channel_name)
+        self.subscriptions.add(conversation_id)
+
+        await self.send(text_data=json.dumps({"type": "subscribed", "conversation_id": conversation_id}))
+
+    async def unsubscribe(self, conversation_id):
+        try:
+            conversation_id = str(uuid.UUID(str(conversation_id)))
+        except ValueError:
+            return await self.send_error(conversation_id, "不正な会話IDです")
+
+        if conversation_id in self.subscriptions:
+            await aunregister_connection(conversation_id, self.user.id, self.channel_name)
+            self.subscriptions.discard(conversation_id)
+
+        await self.send(text_data=json.dumps({"type": "unsubscribed", "conversation_id": conversation_id}))
+
+    async def send_error(self, conversation_id, detail):
+        await self.send(text_data=json.dumps({
+            "type": "error",
+            "conversation_id": conversation_id,
+            "detail": detail,
+        }))
+
+    # --- サーバー側からのイベント（services.fan_out_to_users） ---
+    async def inbox_message(self, event):
+        # 封筒ごとエンコード済み（publish_new_message）
+        await self.send(text_data=event["text"])
+
+    async def inbox_read(self, event):
         await self.send(text_data=json.dumps({
             "type": "read",
-            "message_id": event["message_id"],
+            "conversation_id": event["conversation_id"],
+            "last_read_id": event["last_read_id"],
             "reader_id": event["reader_id"],
         }))
+
+    async def inbox_invitation(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "invitation",
+            "conversation_id": event["conversation_id"],
+            "title": event["title"],
+            "invited_by": event["invited_by"],
+        }))
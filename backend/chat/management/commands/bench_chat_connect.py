@@ -0,0 +1,90 @@
+import asyncio
+import contextlib
+import io
+import statistics
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from chat.consumers import ChatConsumer
+from chat.presence import register_connection, unregister_connection
+from channels.testing.websocket import WebsocketCommunicator
+
+
+# 比較用: 以前と同じく同期 Redis クライアントをイベントループ上で直接呼ぶ Consumer
+class BlockingPresenceChatConsumer(ChatConsumer):
+    async def connect(self):
+        self.user = self.scope['user']
+        self.room_id = self.scope['url_route']['kwargs']['room_id']
+        self.room_group_name = f'chat_{self.room_id}'
+
+        register_connection(self.room_id, self.user.id, self.channel_name)
+
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        unregister_connection(self.room_id, self.user.id, self.channel_name)
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+
+
+class Command(BaseCommand):
+    help = (
+        "1ワーカー・インメモリ channel layer で WebSocket を大量に同時接続し、"
+        "接続レイテンシのパーセンタイルを同期 Redis 版 / async Redis 版で比較する（要 Redis）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=2000, help="同時に張る接続数")
+        parser.add_argument('--rooms', type=int, default=50, help="接続を振り分ける会話数")
+
+    def handle(self, *args, **options):
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+        with override_settings(CHANNEL_LAYERS=layers):
+            for label, consumer in (
+                ("before (sync redis)", BlockingPresenceChatConsumer),
+                ("after  (redis.asyncio)", ChatConsumer),
+            ):
+                latencies = asyncio.run(self.run(consumer, options['sockets'], options['rooms']))
+                self.report(label, latencies)
+
+    async def run(self, consumer, sockets, rooms):
+        app = consumer.as_asgi()
+        communicators = []
+        latencies = []
+
+        async def open_socket(i):
+            room_id = f"bench-{i % rooms}"
+            communicator = WebsocketCommunicator(app, f"/ws/chat/{room_id}/")
+            communicator.scope['user'] = SimpleNamespace(id=i, is_authenticated=True)
+            communicator.scope['url_route'] = {'kwargs': {'room_id': room_id}}
+
+            started = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=30)
+            latencies.append(time.perf_counter() - started)
+
+            if connected:
+                communicators.append(communicator)
+
+        # Consumer の print を計測結果に混ぜない
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.gather(*(open_socket(i) for i in range(sockets)))
+            await asyncio.gather(*(c.disconnect() for c in communicators))
+
+        return latencies
+
+    def report(self, label, latencies):
+        ordered = sorted(latencies)
+
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+        self.stdout.write(
+            f"{label}: n={len(ordered)} "
+            f"p50={percentile(0.50):.1f}ms p95={percentile(0.95):.1f}ms "
+            f"p99={percentile(0.99):.1f}ms max={ordered[-1] * 1000:.1f}ms "
+            f"mean={statistics.mean(ordered) * 1000:.1f}ms"
+        )
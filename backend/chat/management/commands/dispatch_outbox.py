@@ -0,0 +1,35 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from chat.outbox import BATCH_SIZE, POLL_INTERVAL, RETENTION, dispatch_all, purge_dispatched
+
+
+class Command(BaseCommand):
+    help = (
+        "アウトボックスに溜まった WebSocket 配信イベントを channel layer へ送る。"
+        "送信に失敗したイベントはバックオフして再送する（常駐 or cron で実行）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="溜まっている分を送ったら終了する")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="1回に送るイベント数")
+        parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help="常駐時の確認間隔（秒）")
+        parser.add_argument(
+            '--purge-after', type=int, default=int(RETENTION.total_seconds() // 3600),
+            help="送信済み・諦めたイベントを削除するまでの時間（時間）",
+        )
+
+    def handle(self, *args, **options):
+        purge_after = timedelta(hours=options['purge_after'])
+
+        while True:
+            sent = dispatch_all(options['batch_size'])
+            purged = purge_dispatched(purge_after)
+            if sent or purged:
+                self.stdout.write(f"{sent} 件送信 / {purged} 件削除しました")
+
+            if options['once']:
+                return
+            time.sleep(options['interval'])
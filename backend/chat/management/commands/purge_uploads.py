@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from chat.uploads import purge_stale
+
+
+class Command(BaseCommand):
+    help = "途中で放置された添付ファイルのアップロードと、その途中ファイルを削除する（cron で実行）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help="最後のチャンクから何時間経ったものを削除するか")
+
+    def handle(self, *args, **options):
+        purged = purge_stale(timedelta(hours=options['hours']))
+        self.stdout.write(f"{purged} 件削除しました")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chat.presence import sweep_stale_connections
+
+
+class Command(BaseCommand):
+    help = "ハートビートが途絶えた WebSocket 接続を閲覧中リストから削除する（cron 等で定期実行）"
+
+    def handle(self, *args, **options):
+        removed = sweep_stale_connections()
+        self.stdout.write(f"{removed} 件の接続を削除しました")
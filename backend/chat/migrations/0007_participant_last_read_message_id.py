@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:27
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+# 既存の MessageRead を (会話, ユーザー) ごとの最大 ULID にまとめて既読位置へ移す
+def fold_message_reads(apps, schema_editor):
+    MessageRead = apps.get_model('chat', 'MessageRead')
+    Participant = apps.get_model('chat', 'Participant')
+
+    watermarks = (
+        MessageRead.objects
+        .order_by()
+        .values('user_id', 'message__conversation_id')
+        .annotate(last_read=Max('message_id'))
+    )
+
+    for row in watermarks.iterator():
+        Participant.objects.filter(
+            user_id=row['user_id'],
+            conversation_id=row['message__conversation_id'],
+        ).update(last_read_message_id=row['last_read'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_conv_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='last_read_message_id',
+            field=models.CharField(blank=True, max_length=26, null=True, verbose_name='既読位置'),
+        ),
+        migrations.RunPython(fold_message_reads, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='MessageRead',
+        ),
+    ]
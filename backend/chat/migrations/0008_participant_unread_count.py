@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:33
+
+from django.db import migrations, models
+
+
+# 既存の参加者について、既読位置より後ろのメッセージ数を未読件数として埋める
+def backfill_unread_counts(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    Participant = apps.get_model('chat', 'Participant')
+
+    for participant in Participant.objects.filter(left_at__isnull=True).iterator():
+        messages = (
+            Message.objects
+            .filter(conversation_id=participant.conversation_id, created_at__gte=participant.joined_at)
+            .exclude(sender_id=participant.user_id)
+        )
+        if participant.last_read_message_id:
+            messages = messages.filter(id__gt=participant.last_read_message_id)
+
+        unread = messages.count()
+        if unread:
+            Participant.objects.filter(pk=participant.pk).update(unread_count=unread)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_participant_last_read_message_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='未読件数'),
+        ),
+        migrations.RunPython(backfill_unread_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+# 既存の会話に最新メッセージの情報を埋める（メッセージが無い会話は作成日時）
+def backfill_last_message(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+
+    for conversation in Conversation.objects.iterator():
+        message = (
+            Message.objects
+            .filter(conversation_id=conversation.pk)
+            .order_by('-id')
+            .first()
+        )
+        if message is None:
+            Conversation.objects.filter(pk=conversation.pk).update(last_message_at=conversation.created_at)
+            continue
+
+        body = message.body
+        text = body.get('text') if isinstance(body, dict) else body
+        Conversation.objects.filter(pk=conversation.pk).update(
+            last_message=message,
+            last_message_preview=str(text or '')[:100],
+            last_message_at=message.created_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    # PostgreSQL は同じトランザクションでデータを更新した表に DDL をかけると
+    # "pending trigger events" で失敗する（last_message の FK 制約は遅延チェック）。
+    # 列と索引を先に作り、埋め込みはその後に単独のトランザクションで行う
+    atomic = False
+
+    dependencies = [
+        ('chat', '0008_participant_unread_count'),
+        ('companies', '0003_invitecode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message', verbose_name='最新メッセージ'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='最新メッセージ日時'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='最新メッセージの抜粋'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['company', '-last_message_at'], name='chat_last_message_idx'),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop, atomic=True),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+# 既存 DM に dm_key を振る
+# 同じ2人の DM が重複している場合は最も古い会話だけにキーを付け、残りは NULL のままにする
+def backfill_dm_keys(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Participant = apps.get_model('chat', 'Participant')
+
+    assigned = set()
+    for conversation in Conversation.objects.filter(is_group=False).order_by('created_at').iterator():
+        user_ids = sorted(set(
+            Participant.objects
+            .filter(conversation_id=conversation.pk)
+            .values_list('user_id', flat=True)
+        ))
+        if len(user_ids) != 2:
+            continue
+
+        dm_key = f"{conversation.company_id}:{user_ids[0]}:{user_ids[1]}"
+        if dm_key in assigned:
+            continue
+
+        assigned.add(dm_key)
+        Conversation.objects.filter(pk=conversation.pk).update(dm_key=dm_key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_conversation_last_message'),
+        ('companies', '0003_invitecode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='dm_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='DMキー'),
+        ),
+        migrations.RunPython(backfill_dm_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_group', False)), fields=('dm_key',), name='unique_dm_key'),
+        ),
+    ]
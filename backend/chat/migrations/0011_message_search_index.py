@@ -0,0 +1,90 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:48
+
+from django.db import migrations
+
+
+# SQLite: chat_message の rowid をキーにした FTS5 (trigram) 表をトリガーで同期する
+# 削除済み (deleted_at あり) と本文の無いメッセージは索引に入れない
+# （0017 で message_id をキーにした表へ置き換える。この DDL はこの時点のまま変えないこと）
+SQLITE_SEARCH_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts USING fts5(text, tokenize='trigram')",
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON chat_message
+    WHEN new.deleted_at IS NULL AND json_extract(new.body, '$.text') IS NOT NULL
+    BEGIN
+        INSERT INTO chat_message_fts (rowid, text) VALUES (new.rowid, json_extract(new.body, '$.text'));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF body, deleted_at ON chat_message
+    BEGIN
+        DELETE FROM chat_message_fts WHERE rowid = old.rowid;
+        INSERT INTO chat_message_fts (rowid, text)
+        SELECT new.rowid, json_extract(new.body, '$.text')
+        WHERE new.deleted_at IS NULL AND json_extract(new.body, '$.text') IS NOT NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON chat_message
+    BEGIN
+        DELETE FROM chat_message_fts WHERE rowid = old.rowid;
+    END
+    """,
+    # 既存メッセージを入れ直す
+    "DELETE FROM chat_message_fts",
+    """
+    INSERT INTO chat_message_fts (rowid, text)
+    SELECT rowid, json_extract(body, '$.text') FROM chat_message
+    WHERE deleted_at IS NULL AND json_extract(body, '$.text') IS NOT NULL
+    """,
+]
+
+SQLITE_DROP_SEARCH_INDEX = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TABLE IF EXISTS chat_message_fts",
+]
+
+# PostgreSQL: 本文テキストに pg_trgm の GIN 索引を張り、ILIKE で引く（同期は DB が行う）
+POSTGRES_SEARCH_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS chat_message_text_trgm_idx ON chat_message USING gin ((body ->> 'text') gin_trgm_ops)",
+]
+
+POSTGRES_DROP_SEARCH_INDEX = [
+    "DROP INDEX IF EXISTS chat_message_text_trgm_idx",
+]
+
+
+def _execute_all(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        _execute_all(schema_editor, SQLITE_SEARCH_INDEX)
+    elif vendor == "postgresql":
+        _execute_all(schema_editor, POSTGRES_SEARCH_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        _execute_all(schema_editor, SQLITE_DROP_SEARCH_INDEX)
+    elif vendor == "postgresql":
+        _execute_all(schema_editor, POSTGRES_DROP_SEARCH_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_conversation_dm_key'),
+    ]
+
+    operations = [
+        # SQLite は FTS5 (trigram) + トリガー、PostgreSQL は pg_trgm の GIN 索引
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
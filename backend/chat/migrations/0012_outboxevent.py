@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_message_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.CharField(max_length=100, verbose_name='配信先')),
+                ('payload', models.JSONField(verbose_name='イベント')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='次回送信日時')),
+                ('dispatched_at', models.DateTimeField(blank=True, null=True, verbose_name='送信日時')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='試行回数')),
+                ('last_error', models.TextField(blank=True, verbose_name='最後のエラー')),
+            ],
+            options={
+                'verbose_name': '配信イベント',
+                'verbose_name_plural': '配信イベント',
+                'indexes': [models.Index(condition=models.Q(('dispatched_at__isnull', True)), fields=['available_at', 'id'], name='outbox_pending_idx')],
+            },
+        ),
+    ]
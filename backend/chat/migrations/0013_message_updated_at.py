@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:50
+
+from importlib import import_module
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+# この時点の検索索引（rowid キー）の DDL は 0011 にあるものを使う
+create_search_index = import_module('chat.migrations.0011_message_search_index').create_search_index
+
+
+# 既存メッセージの更新日時は、削除・編集・作成の日時のうち最後のもの
+def backfill_updated_at(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    Message.objects.update(updated_at=Coalesce('deleted_at', 'edited_at', 'created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_outboxevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # SQLite は列の追加・削除で chat_message を作り直すので、検索用のトリガーと FTS 索引が消える
+        # （ロールバック時は列を削除した後に張り直す）
+        migrations.RunPython(migrations.RunPython.noop, create_search_index),
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='更新日時'),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'updated_at', 'id'], name='msg_conv_updated_idx'),
+        ),
+        # 作り直したテーブルにトリガーを張り直し、rowid を振り直した分も索引し直す
+        migrations.RunPython(create_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:52
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_message_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='ファイル名')),
+                ('content_type', models.CharField(blank=True, max_length=100, verbose_name='MIME タイプ')),
+                ('size', models.PositiveBigIntegerField(verbose_name='サイズ（バイト）')),
+                ('received', models.PositiveBigIntegerField(default=0, verbose_name='受信済みバイト数')),
+                ('status', models.CharField(choices=[('uploading', 'アップロード中'), ('completed', '完了')], default='uploading', max_length=10, verbose_name='状態')),
+                ('file', models.FileField(blank=True, upload_to='chat_files/', verbose_name='ファイル')),
+                ('sha256', models.CharField(blank=True, max_length=64, verbose_name='SHA-256')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='chat.conversation', verbose_name='会話')),
+                ('message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message', verbose_name='メッセージ')),
+                ('uploader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_uploads', to=settings.AUTH_USER_MODEL, verbose_name='アップロードしたユーザー')),
+            ],
+            options={
+                'verbose_name': 'ファイルアップロード',
+                'verbose_name_plural': 'ファイルアップロード',
+            },
+        ),
+    ]
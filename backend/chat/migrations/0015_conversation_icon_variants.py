@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_fileupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='icon_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='アイコンの縮小版'),
+        ),
+    ]
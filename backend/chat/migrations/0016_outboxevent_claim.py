@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_conversation_icon_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='claim',
+            field=models.UUIDField(blank=True, db_index=True, editable=False, null=True, verbose_name='送信中の印'),
+        ),
+    ]
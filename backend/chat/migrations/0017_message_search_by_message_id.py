@@ -0,0 +1,93 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# 0011 の rowid キーの索引（ロールバック時に戻す）
+rowid_index = import_module('chat.migrations.0011_message_search_index')
+
+
+# SQLite: FTS5 (trigram) 表を chat_message.id (ULID) で引けるようにする
+#   chat_message_fts_key … message_id → FTS 表の rowid（更新・削除時に索引を引くための対応表）
+#   chat_message_fts     … rowid は対応表の fts_rowid、message_id は UNINDEXED で保持する
+# chat_message の rowid には依存しないので、テーブルを作り直しても索引の中身はずれない
+# （作り直しで消えたトリガーは chat.search.ensure_search_triggers が migrate 後に張り直す）
+SQLITE_CREATE = [
+    "CREATE TABLE chat_message_fts_key (fts_rowid INTEGER PRIMARY KEY, message_id TEXT NOT NULL UNIQUE)",
+    "CREATE VIRTUAL TABLE chat_message_fts USING fts5(message_id UNINDEXED, text, tokenize='trigram')",
+    """
+    CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message
+    WHEN new.deleted_at IS NULL AND json_extract(new.body, '$.text') IS NOT NULL
+    BEGIN
+        INSERT INTO chat_message_fts_key (message_id) VALUES (new.id);
+        INSERT INTO chat_message_fts (rowid, message_id, text)
+        SELECT fts_rowid, new.id, json_extract(new.body, '$.text')
+        FROM chat_message_fts_key WHERE message_id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF body, deleted_at ON chat_message
+    BEGIN
+        DELETE FROM chat_message_fts
+        WHERE rowid = (SELECT fts_rowid FROM chat_message_fts_key WHERE message_id = old.id);
+        DELETE FROM chat_message_fts_key WHERE message_id = old.id;
+        INSERT INTO chat_message_fts_key (message_id)
+        SELECT new.id WHERE new.deleted_at IS NULL AND json_extract(new.body, '$.text') IS NOT NULL;
+        INSERT INTO chat_message_fts (rowid, message_id, text)
+        SELECT fts_rowid, new.id, json_extract(new.body, '$.text')
+        FROM chat_message_fts_key WHERE message_id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message
+    BEGIN
+        DELETE FROM chat_message_fts
+        WHERE rowid = (SELECT fts_rowid FROM chat_message_fts_key WHERE message_id = old.id);
+        DELETE FROM chat_message_fts_key WHERE message_id = old.id;
+    END
+    """,
+    # 既存メッセージを索引する
+    """
+    INSERT INTO chat_message_fts_key (message_id)
+    SELECT id FROM chat_message
+    WHERE deleted_at IS NULL AND json_extract(body, '$.text') IS NOT NULL
+    """,
+    """
+    INSERT INTO chat_message_fts (rowid, message_id, text)
+    SELECT k.fts_rowid, m.id, json_extract(m.body, '$.text')
+    FROM chat_message_fts_key k JOIN chat_message m ON m.id = k.message_id
+    """,
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TABLE IF EXISTS chat_message_fts",
+    "DROP TABLE IF EXISTS chat_message_fts_key",
+]
+
+
+def key_by_message_id(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return  # PostgreSQL の pg_trgm 索引は式索引なのでそのまま
+    for statement in SQLITE_DROP + SQLITE_CREATE:
+        schema_editor.execute(statement)
+
+
+def key_by_rowid(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for statement in SQLITE_DROP:
+        schema_editor.execute(statement)
+    rowid_index.create_search_index(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_outboxevent_claim'),
+    ]
+
+    operations = [
+        migrations.RunPython(key_by_message_id, key_by_rowid),
+    ]
@@ -1,6 +1,7 @@
 import uuid
 from django_ulid.models import ULIDField
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from .fields import ULIDField 
@@ -53,13 +54,54 @@ class Conversation(models.Model):
         help_text=_("グループチャットのアイコン画像。DMでは通常使わない"),
     )
 
+    # 正方形に切り抜いた縮小版（users.avatars）
+    icon_variants = models.JSONField(_("アイコンの縮小版"), default=dict, blank=True, editable=False)
+
+    # DM の正規化キー "<company_id>:<小さい user_id>:<大きい user_id>"（グループは NULL）
+    # 同じ2人の DM を1つに限定し、既存 DM の検索も索引1本で済ませる
+    dm_key = models.CharField(
+        _("DMキー"),
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    # --- 一覧表示用の最新メッセージ（メッセージ作成と同じトランザクションで更新する） ---
+    last_message = models.ForeignKey(
+        "chat.Message",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name=_("最新メッセージ"),
+    )
+
+    last_message_preview = models.CharField(
+        _("最新メッセージの抜粋"),
+        max_length=100,
+        blank=True,
+        default="",
+    )
+
+    # メッセージが無い会話は作成日時を入れておく（一覧の並び順に使う）
+    last_message_at = models.DateTimeField(_("最新メッセージ日時"), default=timezone.now)
+
 
     created_at = models.DateTimeField(_("作成日時"), auto_now_add=True)
     updated_at = models.DateTimeField(_("更新日時"), auto_now=True)
 
+    # 縮小版の保存名も blob の参照として数える
+    blob_json_fields = ("icon_variants",)
+
     def is_dm(self) -> bool:
         return not self.is_group
 
+    @staticmethod
+    def build_dm_key(company_id, user_id, partner_id) -> str:
+        low, high = sorted((int(user_id), int(partner_id)))
+        return f"{company_id}:{low}:{high}"
+
     def __str__(self) -> str:
         return self.title or ("グループ" if self.is_group else "DM")
 
@@ -72,6 +114,16 @@ class Conversation(models.Model):
         indexes = [
             # 会社内で最近更新の会話を引くクエリに効く
             models.Index(fields=("company", "-updated_at"), name="chat_recent_idx"),
+            # 会話一覧（最新メッセージ順）はこの索引だけで並べられる
+            models.Index(fields=("company", "-last_message_at"), name="chat_last_message_idx"),
+        ]
+        constraints = [
+            # 同時に作成されても同じ2人の DM は1つだけ
+            models.UniqueConstraint(
+                fields=["dm_key"],
+                condition=models.Q(is_group=False),
+                name="unique_dm_key",
+            ),
         ]
 
 
@@ -102,6 +154,18 @@ class Participant(models.Model):
     joined_at = models.DateTimeField(_("参加日時"), auto_now_add=True)
     left_at   = models.DateTimeField(_("退出日時"), null=True, blank=True)
 
+    # ここまで読んだメッセージの ULID（前進のみ）
+    # これ以下の ID のメッセージは既読として扱う
+    last_read_message_id = models.CharField(
+        _("既読位置"),
+        max_length=26,
+        null=True,
+        blank=True,
+    )
+
+    # 未読件数（メッセージ作成時に加算・既読時に再計算する非正規化カラム）
+    unread_count = models.PositiveIntegerField(_("未読件数"), default=0)
+
     # ---------------------------------------------------------------------
 
     class Meta:
@@ -177,12 +241,20 @@ class Message(models.Model):
     edited_at  = models.DateTimeField(_("編集日時"), null=True, blank=True)
     deleted_at = models.DateTimeField(_("削除日時"), null=True, blank=True)
 
+    # 差分同期 (changes API) の基準。作成・編集・削除のたびに進める
+    # ※ QuerySet.update() で編集・削除するときは updated_at=timezone.now() も一緒に更新すること
+    updated_at = models.DateTimeField(_("更新日時"), auto_now=True)
+
     class Meta:
         verbose_name = _("メッセージ")
         verbose_name_plural = _("メッセージ")
         ordering = ("-created_at",)                       # 新しい順
         indexes = [
             models.Index(fields=("conversation", "-created_at"), name="msg_conv_time_idx"),
+            # ULID の大小 = 作成順なので、カーソルページングはこの索引だけで引ける
+            models.Index(fields=("conversation", "id"), name="msg_conv_id_idx"),
+            # 差分同期は (updated_at, id) のキーセットで引く
+            models.Index(fields=("conversation", "updated_at", "id"), name="msg_conv_updated_idx"),
         ]
 
     def __str__(self) -> str:
@@ -191,48 +263,6 @@ class Message(models.Model):
 
 
 
-# 既読未読テーブル
-class MessageRead(models.Model):
-    message = models.ForeignKey(
-        "chat.Message",
-        on_delete=models.CASCADE,
-        related_name="read_by",
-        verbose_name=_("メッセージ"),
-    )
-
-    user = models.ForeignKey(
-        settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE,
-        related_name="message_reads",
-        verbose_name=_("ユーザー"),
-    )
-
-    read_at = models.DateTimeField(
-        _("既読時刻"),
-        auto_now_add=True,       # 最初に読んだ瞬間を自動で記録
-    )
-
-    class Meta:
-        verbose_name = _("既読情報")
-        verbose_name_plural = _("既読情報")
-        ordering = ("-read_at",)
-
-        constraints = [
-            models.UniqueConstraint(
-                fields=["message", "user"],
-                name="unique_read_per_user"
-            )
-        ]
-
-        indexes = [
-            models.Index(fields=("message", "user"), name="msgread_msg_user_idx"),
-            models.Index(fields=("user", "message"), name="msgread_user_msg_idx"),
-        ]
-
-    def __str__(self) -> str:
-        return f"{self.user} read {self.message} at {self.read_at:%Y-%m-%d %H:%M:%S}"
-    
-
 # --- グループチャット招待テーブル ---
 class InvitationConversation(models.Model):
     conversation = models.ForeignKey(
@@ -276,3 +306,100 @@ class InvitationConversation(models.Model):
 
     def __str__(self):
         return f"{self.invited_by.username} → {self.invitee.username} @ {self.conversation.title or 'DM'}"
+
+
+# --- WebSocket 配信のアウトボックス ---
+# 配信イベントは DB 更新と同じトランザクションでこの表に書き、コミット後にディスパッチャーが
+# channel layer へ送る（ロールバックされた内容は配信されず、リクエストは Redis を待たない）
+class OutboxEvent(models.Model):
+    # 配信先。channel layer のグループ名 ("chat_<id>", "user_<id>")、
+    # または "members:<conversation_id>"（送信時に参加中ユーザーの user_<id> へ展開する）
+    target = models.CharField(_("配信先"), max_length=100)
+
+    payload = models.JSONField(_("イベント"))
+
+    created_at    = models.DateTimeField(_("作成日時"), auto_now_add=True)
+    available_at  = models.DateTimeField(_("次回送信日時"), default=timezone.now)
+    dispatched_at = models.DateTimeField(_("送信日時"), null=True, blank=True)
+
+    attempts   = models.PositiveSmallIntegerField(_("試行回数"), default=0)
+    last_error = models.TextField(_("最後のエラー"), blank=True)
+
+    # 送信中のディスパッチャーの印。available_at を貸出期限まで進めて取り、送り終えたら消す
+    # （途中で落ちても期限が過ぎれば他のディスパッチャーが拾い直す）
+    claim = models.UUIDField(_("送信中の印"), null=True, blank=True, db_index=True, editable=False)
+
+    class Meta:
+        verbose_name = _("配信イベント")
+        verbose_name_plural = _("配信イベント")
+        indexes = [
+            # 未送信のイベントだけを古い順に拾う
+            models.Index(
+                fields=("available_at", "id"),
+                condition=models.Q(dispatched_at__isnull=True),
+                name="outbox_pending_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.target}: {self.payload.get('type')}"
+
+
+# --- 添付ファイルの分割アップロード ---
+# init → PUT（offset 指定でチャンクを追記）→ finalize の順に進め、完了時に FILE メッセージを作る
+# 途中のファイルは MEDIA_ROOT 配下に置き、中断しても received の位置から再開できる
+class FileUpload(models.Model):
+
+    class Status(models.TextChoices):
+        UPLOADING = "uploading", _("アップロード中")
+        COMPLETED = "completed", _("完了")
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    conversation = models.ForeignKey(
+        "chat.Conversation",
+        on_delete=models.CASCADE,
+        related_name="uploads",
+        verbose_name=_("会話"),
+    )
+
+    uploader = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="chat_uploads",
+        verbose_name=_("アップロードしたユーザー"),
+    )
+
+    filename     = models.CharField(_("ファイル名"), max_length=255)
+    content_type = models.CharField(_("MIME タイプ"), max_length=100, blank=True)
+    size         = models.PositiveBigIntegerField(_("サイズ（バイト）"))
+    received     = models.PositiveBigIntegerField(_("受信済みバイト数"), default=0)
+
+    status = models.CharField(
+        _("状態"),
+        max_length=10,
+        choices=Status.choices,
+        default=Status.UPLOADING,
+    )
+
+    # 完了後に埋める
+    file    = models.FileField(_("ファイル"), upload_to="chat_files/", blank=True)
+    sha256  = models.CharField(_("SHA-256"), max_length=64, blank=True)
+    message = models.ForeignKey(
+        "chat.Message",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name=_("メッセージ"),
+    )
+
+    created_at = models.DateTimeField(_("作成日時"), auto_now_add=True)
+    updated_at = models.DateTimeField(_("更新日時"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("ファイルアップロード")
+        verbose_name_plural = _("ファイルアップロード")
+
+    def __str__(self) -> str:
+        return f"{self.filename} ({self.received}/{self.size})"
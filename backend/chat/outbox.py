@@ -0,0 +1,223 @@
+# chat/outbox.py
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OutboxEvent, Participant
+
+logger = logging.getLogger(__name__)
+
+MEMBERS_PREFIX = "members:"
+
+# 1回に送るイベント数・リトライ間隔の上限・諦めるまでの試行回数
+BATCH_SIZE = getattr(settings, 'CHAT_OUTBOX_BATCH_SIZE', 200)
+MAX_BACKOFF = getattr(settings, 'CHAT_OUTBOX_MAX_BACKOFF', 300)
+MAX_ATTEMPTS = getattr(settings, 'CHAT_OUTBOX_MAX_ATTEMPTS', 10)
+
+# 起こされなくても定期的に見に行く間隔（秒）。リトライ待ちのイベントはこれで拾う
+POLL_INTERVAL = getattr(settings, 'CHAT_OUTBOX_POLL_INTERVAL', 5)
+
+# 取ったイベントの貸出期限（秒）。送信中に落ちたディスパッチャーの分はこの後で拾い直す
+LEASE = getattr(settings, 'CHAT_OUTBOX_LEASE', 60)
+
+# 送信済み・諦めたイベントを残しておく時間と、スレッドが掃除する間隔（秒）
+RETENTION = timedelta(hours=getattr(settings, 'CHAT_OUTBOX_RETENTION_HOURS', 24))
+PURGE_INTERVAL = getattr(settings, 'CHAT_OUTBOX_PURGE_INTERVAL', 600)
+
+
+def members_target(conversation_id) -> str:
+    return f"{MEMBERS_PREFIX}{conversation_id}"
+
+
+# イベントをアウトボックスに積む（呼び出し側のトランザクション内で INSERT 1本）
+def enqueue(events) -> None:
+    """
+    `events` は (配信先, イベント dict) の並び。
+    コミットされたらディスパッチャーを起こす。
+    """
+    rows = [OutboxEvent(target=target, payload=payload) for target, payload in events]
+    if not rows:
+        return
+
+    OutboxEvent.objects.bulk_create(rows)
+    transaction.on_commit(wake_dispatcher)
+
+
+# "members:<conversation_id>" を参加中ユーザーのグループへ展開する（バッチ全体でクエリ1本）
+def expand_targets(events) -> dict:
+    conversation_ids = {
+        event.target[len(MEMBERS_PREFIX):]
+        for event in events
+        if event.target.startswith(MEMBERS_PREFIX)
+    }
+
+    members = defaultdict(list)
+    if conversation_ids:
+        rows = (
+            Participant.objects
+            .filter(conversation_id__in=conversation_ids, left_at__isnull=True)
+            .order_by()
+            .values_list('conversation_id', 'user_id')
+        )
+        for conversation_id, user_id in rows:
+            members[str(conversation_id)].append(f"user_{user_id}")
+
+    groups = {}
+    for event in events:
+        if event.target.startswith(MEMBERS_PREFIX):
+            groups[event.pk] = members[event.target[len(MEMBERS_PREFIX):]]
+        else:
+            groups[event.pk] = [event.target]
+    return groups
+
+
+def claim_pending(batch_size: int = BATCH_SIZE) -> list:
+    """
+    送信待ちのイベントを古い順に最大 `batch_size` 件取る。
+    UPDATE 1本で印と貸出期限 (available_at) を付けるだけなので、送信中に DB のロックを持たない。
+    複数のディスパッチャーが動いていても同じイベントは取り合わない。
+    """
+    now = timezone.now()
+    token = uuid.uuid4()
+    pending = (
+        OutboxEvent.objects
+        .filter(dispatched_at__isnull=True, available_at__lte=now, attempts__lt=MAX_ATTEMPTS)
+        .order_by('available_at', 'id')
+        .values('pk')[:batch_size]
+    )
+    claimed = (
+        OutboxEvent.objects
+        # 他のディスパッチャーが先に取っていたら条件から外れる
+        .filter(pk__in=pending, dispatched_at__isnull=True, available_at__lte=now)
+        .update(claim=token, available_at=now + timedelta(seconds=LEASE))
+    )
+    if not claimed:
+        return []
+    return list(OutboxEvent.objects.filter(claim=token).order_by('id'))
+
+
+def dispatch_pending(batch_size: int = BATCH_SIZE) -> int:
+    """
+    送信待ちのイベントを最大 `batch_size` 件 channel layer へ送る。
+    取る・送る・結果を書く の3段に分け、Redis を待つ間はトランザクションの外にいる。
+    失敗したイベントは指数バックオフで後回しにし、MAX_ATTEMPTS 回で諦める。
+    処理した件数を返す。
+    """
+    events = claim_pending(batch_size)
+    if not events:
+        return 0
+
+    groups = expand_targets(events)
+    channel_layer = get_channel_layer()
+    failures = {}
+
+    async def send_batch():
+        for event in events:
+            try:
+                for group in groups[event.pk]:
+                    await channel_layer.group_send(group, event.payload)
+            except Exception as exc:  # Redis 停止など。イベント単位でやり直す
+                failures[event.pk] = exc
+
+    async_to_sync(send_batch)()
+
+    now = timezone.now()
+    with transaction.atomic():
+        # 貸出期限が切れて他のディスパッチャーに取られた分は書き換えない
+        claimed = OutboxEvent.objects.filter(claim=events[0].claim)
+
+        sent = [event.pk for event in events if event.pk not in failures]
+        if sent:
+            claimed.filter(pk__in=sent).update(dispatched_at=now, claim=None)
+
+        for event in events:
+            exc = failures.get(event.pk)
+            if exc is None:
+                continue
+            attempts = event.attempts + 1
+            if attempts >= MAX_ATTEMPTS:
+                # 諦めたイベントは送信待ちから外れ、purge_dispatched で消える
+                logger.error("outbox event %s given up after %s attempts: %s", event.pk, attempts, exc)
+            else:
+                logger.warning("outbox event %s failed (attempt %s): %s", event.pk, attempts, exc)
+            claimed.filter(pk=event.pk).update(
+                attempts=attempts,
+                available_at=now + timedelta(seconds=min(2 ** event.attempts, MAX_BACKOFF)),
+                last_error=repr(exc)[:1000],
+                claim=None,
+            )
+
+    return len(events)
+
+
+def dispatch_all(batch_size: int = BATCH_SIZE) -> int:
+    total = 0
+    while True:
+        count = dispatch_pending(batch_size)
+        total += count
+        if count < batch_size:
+            return total
+
+
+# 送信済みイベントと、諦めたイベントの掃除
+def purge_dispatched(older_than: timedelta = None) -> int:
+    cutoff = timezone.now() - (RETENTION if older_than is None else older_than)
+    deleted, _ = OutboxEvent.objects.filter(
+        Q(dispatched_at__lt=cutoff)
+        | Q(dispatched_at__isnull=True, attempts__gte=MAX_ATTEMPTS, created_at__lt=cutoff)
+    ).delete()
+    return deleted
+
+
+# --- プロセス内のディスパッチャー（バックグラウンドスレッド） ---
+# CHAT_OUTBOX_DISPATCH
+#   "thread" … コミット時にスレッドを起こして送る（既定）
+#   "inline" … コミット時にその場で送る（テスト・開発用）
+#   "command" … 何もしない。manage.py dispatch_outbox に任せる
+_wakeup = threading.Event()
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def wake_dispatcher() -> None:
+    mode = getattr(settings, 'CHAT_OUTBOX_DISPATCH', 'thread')
+
+    if mode == 'inline':
+        dispatch_all()
+    elif mode == 'thread':
+        _ensure_thread()
+        _wakeup.set()
+
+
+def _ensure_thread() -> None:
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run_dispatcher, name="chat-outbox", daemon=True)
+            _thread.start()
+
+
+def _run_dispatcher() -> None:
+    purged_at = 0.0
+    while True:
+        _wakeup.wait(timeout=POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            dispatch_all()
+            if time.monotonic() - purged_at >= PURGE_INTERVAL:
+                purged_at = time.monotonic()
+                purge_dispatched()
+        except Exception:
+            logger.exception("outbox dispatcher failed")
+        finally:
+            close_old_connections()
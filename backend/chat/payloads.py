@@ -0,0 +1,19 @@
+# chat/payloads.py
+import orjson
+
+# 配信するメッセージは1回だけ JSON 文字列にし、REST のレスポンス・各 WebSocket へ同じ文字列を流す
+# orjson は datetime / UUID をそのまま扱えるので default=str の往復変換が要らない
+
+
+def encode(data) -> str:
+    return orjson.dumps(data, default=str).decode()
+
+
+def envelope(fields: dict, key: str, encoded: str) -> str:
+    """
+    エンコード済みの JSON 文字列 `encoded` を `key` に埋め込んだオブジェクトを作る。
+    `encoded` はデコード・再エンコードせず、文字列のまま連結する。
+    """
+    head = orjson.dumps(fields).decode()
+    separator = "," if len(head) > 2 else ""
+    return f'{head[:-1]}{separator}{encode(key)}:{encoded}}}'
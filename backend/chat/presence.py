@@ -0,0 +1,124 @@
+# chat/presence.py
+import asyncio
+import time
+import weakref
+from typing import Iterable, List
+
+import redis.asyncio as aioredis
+from django.conf import settings
+from django_redis import get_redis_connection
+
+# 会話ごとに「チャット画面を開いている接続」を sorted set で持つ
+#   member = "<user_id>:<channel_name>"（接続単位）
+#   score  = 最後にハートビートを受け取った UNIX 時刻
+# 同じユーザーが複数端末・複数タブで開いていても接続ごとに別エントリになるので、
+# どれか1本でも生きていれば「閲覧中」として扱える（参照カウントの代わり）
+PRESENCE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL', 90)
+
+# 接続エントリを持っている会話の一覧（掃除用）
+ROOMS_KEY = "chat_viewer_rooms"
+
+
+# Consumer (async) 用の Redis クライアント
+# イベントループごとに1つの接続プールを共有し、接続・切断でループを止めない
+# 同時接続が上限を超えたらエラーにせず空きを待つ (BlockingConnectionPool)
+PRESENCE_REDIS_URL = getattr(settings, 'CHAT_PRESENCE_REDIS_URL', settings.CACHES['default']['LOCATION'])
+PRESENCE_REDIS_MAX_CONNECTIONS = getattr(settings, 'CHAT_PRESENCE_REDIS_MAX_CONNECTIONS', 50)
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool = aioredis.BlockingConnectionPool.from_url(
+            PRESENCE_REDIS_URL,
+            max_connections=PRESENCE_REDIS_MAX_CONNECTIONS,
+        )
+        client = aioredis.Redis(connection_pool=pool)
+        _async_clients[loop] = client
+    return client
+
+
+def viewers_key(conversation_id) -> str:
+    return f"chat_viewers:{conversation_id}"
+
+
+def connection_member(user_id: int, channel_name: str) -> str:
+    return f"{user_id}:{channel_name}"
+
+
+def register_connection(conversation_id, user_id: int, channel_name: str) -> None:
+    redis_conn = get_redis_connection('default')
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.zadd(viewers_key(conversation_id), {connection_member(user_id, channel_name): time.time()})
+    pipe.sadd(ROOMS_KEY, str(conversation_id))
+    pipe.execute()
+
+
+# ハートビート受信時。スコアを現在時刻に更新する
+refresh_connection = register_connection
+
+
+def unregister_connection(conversation_id, user_id: int, channel_name: str) -> None:
+    redis_conn = get_redis_connection('default')
+    redis_conn.zrem(viewers_key(conversation_id), connection_member(user_id, channel_name))
+
+
+# --- async 版（ChatConsumer から使う） ---
+async def aregister_connection(conversation_id, user_id: int, channel_name: str) -> None:
+    pipe = get_async_redis().pipeline(transaction=False)
+    pipe.zadd(viewers_key(conversation_id), {connection_member(user_id, channel_name): time.time()})
+    pipe.sadd(ROOMS_KEY, str(conversation_id))
+    await pipe.execute()
+
+
+arefresh_connection = aregister_connection
+
+
+async def aunregister_connection(conversation_id, user_id: int, channel_name: str) -> None:
+    await get_async_redis().zrem(viewers_key(conversation_id), connection_member(user_id, channel_name))
+
+
+# 指定ユーザーのうち、会話を開いている人だけを返す（Redis往復1回）
+def get_viewing_users(conversation_id, user_ids: Iterable[int]) -> List[int]:
+    user_ids = list(user_ids)
+    if not user_ids:
+        return []
+
+    redis_conn = get_redis_connection('default')
+    # TTL 内にハートビートがあった接続だけを見る（掃除前の死んだ接続は無視される）
+    members = redis_conn.zrangebyscore(viewers_key(conversation_id), time.time() - PRESENCE_TTL, '+inf')
+    viewers = {int(member.split(b':', 1)[0]) for member in members}
+    return [user_id for user_id in user_ids if user_id in viewers]
+
+
+def is_viewing(conversation_id, user_id: int) -> bool:
+    return bool(get_viewing_users(conversation_id, [user_id]))
+
+
+# ハートビートが途絶えた接続を削除する（manage.py sweep_chat_presence から定期実行）
+def sweep_stale_connections() -> int:
+    redis_conn = get_redis_connection('default')
+    rooms = [room.decode() for room in redis_conn.smembers(ROOMS_KEY)]
+    if not rooms:
+        return 0
+
+    threshold = time.time() - PRESENCE_TTL
+    pipe = redis_conn.pipeline(transaction=False)
+    for room in rooms:
+        pipe.zremrangebyscore(viewers_key(room), '-inf', threshold)
+        pipe.zcard(viewers_key(room))
+    results = pipe.execute()
+
+    removed = 0
+    empty_rooms = []
+    for room, (swept, remaining) in zip(rooms, zip(results[::2], results[1::2])):
+        removed += swept
+        if remaining == 0:
+            empty_rooms.append(room)
+
+    if empty_rooms:
+        redis_conn.srem(ROOMS_KEY, *empty_rooms)
+    return removed
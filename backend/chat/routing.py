@@ -3,4 +3,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'^ws/chat/(?P<room_id>[^/]+)/$', consumers.ChatConsumer.as_asgi()),
+    # 参加中の全会話のイベントを1本で受け取る
+    re_path(r'^ws/inbox/$', consumers.InboxConsumer.as_asgi()),
 ]
@@ -0,0 +1,272 @@
+# chat/search.py
+import html
+from typing import List, NamedTuple, Optional
+
+from django.db import connection, connections
+from django.db.models import Exists, OuterRef
+from django.db.models.fields.json import KeyTextTransform
+
+from .models import Conversation, Message, Participant
+
+# FTS5 trigram / pg_trgm は3文字単位で索引するので、それより短い語（「現場」「会議」など）は
+# 索引で引けない。長い語があれば索引で絞った結果に LIKE をかけ、短い語だけなら
+# 自分の参加中の会話の参加後のメッセージだけを (conversation, created_at) の索引で走査する
+MIN_INDEXED_LENGTH = 3
+
+SNIPPET_RADIUS = 20
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+
+# FTS5 の snippet() に渡す目印。本文をエスケープした後で <mark> に置き換える
+# （本文に含まれていても <mark> がずれるだけで、タグは増やせない）
+_SNIPPET_START = "\x02"
+_SNIPPET_END = "\x03"
+
+
+class SearchHit(NamedTuple):
+    message_id: str
+    snippet: str
+
+
+def make_snippet(text: str, term: str, radius: int = SNIPPET_RADIUS) -> str:
+    """
+    最初に一致した箇所の前後だけを切り出し、一致部分を <mark> で囲む。
+    本文は HTML エスケープする（<mark> 以外のタグは含まない）
+    """
+    text = text or ""
+    position = text.lower().find(term.lower())
+    if position < 0:
+        return html.escape(text[:radius * 2])
+
+    start = max(0, position - radius)
+    end = min(len(text), position + len(term) + radius)
+    return (
+        ("…" if start > 0 else "")
+        + html.escape(text[start:position])
+        + HIGHLIGHT_START + html.escape(text[position:position + len(term)]) + HIGHLIGHT_END
+        + html.escape(text[position + len(term):end])
+        + ("…" if end < len(text) else "")
+    )
+
+
+def _markup_fts_snippet(snippet: str) -> str:
+    return (
+        html.escape(snippet or "")
+        .replace(_SNIPPET_START, HIGHLIGHT_START)
+        .replace(_SNIPPET_END, HIGHLIGHT_END)
+    )
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_messages(
+    user,
+    query: str,
+    before: Optional[str] = None,
+    limit: int = 20,
+    conversation_id=None,
+) -> List[SearchHit]:
+    """
+    `user` が参加中（参加後に届いた分のみ）の会話からメッセージを新しい順に検索する。
+    `before` (ULID) より古いものを最大 `limit` 件返す。
+    空白区切りの語はすべて含むもの (AND) だけを返す。
+    """
+    terms = query.split()
+    if not terms:
+        return []
+
+    indexed = [term for term in terms if len(term) >= MIN_INDEXED_LENGTH]
+    short = [term for term in terms if len(term) < MIN_INDEXED_LENGTH]
+
+    if connection.vendor == "sqlite":
+        if indexed:
+            return _search_sqlite_fts(user, indexed, short, before, limit, conversation_id)
+        return _search_scoped_scan(user, terms, before, limit, conversation_id)
+    if connection.vendor == "postgresql":
+        if indexed:
+            return _search_postgres_trgm(user, terms, before, limit, conversation_id)
+        return _search_scoped_scan(user, terms, before, limit, conversation_id)
+
+    return _search_like(user, terms, before, limit, conversation_id)
+
+
+# 参加中の会話・参加後のメッセージに絞る条件（生 SQL 用）
+def _scope_sql(user, before, limit, conversation_id):
+    where = [
+        "p.user_id = %s",
+        "p.left_at IS NULL",
+        "m.created_at >= p.joined_at",
+        "m.deleted_at IS NULL",
+    ]
+    params = [user.id]
+
+    if conversation_id:
+        where.append("m.conversation_id = %s")
+        params.append(Conversation._meta.pk.get_db_prep_value(conversation_id, connection))
+    if before:
+        where.append("m.id < %s")
+        params.append(before)
+
+    join = "JOIN chat_participant p ON p.conversation_id = m.conversation_id"
+    tail = "ORDER BY m.id DESC LIMIT %s"
+    return join, " AND ".join(where), params, tail, [limit]
+
+
+def _text_sql():
+    if connection.vendor == "postgresql":
+        return "(m.body ->> 'text')", "ILIKE"
+    return "json_extract(m.body, '$.text')", "LIKE"
+
+
+def _contains_sql(terms):
+    """各語を含む条件（大小文字は区別しない）"""
+    text, like = _text_sql()
+    conditions = [f"{text} {like} %s ESCAPE '\\'" for _ in terms]
+    return conditions, [f"%{escape_like(term)}%" for term in terms]
+
+
+def _search_sqlite_fts(user, terms, short_terms, before, limit, conversation_id):
+    join, where, params, tail, tail_params = _scope_sql(user, before, limit, conversation_id)
+
+    # 各語をフレーズとして引用し AND 検索（trigram なので語の途中でも一致する）
+    match = " AND ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+    # 索引で引けない短い語は、索引で絞った行に LIKE をかける
+    contains, contains_params = _contains_sql(short_terms)
+    where = " AND ".join([where, *contains])
+
+    sql = f"""
+        SELECT m.id, snippet(chat_message_fts, 1, %s, %s, '…', 16)
+        FROM chat_message_fts
+        JOIN chat_message m ON m.id = chat_message_fts.message_id
+        {join}
+        WHERE chat_message_fts MATCH %s AND {where}
+        {tail}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [_SNIPPET_START, _SNIPPET_END, match, *params, *contains_params, *tail_params])
+        return [SearchHit(message_id, _markup_fts_snippet(snippet)) for message_id, snippet in cursor.fetchall()]
+
+
+def _search_postgres_trgm(user, terms, before, limit, conversation_id):
+    join, where, params, tail, tail_params = _scope_sql(user, before, limit, conversation_id)
+
+    # chat_message_text_trgm_idx (GIN, gin_trgm_ops) で ILIKE を引く（短い語は絞った行へのフィルタになる）
+    text, _ = _text_sql()
+    contains, contains_params = _contains_sql(terms)
+
+    sql = f"""
+        SELECT m.id, {text}
+        FROM chat_message m
+        {join}
+        WHERE {" AND ".join(contains)} AND {where}
+        {tail}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*contains_params, *params, *tail_params])
+        return [
+            SearchHit(message_id, make_snippet(body_text, terms[0]))
+            for message_id, body_text in cursor.fetchall()
+        ]
+
+
+def _search_scoped_scan(user, terms, before, limit, conversation_id):
+    """
+    短い語だけの検索。自分の参加行から会話ごとに (conversation, created_at) の索引で
+    参加後のメッセージを引き、本文に LIKE をかける（他人の会話のメッセージは読まない）
+    """
+    _, where, params, tail, tail_params = _scope_sql(user, before, limit, conversation_id)
+    text, _ = _text_sql()
+    contains, contains_params = _contains_sql(terms)
+
+    # SQLite の CROSS JOIN は左の表を外側のループに固定する（参加行 → メッセージの順に引かせる）
+    join = "CROSS JOIN" if connection.vendor == "sqlite" else "JOIN"
+    sql = f"""
+        SELECT m.id, {text}
+        FROM chat_participant p
+        {join} chat_message m
+        WHERE m.conversation_id = p.conversation_id AND {where} AND {" AND ".join(contains)}
+        {tail}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*params, *contains_params, *tail_params])
+        return [
+            SearchHit(message_id, make_snippet(body_text, terms[0]))
+            for message_id, body_text in cursor.fetchall()
+        ]
+
+
+# その他の DB 用
+def _search_like(user, terms, before, limit, conversation_id):
+    joined = Participant.objects.filter(
+        user=user,
+        left_at__isnull=True,
+        conversation_id=OuterRef('conversation_id'),
+        joined_at__lte=OuterRef('created_at'),
+    )
+    messages = (
+        Message.objects
+        .filter(Exists(joined), deleted_at__isnull=True)
+        .annotate(text=KeyTextTransform('text', 'body'))
+    )
+    for term in terms:
+        messages = messages.filter(text__icontains=term)
+    if conversation_id:
+        messages = messages.filter(conversation_id=conversation_id)
+    if before:
+        messages = messages.filter(id__lt=before)
+
+    rows = messages.order_by('-id').values_list('id', 'text')[:limit]
+    return [SearchHit(message_id, make_snippet(text, terms[0])) for message_id, text in rows]
+
+
+# --- 索引の同期トリガー（SQLite） ---
+# 索引の表はマイグレーション (0011, 0017) が作る。SQLite は列の変更などで chat_message を
+# 作り直すとトリガーが消えるので、migrate のたびに無ければ張り直す（post_migrate）。
+# 索引は message_id で引くので、作り直しの前後で中身はずれない
+SQLITE_SEARCH_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON chat_message
+    WHEN new.deleted_at IS NULL AND json_extract(new.body, '$.text') IS NOT NULL
+    BEGIN
+        INSERT INTO chat_message_fts_key (message_id) VALUES (new.id);
+        INSERT INTO chat_message_fts (rowid, message_id, text)
+        SELECT fts_rowid, new.id, json_extract(new.body, '$.text')
+        FROM chat_message_fts_key WHERE message_id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF body, deleted_at ON chat_message
+    BEGIN
+        DELETE FROM chat_message_fts
+        WHERE rowid = (SELECT fts_rowid FROM chat_message_fts_key WHERE message_id = old.id);
+        DELETE FROM chat_message_fts_key WHERE message_id = old.id;
+        INSERT INTO chat_message_fts_key (message_id)
+        SELECT new.id WHERE new.deleted_at IS NULL AND json_extract(new.body, '$.text') IS NOT NULL;
+        INSERT INTO chat_message_fts (rowid, message_id, text)
+        SELECT fts_rowid, new.id, json_extract(new.body, '$.text')
+        FROM chat_message_fts_key WHERE message_id = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON chat_message
+    BEGIN
+        DELETE FROM chat_message_fts
+        WHERE rowid = (SELECT fts_rowid FROM chat_message_fts_key WHERE message_id = old.id);
+        DELETE FROM chat_message_fts_key WHERE message_id = old.id;
+    END
+    """,
+]
+
+
+def ensure_search_triggers(using="default", **kwargs) -> None:
+    db = connections[using]
+    if db.vendor != "sqlite":
+        return
+    # 0017 より前の状態（ロールバック中など）では何もしない
+    if "chat_message_fts_key" not in db.introspection.table_names():
+        return
+    with db.cursor() as cursor:
+        for statement in SQLITE_SEARCH_TRIGGERS:
+            cursor.execute(statement)
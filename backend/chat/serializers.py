@@ -1,10 +1,20 @@
 from rest_framework import serializers
-from .models import Conversation, Participant, Message, MessageRead, InvitationConversation
+from . import uploads
+from .models import Conversation, Participant, Message, InvitationConversation, FileUpload
+from .services import ReadStateResolver
+from users.avatars import CONVERSATION_ICON_VARIANTS, AvatarField
 from users.serializers import SimpleUserSerializer
 
 
+# 作成した会話のアイコンの縮小版をコミット後に作る（DM の get_or_create からも使う）
+def schedule_icon_variants(conversation) -> None:
+    if conversation.icon:
+        CONVERSATION_ICON_VARIANTS.schedule([conversation])
+
+
 class ConversationSerializer(serializers.ModelSerializer):
-    icon = serializers.ImageField(required=False, allow_null=True)
+    # 読み出しは正方形の小さい縮小版（まだ無ければ元画像）
+    icon = AvatarField(required=False, allow_null=True)
     partner_user = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
 
@@ -42,13 +52,18 @@ class ConversationSerializer(serializers.ModelSerializer):
         request = self.context["request"]
         validated_data["company"] = request.user.company
 
-        return super().create(validated_data)
+        conversation = super().create(validated_data)
+        schedule_icon_variants(conversation)
+        return conversation
 
     def update(self, instance, validated_data):
         if not instance.is_group and validated_data.get("is_group", False):
             raise serializers.ValidationError("DM をグループチャットに変更することはできません。")
 
-        return super().update(instance, validated_data)
+        conversation = super().update(instance, validated_data)
+        if "icon" in validated_data:
+            CONVERSATION_ICON_VARIANTS.schedule([conversation])
+        return conversation
     
     def get_partner_user(self, obj):
         is_group = obj.get('is_group') if isinstance(obj, dict) else obj.is_group
@@ -62,19 +77,24 @@ class ConversationSerializer(serializers.ModelSerializer):
         if isinstance(obj, dict):
             return None
 
-        # 自分以外の参加者を取得
-        partner = obj.participants.exclude(user=me).first()
+        # 会話一覧では Prefetch(to_attr='other_participants') 済みなので追加クエリなし
+        others = getattr(obj, 'other_participants', None)
+        if others is not None:
+            partner = others[0] if others else None
+        else:
+            # 自分以外の参加者を取得
+            partner = obj.participants.select_related('user').exclude(user=me).first()
         if partner:
             return SimpleUserSerializer(partner.user, context=self.context).data
         return None
     
     def get_last_message(self, obj):
-        body = getattr(obj, 'last_message_content', None)
-        if isinstance(body, dict):
-            body = body.get("text")  # ✅ 'text' フィールドを抽出
+        # メッセージ作成時に会話へ書き込んだ抜粋を返す（メッセージ表は引かない）
+        if not obj.last_message_id:
+            return {"content": None, "created_at": None}
         return {
-            "content": body,
-            "created_at": getattr(obj, 'last_message_created_at', None),
+            "content": obj.last_message_preview,
+            "created_at": obj.last_message_at,
         }
 
     
@@ -84,9 +104,10 @@ class ConversationWrapperSerializer(serializers.Serializer):
     conversation = ConversationSerializer()
     is_invited = serializers.BooleanField()
     invited_by = SimpleUserSerializer(required=False)
+    unread_count = serializers.IntegerField(default=0)
 
     class Meta:
-        fields = ['conversation', 'is_invited', 'invited_by']
+        fields = ['conversation', 'is_invited', 'invited_by', 'unread_count']
 
 
 
@@ -141,20 +162,27 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ('id', 'conversation', 'sender', 'kind', 'body', 'created_at', 'is_read', 'read_users')
         read_only_fields = ('id', 'sender', 'created_at')
 
+    # 既読位置は会話ごとに1回だけ読み込み、メッセージ単位ではクエリを発行しない
+    def get_read_state(self, obj):
+        resolvers = self.context.setdefault('read_states', {})
+        if obj.conversation_id not in resolvers:
+            resolvers[obj.conversation_id] = ReadStateResolver(obj.conversation_id)
+        return resolvers[obj.conversation_id]
+
+    # REST では request.user、WebSocket からは context['user'] が閲覧者
+    def get_viewer(self):
+        request = self.context.get('request')
+        return request.user if request else self.context['user']
+
     def get_is_read(self, obj):
-        user = self.context['request'].user
-        partner = obj.conversation.participants.exclude(user=user).first()
-        if partner is None:
-            return False
-        return MessageRead.objects.filter(message=obj, user=partner.user).exists()
+        user = self.get_viewer()
+        return self.get_read_state(obj).is_read(obj, user.id)
         
     def get_read_users(self, obj):
         if obj is None:
             return []
-        
-        return list(
-            MessageRead.objects.filter(message=obj).values_list('user__id', flat=True)
-        )
+
+        return self.get_read_state(obj).read_users(obj)
 
     def create(self, validated_data):
         request = self.context['request']
@@ -175,14 +203,6 @@ class MessageSerializer(serializers.ModelSerializer):
     
 
 
-class MessageReadSirializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = MessageRead
-        fields = ('message', 'user', 'read_at')
-        read_only_fields = ('message', 'user', 'read_at',)
-        
-
 # post用
 class InvitationConversationSerializer(serializers.Serializer):
     partners = serializers.ListField(
@@ -195,3 +215,27 @@ class InvitationUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = InvitationConversation
         fields = ['is_participated']
+
+
+# 分割アップロードの開始・状態確認
+class FileUploadSerializer(serializers.ModelSerializer):
+    offset = serializers.IntegerField(source='received', read_only=True)
+    chunk_size = serializers.SerializerMethodField()
+
+    class Meta:
+        model = FileUpload
+        fields = ('id', 'filename', 'content_type', 'size', 'offset', 'chunk_size', 'status', 'created_at')
+        read_only_fields = ('id', 'status', 'created_at')
+
+    def get_chunk_size(self, obj):
+        return uploads.CHUNK_SIZE
+
+    def validate_filename(self, value):
+        return uploads.clean_filename(value)
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("空のファイルはアップロードできません")
+        if value > uploads.MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(f"{uploads.MAX_UPLOAD_SIZE // (1024 * 1024)}MB 以下のファイルを選択してください")
+        return value
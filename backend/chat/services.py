@@ -0,0 +1,283 @@
+# chat/services.py
+import logging
+
+import orjson
+from redis.exceptions import RedisError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import payloads
+from .models import Conversation, Message, Participant
+from .outbox import enqueue, members_target
+from .presence import get_viewing_users
+from users.serializers import SimpleUserSerializer
+
+logger = logging.getLogger(__name__)
+
+
+# メッセージ一覧の既読判定用（参加者の既読位置をまとめて読み込む）
+class ReadStateResolver:
+    """
+    会話の参加者と既読位置をクエリ1本で読み込み、
+    各メッセージの既読者はメモリ上で ULID を比較して求める。
+    """
+
+    def __init__(self, conversation_id):
+        self.participants = list(
+            Participant.objects
+            .filter(conversation_id=conversation_id, last_read_message_id__isnull=False)
+            .order_by('joined_at')
+            .values('user_id', 'joined_at', 'last_read_message_id')
+        )
+
+    def read_users(self, message) -> list:
+        return [
+            p['user_id'] for p in self.participants
+            if p['last_read_message_id'] >= message.id
+            and p['joined_at'] <= message.created_at
+            and p['user_id'] != message.sender_id
+        ]
+
+    def is_read(self, message, viewer_id) -> bool:
+        return any(user_id != viewer_id for user_id in self.read_users(message))
+
+
+# 既読位置より後ろにある、自分以外が送ったメッセージの件数（Participant 行ごとの相関サブクエリ）
+def unread_after(up_to: str):
+    return Coalesce(
+        Subquery(
+            Message.objects
+            .filter(
+                conversation_id=OuterRef('conversation_id'),
+                id__gt=up_to,
+                created_at__gte=OuterRef('joined_at'),
+            )
+            .exclude(sender_id=OuterRef('user_id'))
+            .order_by()
+            .values('conversation_id')
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+# 既読位置を前進させる（後退はさせない）
+def advance_read_watermark(participants, up_to: str) -> int:
+    """
+    `participants` (Participant の QuerySet) の既読位置を `up_to` (ULID) まで進め、
+    未読件数も同じ UPDATE 1本で数え直す。
+    すでに `up_to` 以上を読んでいる参加者は変更しない。
+    戻り値は既読位置が進んだ参加者数。
+    """
+    return (
+        participants
+        .filter(Q(last_read_message_id__isnull=True) | Q(last_read_message_id__lt=up_to))
+        .update(last_read_message_id=up_to, unread_count=unread_after(up_to))
+    )
+
+
+# 新着メッセージ分の未読件数を加算する
+def increment_unread(conversation_id, user_ids) -> int:
+    if not user_ids:
+        return 0
+    return (
+        Participant.objects
+        .filter(conversation_id=conversation_id, user_id__in=user_ids, left_at__isnull=True)
+        .update(unread_count=F('unread_count') + 1)
+    )
+
+
+# ユーザー単位のグループ名（InboxConsumer が接続時に参加する）
+def user_group_name(user_id) -> str:
+    return f"user_{user_id}"
+
+
+# 指定ユーザーの inbox ソケットへイベントを配る（アウトボックス経由・コミット後に送信）
+def fan_out_to_users(user_ids, event: dict) -> None:
+    enqueue([(user_group_name(user_id), event) for user_id in set(user_ids)])
+
+
+# 会話を開いたときの既読処理（まとめて1回で記録・通知する）
+def mark_conversation_read(user, participant, up_to: str) -> bool:
+    """
+    `up_to` (ULID) 以前のメッセージをまとめて既読にする。
+    既読位置の更新は UPDATE 1本、WebSocket通知も
+    「<up_to> までを既読」の1イベントだけ送る。
+    既読位置が進んだ場合に True を返す。
+    """
+    advanced = advance_read_watermark(
+        Participant.objects.filter(pk=participant.pk), up_to
+    )
+
+    if not advanced:
+        return False
+
+    participant.last_read_message_id = up_to
+
+    conversation_id = participant.conversation_id
+    enqueue([
+        (f"chat_{conversation_id}", {
+            "type": "chat.read",
+            "last_read_id": up_to,
+            "reader_id": user.id,
+        }),
+        # 会話の参加者全員（自分の他端末を含む）の inbox へ。既読表示と未読バッジの更新用
+        (members_target(conversation_id), {
+            "type": "inbox.read",
+            "conversation_id": str(conversation_id),
+            "last_read_id": up_to,
+            "reader_id": user.id,
+        }),
+    ])
+    return True
+
+
+# 送信者以外の参加者を返す。チャットを削除（退出）していた参加者は復帰させる
+def reactivate_participants(conversation, sender) -> list:
+    partners = list(conversation.participants.exclude(user=sender))
+
+    left_partners = [partner for partner in partners if partner.left_at]
+    if left_partners:
+        now = timezone.now()
+        Participant.objects.filter(pk__in=[p.pk for p in left_partners]).update(
+            left_at=None, joined_at=now, unread_count=0,
+        )
+        for partner in left_partners:
+            partner.left_at = None
+            partner.joined_at = now
+            partner.unread_count = 0
+
+    return partners
+
+
+# 会話一覧に出す最新メッセージの抜粋
+def message_preview(message) -> str:
+    body = message.body
+    text = body.get("text") if isinstance(body, dict) else body
+    # ファイルはファイル名を出す
+    if not text and isinstance(body, dict) and isinstance(body.get("file"), dict):
+        text = body["file"].get("name")
+    return str(text or "")[:100]
+
+
+# 会話の「最新メッセージ」を更新する（メッセージ作成と同じトランザクション内で呼ぶ）
+def record_last_message(message) -> int:
+    """
+    ULID が現在の最新より新しい場合だけ更新するので、
+    同時に送信されても古いメッセージで上書きされない。
+    """
+    return (
+        Conversation.objects
+        .filter(pk=message.conversation_id)
+        .filter(Q(last_message__isnull=True) | Q(last_message_id__lt=message.id))
+        .update(
+            last_message=message,
+            last_message_preview=message_preview(message),
+            last_message_at=message.created_at,
+        )
+    )
+
+
+# 新着メッセージの配信（REST / WebSocket 共通）
+def publish_new_message(message, recipient_ids, context) -> str:
+    """
+    会話を開いている受信者はその場で既読にし、ルームへ `chat.message` を送る。
+    それ以外の受信者は未読件数を加算する。
+    JSON エンコード済みのメッセージ (str) を返す。REST のレスポンスや ack にはこれをそのまま使う。
+    """
+    from .serializers import MessageSerializer
+
+    try:
+        viewers = get_viewing_users(message.conversation_id, recipient_ids)
+    except RedisError as exc:
+        # Redis が使えなくてもメッセージは保存する。全員を「閲覧中でない」扱いにして未読を数える
+        logger.warning("presence lookup failed, treating recipients as not viewing: %s", exc)
+        viewers = []
+    if viewers:
+        advance_read_watermark(
+            Participant.objects.filter(conversation_id=message.conversation_id, user_id__in=viewers),
+            message.id,
+        )
+
+    # 画面を開いていない受信者は未読 +1
+    increment_unread(
+        message.conversation_id,
+        [user_id for user_id in recipient_ids if user_id not in viewers],
+    )
+
+    # シリアライズ・エンコードはここで1回だけ。以降は同じ文字列を使い回す
+    encoded = payloads.encode(MessageSerializer(message, context=context).data)
+
+    events = []
+
+    # 一人でも閲覧中のユーザーがいれば WebSocket で通知
+    if viewers:
+        events.append((f"chat_{message.conversation_id}", {
+            "type": "chat.message",  # Consumer 内で定義されているメソッド名に対応
+            "text": encoded,  # 送るメッセージ内容（エンコード済みの JSON 文字列）
+        }))
+
+    # 送信者（他端末）と受信者全員の inbox へ。会話を開いていなくても一覧を更新できる
+    # Consumer はこの文字列をそのまま送る
+    events.append((members_target(message.conversation_id), {
+        "type": "inbox.message",
+        "text": payloads.envelope(
+            {"type": "message", "conversation_id": str(message.conversation_id)},
+            "message",
+            encoded,
+        ),
+    }))
+
+    # 配信はアウトボックスに積むだけ。コミット後にディスパッチャーが送る
+    enqueue(events)
+
+    return encoded
+
+
+# システムメッセージ（参加・招待の通知など）の作成
+@transaction.atomic
+def create_system_message(conversation, sender, text: str):
+    """
+    保存・最新メッセージ更新・未読加算を1トランザクションで行い、
+    閲覧中の参加者へはコミット後に1回だけ配信する。
+    """
+    message = Message.objects.create(
+        conversation=conversation,
+        sender=sender,
+        kind=Message.Kind.SYSTEM,
+        body={"text": text},
+    )
+    record_last_message(message)
+
+    recipient_ids = list(
+        Participant.objects
+        .filter(conversation=conversation, left_at__isnull=True)
+        .exclude(user=sender)
+        .order_by()
+        .values_list('user_id', flat=True)
+    )
+    publish_new_message(message, recipient_ids, context={"user": sender})
+
+    return message
+
+
+# 招待のシステムメッセージ本文（人数が多いときは先頭の数人だけ名前を出す）
+def invitation_text(inviter, invitees, shown: int = 2) -> str:
+    names = "、".join(f"{invitee.username}さん" for invitee in invitees[:shown])
+    rest = len(invitees) - shown
+    if rest > 0:
+        names += f"ほか{rest}人"
+    return f"{inviter.username}さんが{names}を招待しました"
+
+
+# 招待されたユーザーの inbox へ通知する
+def notify_invitations(conversation, inviter, invitee_ids) -> None:
+    fan_out_to_users(invitee_ids, {
+        "type": "inbox.invitation",
+        "conversation_id": str(conversation.id),
+        "title": conversation.title,
+        "invited_by": orjson.loads(payloads.encode(SimpleUserSerializer(inviter).data)),
+    })
@@ -1,3 +1,1076 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from redis.exceptions import ConnectionError as RedisConnectionError
+from rest_framework.test import APIClient
+from companies.models import Company
+from utils.testing import CompanyMemberMixin, TempMediaRootMixin
+from . import outbox, presence, uploads
+from .consumers import ChatConsumer, InboxConsumer
+from .models import Conversation, FileUpload, InvitationConversation, Participant, Message, OutboxEvent
+from .utils import encode_cursor
+from .views import MessageChangesAPIView
+
+try:
+    import fakeredis
+    import fakeredis.aioredis
+except ImportError:  # 開発環境に無ければ閲覧中（Redis）のテストだけ飛ばす
+    fakeredis = None
+
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+}
+
+
+class NoViewersMixin:
+    """閲覧中ユーザーの確認は Redis を使うので、誰も開いていない扱いにする"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('chat.services.get_viewing_users', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class DirectMessageCreateTests(CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.partner = self.create_user('partner')
+        self.url = '/api/chat/conversation/create/'
+
+    def create_dm(self, partner, client=None):
+        return (client or self.client).post(self.url, {'is_group': False, 'partner': partner.id}, format='json')
+
+    def test_reuses_one_dm_per_pair(self):
+        first = self.create_dm(self.partner)
+        self.assertEqual(first.status_code, 200)
+
+        again = self.create_dm(self.partner)
+        # 相手側から作っても同じ会話になる
+        partner_client = APIClient()
+        partner_client.force_authenticate(self.partner)
+        reverse = self.create_dm(self.me, client=partner_client)
+
+        self.assertEqual(again.json()['id'], first.json()['id'])
+        self.assertEqual(reverse.json()['id'], first.json()['id'])
+        self.assertEqual(Conversation.objects.filter(is_group=False).count(), 1)
+        self.assertEqual(Participant.objects.count(), 2)
+
+    def test_concurrent_create_returns_existing_dm(self):
+        existing = self.create_dm(self.partner).json()['id']
+
+        # 同時に作成したもう一方のリクエスト：最初の get では見えず、作成が一意制約に当たる
+        real_get = QuerySet.get
+        missed = []
+
+        def racing_get(queryset, *args, **kwargs):
+            if queryset.model is Conversation and not missed:
+                missed.append(kwargs)
+                raise Conversation.DoesNotExist
+            return real_get(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'get', autospec=True, side_effect=racing_get):
+            response = self.create_dm(self.partner)
+
+        self.assertTrue(missed)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], existing)
+        self.assertEqual(Conversation.objects.filter(is_group=False).count(), 1)
+        self.assertEqual(Participant.objects.count(), 2)
+
+    def test_rejoins_dm_after_leaving(self):
+        conversation_id = self.create_dm(self.partner).json()['id']
+        Participant.objects.filter(user=self.me).update(left_at=timezone.now())
+
+        response = self.create_dm(self.partner)
+
+        self.assertEqual(response.json()['id'], conversation_id)
+        self.assertIsNone(Participant.objects.get(user=self.me).left_at)
+        self.assertEqual(Participant.objects.count(), 2)
+
+    def test_rejects_self_and_other_company(self):
+        other_company = Company.objects.create(name='別会社', is_approved=True)
+        outsider = self.create_user('outsider', company=other_company)
+
+        for partner, field in ((self.me, 'partner'), (outsider, 'user')):
+            with self.subTest(partner=partner.username):
+                response = self.create_dm(partner)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.json())
+        self.assertFalse(Conversation.objects.exists())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class MessageListQueryCountTests(CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = [self.me] + [self.create_user(f'user{i}') for i in range(1, 4)]
+
+        self.conversation = Conversation.objects.create(
+            company=self.company, title='現場', is_group=True,
+        )
+        for user in self.users:
+            Participant.objects.create(user=user, conversation=self.conversation)
+
+        self.url = f'/api/chat/conversation/{self.conversation.id}/message/'
+
+    def create_messages(self, count):
+        for i in range(count):
+            Message.objects.create(
+                conversation=self.conversation,
+                sender=self.users[i % len(self.users)],
+                body={'text': f'message {i}'},
+            )
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        # 参加者取得・ページ取得・既読位置更新・inbox 通知先の取得・既読状態の読み込み
+        self.create_messages(5)
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url, {'limit': 5})
+        self.assertEqual(len(response.json()), 5)
+
+        self.create_messages(200)
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url, {'limit': 200})
+        self.assertEqual(len(response.json()), 200)
+
+    def test_pages_backwards_with_before_and_forwards_with_after(self):
+        self.create_messages(7)
+        ids = list(Message.objects.order_by('id').values_list('id', flat=True))
+
+        newest = self.client.get(self.url, {'limit': 3})
+        self.assertEqual([m['id'] for m in newest.json()], ids[-3:])
+        self.assertEqual(newest['X-Next-Cursor'], ids[-3])
+
+        # X-Next-Cursor を before に渡して古い方へ辿り、最後のページにはヘッダーが無い
+        seen, cursor = [], newest['X-Next-Cursor']
+        while cursor:
+            page = self.client.get(self.url, {'limit': 3, 'before': cursor})
+            seen = [m['id'] for m in page.json()] + seen
+            cursor = page.get('X-Next-Cursor')
+        self.assertEqual(seen, ids[:-3])
+
+        after = self.client.get(self.url, {'after': ids[1], 'limit': 2}).json()
+        self.assertEqual([m['id'] for m in after], ids[2:4])
+
+        # limit は 1〜max_page_size に丸める
+        self.assertEqual(len(self.client.get(self.url, {'limit': 0}).json()), 1)
+        self.create_messages(250)
+        self.assertEqual(len(self.client.get(self.url, {'limit': 1000}).json()), 200)
+
+    def test_rejects_invalid_page_params(self):
+        self.create_messages(2)
+        message_id = Message.objects.values_list('id', flat=True).first()
+        for params in (
+            {'before': message_id, 'after': message_id},
+            {'before': 'not-a-ulid'},
+            {'limit': 'many'},
+        ):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
+
+    def test_read_state_is_resolved_from_watermarks(self):
+        self.create_messages(8)
+        last_id = Message.objects.order_by('-id').values_list('id', flat=True).first()
+        Participant.objects.filter(user=self.users[1]).update(last_read_message_id=last_id)
+
+        messages = self.client.get(self.url).json()
+        mine = [m for m in messages if m['sender']['id'] == self.me.id]
+
+        self.assertTrue(mine)
+        for message in mine:
+            self.assertTrue(message['is_read'])
+            self.assertIn(self.users[1].id, message['read_users'])
+            self.assertNotIn(self.users[2].id, message['read_users'])
+
+    def test_created_message_is_encoded_once(self):
+        with mock.patch('chat.services.get_viewing_users', return_value=[]):
+            response = self.client.post(
+                self.url,
+                {'conversation': str(self.conversation.id), 'body': {'text': 'こんにちは'}},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+
+        # REST のレスポンスと inbox へ配る封筒の中身は同じ文字列
+        event = OutboxEvent.objects.get(payload__type='inbox.message')
+        self.assertIn(response.content.decode(), event.payload['text'])
+        self.assertEqual(json.loads(event.payload['text'])['message'], response.json())
+        self.assertEqual(response.json()['body'], {'text': 'こんにちは'})
+
+
+class InboxQueryCountTests(CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.partner_count = 0
+        self.url = '/api/chat/conversation/'
+
+    def create_partner(self):
+        self.partner_count += 1
+        return self.create_user(f'partner{self.partner_count}')
+
+    def create_conversations(self, count):
+        for _ in range(count):
+            partner = self.create_partner()
+
+            dm = Conversation.objects.create(company=self.company)
+            Participant.objects.create(user=self.me, conversation=dm)
+            Participant.objects.create(user=partner, conversation=dm)
+
+            group = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+            Participant.objects.create(user=self.me, conversation=group)
+            Participant.objects.create(user=partner, conversation=group)
+
+            invited = Conversation.objects.create(company=self.company, title='招待', is_group=True)
+            Participant.objects.create(user=partner, conversation=invited)
+            InvitationConversation.objects.create(conversation=invited, invited_by=partner, invitee=self.me)
+
+    def test_query_count_does_not_grow_with_conversations(self):
+        self.create_conversations(2)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.json()), 6)
+
+        self.create_conversations(10)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.json()), 36)
+
+    def test_dm_partner_is_resolved_from_prefetch(self):
+        self.create_conversations(3)
+        rows = self.client.get(self.url).json()
+
+        dms = [row for row in rows if not row['conversation']['is_group']]
+        self.assertEqual(len(dms), 3)
+        for row in dms:
+            self.assertIsNotNone(row['conversation']['partner_user'])
+            self.assertNotEqual(row['conversation']['partner_user']['id'], self.me.id)
+
+    def test_pages_across_ties_and_invitations(self):
+        self.create_conversations(3)
+        # 同じ最新メッセージ日時の行をページの境目に並べる
+        tied = timezone.now() - timedelta(hours=1)
+        Conversation.objects.update(last_message_at=tied)
+        Conversation.objects.filter(pk__in=Conversation.objects.order_by('pk')[:2].values('pk')).update(
+            last_message_at=tied + timedelta(minutes=1),
+        )
+        expected = list(Conversation.objects.order_by('-last_message_at', '-pk').values_list('pk', flat=True))
+
+        seen, invited, before = [], 0, None
+        while True:
+            params = {'limit': 4, **({'before': before} if before else {})}
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            rows = response.json()
+            seen += [row['conversation']['id'] for row in rows]
+            invited += sum(row['is_invited'] for row in rows)
+            before = response.get('X-Next-Cursor')
+            if not before:
+                break
+
+        self.assertEqual(seen, [str(pk) for pk in expected])
+        self.assertEqual(invited, 3)
+
+    def test_rejects_malformed_before(self):
+        valid_id = '00000000-0000-0000-0000-000000000000'
+        for before in ('broken', f'2026-13-01T00:00:00+00:00,{valid_id}', '2026-01-01T00:00:00+00:00,broken', valid_id):
+            with self.subTest(before=before):
+                response = self.client.get(self.url, {'before': before})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('before', response.json())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_OUTBOX_DISPATCH='command')
+class UnreadCountTests(CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sender = self.create_user('sender')
+        self.viewer = self.create_user('viewer')
+        self.conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+        for user in (self.me, self.sender, self.viewer):
+            Participant.objects.create(user=user, conversation=self.conversation)
+        self.url = f'/api/chat/conversation/{self.conversation.id}/message/'
+
+    def unread(self, user):
+        return Participant.objects.get(conversation=self.conversation, user=user).unread_count
+
+    def inbox_unread(self):
+        [row] = self.client.get('/api/chat/conversation/').json()
+        return row['unread_count']
+
+    def test_counts_unread_for_participants_not_viewing(self):
+        sender_client = APIClient()
+        sender_client.force_authenticate(self.sender)
+
+        # viewer だけが会話を開いている
+        with mock.patch('chat.services.get_viewing_users', return_value=[self.viewer.id]):
+            for text in ('朝礼します', '集合してください'):
+                response = sender_client.post(
+                    self.url, {'conversation': str(self.conversation.id), 'body': {'text': text}}, format='json',
+                )
+                self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(self.unread(self.me), 2)
+        self.assertEqual(self.unread(self.sender), 0)
+        self.assertEqual(self.unread(self.viewer), 0)
+        self.assertEqual(self.inbox_unread(), 2)
+
+        # 開いたら 0 に戻る
+        self.client.get(self.url)
+        self.assertEqual(self.unread(self.me), 0)
+        self.assertEqual(self.inbox_unread(), 0)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_OUTBOX_DISPATCH='command')
+class InvitationCreateTests(NoViewersMixin, CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+        Participant.objects.create(user=self.me, conversation=self.conversation, role='owner')
+        self.url = f'/api/chat/conversation/{self.conversation.id}/invite/'
+
+    def invite(self, ids):
+        return self.client.post(self.url, {'partners': ids}, format='json')
+
+    def system_messages(self):
+        return Message.objects.filter(conversation=self.conversation, kind=Message.Kind.SYSTEM)
+
+    def test_query_count_does_not_grow_with_invitees(self):
+        one = [self.create_user('single').id]
+        six = [self.create_user(f'many{i}').id for i in range(6)]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.invite(one).status_code, 201)
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(self.invite(six).status_code, 201)
+
+    def test_invites_in_one_batch_with_one_system_message(self):
+        users = [self.create_user(f'worker{i}') for i in range(3)]
+        ids = [u.id for u in users]
+        InvitationConversation.objects.create(conversation=self.conversation, invited_by=self.me, invitee=users[0])
+
+        # 重複した ID・存在しない ID は無視する
+        response = self.invite([ids[1], ids[2], ids[1], ids[0], 999999])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'created': [ids[1], ids[2]], 'already_invited': [ids[0]]})
+        self.assertEqual(InvitationConversation.objects.filter(conversation=self.conversation).count(), 3)
+        self.assertEqual(self.system_messages().count(), 1)
+
+        # 全員招待済みならメッセージも増えない
+        self.assertEqual(self.invite(ids).json()['created'], [])
+        self.assertEqual(self.system_messages().count(), 1)
+
+    def test_concurrent_invite_of_same_user_is_not_announced_twice(self):
+        users = [self.create_user(f'worker{i}') for i in range(2)]
+        real_in_bulk = QuerySet.in_bulk
+
+        # 招待対象を読んだ直後に、別のリクエストが users[0] の招待をコミットした
+        def racing_in_bulk(queryset, *args, **kwargs):
+            result = real_in_bulk(queryset, *args, **kwargs)
+            if queryset.model is type(self.me):
+                InvitationConversation.objects.get_or_create(
+                    conversation=self.conversation, invitee=users[0], defaults={'invited_by': self.me},
+                )
+            return result
+
+        with mock.patch.object(QuerySet, 'in_bulk', autospec=True, side_effect=racing_in_bulk):
+            response = self.invite([u.id for u in users])
+
+        self.assertEqual(response.json(), {'created': [users[1].id], 'already_invited': [users[0].id]})
+        [message] = self.system_messages()
+        self.assertNotIn(users[0].username, message.body['text'])
+        self.assertIn(users[1].username, message.body['text'])
+
+    def test_rejects_whole_batch_with_other_company_user(self):
+        colleague = self.create_user('colleague')
+        outsider = self.create_user('outsider', company=Company.objects.create(name='別会社', is_approved=True))
+
+        response = self.invite([colleague.id, outsider.id])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(InvitationConversation.objects.exists())
+        self.assertFalse(self.system_messages().exists())
+
+
+class InviteCandidateTests(CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+        Participant.objects.create(user=self.me, conversation=self.conversation, role='owner')
+        self.url = f'/api/chat/conversation/{self.conversation.id}/invite/'
+
+    def create_named_user(self, name, username, account_id):
+        user = self.create_user(name)
+        user.username, user.account_id = username, account_id
+        user.save()
+        return user
+
+    def candidates(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [user['id'] for user in response.json()], response.get('X-Next-Cursor')
+
+    def test_matches_normalized_name_and_account_prefix(self):
+        katayama = self.create_named_user('katayama', 'カタヤマ', '@kata1')
+        sato = self.create_named_user('sato', 'さとう', '@Sato')
+
+        # 半角カナ・ひらがな・大文字・先頭の @ の違いは吸収する
+        for q, expected in (('ｶﾀ', [katayama.id]), ('かた', [katayama.id]), ('SAT', [sato.id]), ('@sat', [sato.id]), ('サト', [sato.id])):
+            with self.subTest(q=q):
+                self.assertEqual(self.candidates(q=q)[0], expected)
+
+    def test_excludes_participants(self):
+        member = self.create_user('member')
+        outsider = self.create_user('outsider')
+        Participant.objects.create(user=member, conversation=self.conversation)
+        self.create_user('other', company=Company.objects.create(name='別会社', is_approved=True))
+
+        self.assertEqual(self.candidates()[0], [outsider.id])
+
+    def test_pages_with_next_cursor(self):
+        users = [self.create_user(f'worker{i:02d}') for i in range(55)]
+
+        first, cursor = self.candidates()
+        self.assertEqual(len(first), 50)
+        self.assertIsNotNone(cursor)
+
+        second, last_cursor = self.candidates(cursor=cursor)
+        self.assertEqual(len(second), 5)
+        self.assertIsNone(last_cursor)
+        self.assertEqual(first + second, [user.id for user in users])
+
+    def test_rejects_bad_cursor(self):
+        # 'WzEsMl0' は [1,2]（デコードはできるが [名前, ID] ではない）
+        for cursor in ('broken', 'WzEsMl0', encode_cursor(['a']), encode_cursor(['a', '1']), encode_cursor({'a': 1})):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class MessageChangesTests(CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+        Participant.objects.create(user=self.me, conversation=self.conversation)
+
+        self.url = f'/api/chat/conversation/{self.conversation.id}/changes/'
+
+        # 直近の読み直しを無くし、前回以降の変更だけが返ることを確かめる
+        patcher = mock.patch.object(MessageChangesAPIView, 'settle_delay', timedelta(0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_messages(self, count):
+        return [
+            Message.objects.create(conversation=self.conversation, sender=self.me, body={'text': f'message {i}'})
+            for i in range(count)
+        ]
+
+    def test_returns_only_changes_since_token(self):
+        messages = self.create_messages(5)
+        first = self.client.get(self.url).json()
+        self.assertEqual(len(first['messages']), 5)
+        self.assertFalse(first['has_more'])
+
+        edited, deleted = messages[1], messages[2]
+        edited.body = {'text': '編集しました'}
+        edited.edited_at = timezone.now()
+        edited.save()
+        Message.objects.filter(pk=deleted.pk).update(deleted_at=timezone.now(), updated_at=timezone.now())
+        added = self.create_messages(1)[0]
+
+        second = self.client.get(self.url, {'since': first['next']}).json()
+        self.assertEqual([m['id'] for m in second['messages']], [edited.id, added.id])
+        self.assertEqual(second['messages'][0]['body'], {'text': '編集しました'})
+        self.assertEqual([d['id'] for d in second['deleted']], [deleted.id])
+
+        third = self.client.get(self.url, {'since': second['next']}).json()
+        self.assertEqual(third['messages'], [])
+        self.assertEqual(third['deleted'], [])
+
+    def test_pages_until_caught_up(self):
+        self.create_messages(7)
+
+        seen, since = [], None
+        while True:
+            params = {'limit': 3, **({'since': since} if since else {})}
+            page = self.client.get(self.url, params).json()
+            seen += [m['id'] for m in page['messages']]
+            since = page['next']
+            if not page['has_more']:
+                break
+
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+    def test_rejects_broken_token(self):
+        response = self.client.get(self.url, {'since': 'broken'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MessageSearchTests(CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+        self.participant = Participant.objects.create(user=self.me, conversation=self.conversation)
+        self.url = '/api/chat/message/search/'
+
+    def post(self, text, conversation=None):
+        return Message.objects.create(conversation=conversation or self.conversation, sender=self.me, body={'text': text})
+
+    def search(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [hit['message']['id'] for hit in response.json()]
+
+    def test_searches_only_joined_conversations_after_joining(self):
+        other = Conversation.objects.create(company=self.company, title='別件', is_group=True)
+        Participant.objects.create(user=self.create_user('other'), conversation=other)
+        self.post('足場の点検をお願いします', conversation=other)
+
+        before_joining = self.post('足場の点検（参加前）')
+        Message.objects.filter(pk=before_joining.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        Participant.objects.filter(pk=self.participant.pk).update(joined_at=timezone.now() - timedelta(minutes=1))
+        visible = self.post('足場の点検（参加後）')
+
+        for q in ('足場の点検', '足場'):
+            with self.subTest(q=q):
+                self.assertEqual(self.search(q), [visible.id])
+
+        Participant.objects.filter(pk=self.participant.pk).update(left_at=timezone.now())
+        self.assertEqual(self.search('足場の点検'), [])
+
+    def test_matches_all_terms_and_skips_deleted(self):
+        both = self.post('明日の朝礼は現場事務所で')
+        self.post('明日の朝礼は中止')
+        deleted = self.post('現場事務所の朝礼')
+        Message.objects.filter(pk=deleted.pk).update(deleted_at=timezone.now())
+
+        # 長い語どうし・長い語と短い語・短い語どうし
+        for q in ('朝礼は 現場事務所', '現場事務所 朝礼', '朝礼 現場'):
+            with self.subTest(q=q):
+                self.assertEqual(self.search(q), [both.id])
+
+        edited = self.post('資材の搬入')
+        edited.body = {'text': '現場事務所で朝礼'}
+        edited.save()
+        self.assertEqual(self.search('現場事務所 朝礼'), sorted([edited.id, both.id], reverse=True))
+
+    def test_pages_with_before(self):
+        messages = [self.post(f'安全確認 {i}') for i in range(5)]
+        expected = sorted((m.id for m in messages), reverse=True)
+
+        for q in ('安全確認', '安全'):
+            with self.subTest(q=q):
+                seen, before = [], None
+                while True:
+                    params = {'limit': 2, **({'before': before} if before else {})}
+                    response = self.client.get(self.url, {'q': q, **params})
+                    seen += [hit['message']['id'] for hit in response.json()]
+                    before = response.get('X-Next-Cursor')
+                    if not before:
+                        break
+                self.assertEqual(seen, expected)
+
+    def test_snippet_escapes_message_text(self):
+        self.post('足場の点検 <b>&</b>')
+
+        # 索引の snippet()・LIKE で探した分の切り出しの両方
+        for q in ('足場の点検', '足場'):
+            with self.subTest(q=q):
+                [hit] = self.client.get(self.url, {'q': q}).json()
+                self.assertNotIn('<b>', hit['snippet'])
+                self.assertIn('&lt;b&gt;&amp;&lt;/b&gt;', hit['snippet'])
+                self.assertIn(f'<mark>{q}</mark>', hit['snippet'])
+
+    def test_index_survives_table_rebuild(self):
+        from django.db import connection
+        from .search import ensure_search_triggers
+
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite の FTS5 索引のみ')
+
+        self.post('型枠の解体')
+        # テーブルを作り直すマイグレーションでトリガーが消えた状態
+        with connection.cursor() as cursor:
+            for name in ('insert', 'update', 'delete'):
+                cursor.execute(f'DROP TRIGGER chat_message_fts_{name}')
+        ensure_search_triggers()
+
+        added = self.post('型枠の組立')
+        self.assertEqual(len(self.search('型枠の')), 2)
+        Message.objects.filter(pk=added.pk).delete()
+        self.assertEqual(len(self.search('型枠の')), 1)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_OUTBOX_DISPATCH='command')
+class FileUploadTests(NoViewersMixin, TempMediaRootMixin, CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+        Participant.objects.create(user=self.me, conversation=self.conversation)
+
+    def put_chunk(self, upload_id, offset, data):
+        return self.client.generic(
+            'PUT', f'/api/chat/upload/{upload_id}/?offset={offset}', data,
+            content_type='application/octet-stream',
+        )
+
+    def test_resumes_from_offset_and_creates_file_message(self):
+        content = b'0123456789' * 1000
+        upload = self.client.post(
+            f'/api/chat/conversation/{self.conversation.id}/upload/',
+            {'filename': '../図面 A.pdf', 'size': len(content), 'content_type': 'application/pdf'},
+            format='json',
+        ).json()
+        self.assertEqual(upload['offset'], 0)
+        self.assertEqual(upload['filename'], '図面_A.pdf')
+
+        self.assertEqual(self.put_chunk(upload['id'], 0, content[:4000]).json()['offset'], 4000)
+
+        # 受信済みの位置と違う offset は 409 で現在位置を返す
+        conflict = self.put_chunk(upload['id'], 0, content[:4000])
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict.json()['offset'], 4000)
+
+        # 全部届く前の finalize は失敗する
+        early = self.client.post(f'/api/chat/upload/{upload["id"]}/finalize/')
+        self.assertEqual(early.status_code, 400)
+
+        resumed = self.client.get(f'/api/chat/upload/{upload["id"]}/').json()['offset']
+        self.put_chunk(upload['id'], resumed, content[resumed:])
+
+        sha256 = hashlib.sha256(content).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/chat/upload/{upload["id"]}/finalize/', {'sha256': sha256}, format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        message = response.json()
+        self.assertEqual(message['kind'], 'file')
+        self.assertEqual(message['body']['file']['sha256'], sha256)
+        self.assertEqual(message['body']['file']['size'], len(content))
+
+        stored = FileUpload.objects.get(pk=upload['id'])
+        with stored.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(os.path.exists(uploads.partial_path(stored)))
+
+        # finalize の再送は同じメッセージを返す
+        again = self.client.post(f'/api/chat/upload/{upload["id"]}/finalize/')
+        self.assertEqual(again.json()['id'], message['id'])
+        self.assertEqual(Message.objects.filter(kind=Message.Kind.FILE).count(), 1)
+
+
+    def test_overlapping_put_and_corrupt_upload(self):
+        content = b'abcdefgh' * 100
+        upload = self.client.post(
+            f'/api/chat/conversation/{self.conversation.id}/upload/',
+            {'filename': 'a.bin', 'size': len(content)}, format='json',
+        ).json()
+
+        # 別の PUT が書き込み中なら待たずに 409
+        with uploads.chunk_lock(FileUpload.objects.get(pk=upload['id'])):
+            busy = self.put_chunk(upload['id'], 0, content)
+        self.assertEqual(busy.status_code, 409)
+        self.assertEqual(busy.json()['offset'], 0)
+
+        self.assertEqual(self.put_chunk(upload['id'], 0, content).json()['offset'], len(content))
+
+        # ハッシュが合わなければ最初からやり直し
+        mismatch = self.client.post(
+            f'/api/chat/upload/{upload["id"]}/finalize/', {'sha256': '0' * 64}, format='json',
+        )
+        self.assertEqual(mismatch.status_code, 409)
+        self.assertEqual(self.client.get(f'/api/chat/upload/{upload["id"]}/').json()['offset'], 0)
+        self.assertFalse(Message.objects.filter(kind=Message.Kind.FILE).exists())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_OUTBOX_DISPATCH='command')
+class OutboxTests(CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.partner = self.create_user('partner')
+        self.left = self.create_user('left')
+        self.conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+        for user in (self.me, self.partner, self.left):
+            Participant.objects.create(user=user, conversation=self.conversation)
+        Participant.objects.filter(user=self.left).update(left_at=timezone.now())
+
+        self.group_send = mock.AsyncMock()
+        layer = mock.Mock(group_send=self.group_send)
+        patcher = mock.patch('chat.outbox.get_channel_layer', return_value=layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent_groups(self):
+        return [call.args[0] for call in self.group_send.call_args_list]
+
+    def test_rolled_back_events_are_discarded(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    outbox.enqueue([(f'chat_{self.conversation.id}', {'type': 'chat.message', 'text': '{}'})])
+                    raise RuntimeError('rollback')
+            except RuntimeError:
+                pass
+
+        self.assertFalse(OutboxEvent.objects.exists())
+        self.assertEqual(callbacks, [])
+        self.assertEqual(outbox.dispatch_pending(), 0)
+
+    def test_members_target_expands_to_active_participants(self):
+        outbox.enqueue([(outbox.members_target(self.conversation.id), {'type': 'inbox.message', 'text': '{}'})])
+
+        self.assertEqual(outbox.dispatch_pending(), 1)
+        self.assertCountEqual(self.sent_groups(), [f'user_{self.me.id}', f'user_{self.partner.id}'])
+        event = OutboxEvent.objects.get()
+        self.assertIsNotNone(event.dispatched_at)
+        self.assertIsNone(event.claim)
+
+    def test_failed_events_back_off_then_give_up_and_are_purged(self):
+        self.group_send.side_effect = RuntimeError('redis down')
+        outbox.enqueue([(f'user_{self.me.id}', {'type': 'inbox.message', 'text': '{}'})])
+
+        self.assertEqual(outbox.dispatch_pending(), 1)
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertIsNone(event.dispatched_at)
+        self.assertIn('redis down', event.last_error)
+        # バックオフ中は取らない
+        self.assertEqual(outbox.dispatch_pending(), 0)
+
+        # 期限が来たら再送し、成功すれば送信済みになる
+        OutboxEvent.objects.update(available_at=timezone.now())
+        self.group_send.side_effect = None
+        self.assertEqual(outbox.dispatch_pending(), 1)
+        self.assertIsNotNone(OutboxEvent.objects.get().dispatched_at)
+
+        # MAX_ATTEMPTS 回失敗したら諦め、保持期間の後で消す
+        self.group_send.side_effect = RuntimeError('redis down')
+        outbox.enqueue([(f'user_{self.me.id}', {'type': 'inbox.message', 'text': '{}'})])
+        OutboxEvent.objects.filter(dispatched_at__isnull=True).update(attempts=outbox.MAX_ATTEMPTS - 1)
+        self.assertEqual(outbox.dispatch_pending(), 1)
+        given_up = OutboxEvent.objects.get(dispatched_at__isnull=True)
+        self.assertEqual(given_up.attempts, outbox.MAX_ATTEMPTS)
+
+        OutboxEvent.objects.filter(dispatched_at__isnull=True).update(available_at=timezone.now())
+        self.assertEqual(outbox.dispatch_pending(), 0)
+        self.assertEqual(outbox.purge_dispatched(timedelta(hours=1)), 0)
+        self.assertEqual(outbox.purge_dispatched(timedelta(0)), 2)
+
+    def test_claimed_events_are_not_taken_twice_until_lease_expires(self):
+        outbox.enqueue([(f'user_{self.me.id}', {'type': 'inbox.message', 'text': '{}'})])
+
+        claimed = outbox.claim_pending()
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(outbox.claim_pending(), [])
+
+        # 送信中に落ちたディスパッチャーの分は、貸出期限が過ぎたら拾い直す
+        OutboxEvent.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.dispatch_pending(), 1)
+        self.assertEqual(OutboxEvent.objects.get().claim, None)
+
+    def test_message_post_survives_redis_outage(self):
+        with mock.patch('chat.services.get_viewing_users', side_effect=RedisConnectionError('refused')):
+            response = self.client.post(
+                f'/api/chat/conversation/{self.conversation.id}/message/',
+                {'conversation': str(self.conversation.id), 'body': {'text': '届く？'}},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Participant.objects.get(user=self.partner).unread_count, 1)
+
+    def test_read_event_names_the_reader(self):
+        mine = Message.objects.create(conversation=self.conversation, sender=self.me, body={'text': 'お疲れさまです'})
+        theirs = Message.objects.create(conversation=self.conversation, sender=self.partner, body={'text': '了解です'})
+        url = f'/api/chat/conversation/{self.conversation.id}/message/'
+
+        partner_client = APIClient()
+        partner_client.force_authenticate(self.partner)
+        for reader, client in ((self.me, self.client), (self.partner, partner_client)):
+            with self.subTest(reader=reader.username):
+                OutboxEvent.objects.all().delete()
+                self.assertEqual(client.get(url).status_code, 200)
+
+                # クライアントは reader_id が自分なら無視し、相手なら自分の送信分を既読にする
+                event = OutboxEvent.objects.get(target=f'chat_{self.conversation.id}')
+                self.assertEqual(event.payload, {
+                    'type': 'chat.read',
+                    'last_read_id': max(mine.id, theirs.id),
+                    'reader_id': reader.id,
+                })
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ConsumerFrameTests(CompanyMemberMixin, TestCase):
+
+    async def exchange(self, consumer, path, user, frame, url_route=None):
+        communicator = WebsocketCommunicator(consumer.as_asgi(), path)
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': url_route or {}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_to(text_data=frame)
+        reply = await communicator.receive_json_from()
+        await communicator.disconnect()
+        return reply
+
+    def test_invalid_frames_get_error_reply(self):
+        targets = [
+            (ChatConsumer, '/ws/chat/room/', AnonymousUser(), {'room_id': 'room'}),
+            (InboxConsumer, '/ws/inbox/', self.me, None),
+        ]
+        for consumer, path, user, url_route in targets:
+            for frame in ('[]', '"ping"', '1', 'null', '{broken'):
+                with self.subTest(consumer=consumer.__name__, frame=frame):
+                    reply = async_to_sync(self.exchange)(consumer, path, user, frame, url_route)
+                    self.assertEqual(reply['type'], 'error')
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_OUTBOX_DISPATCH='command')
+class ChatConsumerSendTests(NoViewersMixin, CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.partner = self.create_user('partner')
+        self.conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+        for user in (self.me, self.partner):
+            Participant.objects.create(user=user, conversation=self.conversation)
+
+        # 閲覧中の記録（Redis）は使わない
+        for name in ('aregister_connection', 'arefresh_connection', 'aunregister_connection'):
+            patcher = mock.patch(f'chat.consumers.{name}', new=mock.AsyncMock())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def send_frame(self, frame):
+        room_id = str(self.conversation.id)
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{room_id}/')
+        communicator.scope['user'] = self.me
+        communicator.scope['url_route'] = {'kwargs': {'room_id': room_id}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to(frame)
+        replies = [await communicator.receive_json_from()]
+        # outbox はディスパッチしない設定なので、届くのは ack かエラーの1通だけ
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+        return replies
+
+    def test_send_persists_and_acks_with_server_id(self):
+        # 相手は会話を開いている
+        with mock.patch('chat.services.get_viewing_users', return_value=[self.partner.id]):
+            [ack] = async_to_sync(self.send_frame)({'type': 'send', 'client_id': 'local-1', 'body': {'text': '搬入完了'}})
+
+        self.assertEqual(ack['type'], 'ack')
+        self.assertEqual(ack['client_id'], 'local-1')
+        message = Message.objects.get()
+        self.assertEqual(ack['id'], message.id)
+        self.assertEqual(ack['message']['id'], message.id)
+        self.assertEqual((message.sender, message.body), (self.me, {'text': '搬入完了'}))
+
+        # ルームと参加者の inbox への配信はコミット後に outbox から
+        self.assertCountEqual(
+            OutboxEvent.objects.values_list('target', flat=True),
+            [f'chat_{self.conversation.id}', outbox.members_target(self.conversation.id)],
+        )
+        partner = Participant.objects.get(user=self.partner)
+        self.assertEqual((partner.unread_count, partner.last_read_message_id), (0, message.id))
+
+    def test_left_participant_cannot_send(self):
+        Participant.objects.filter(user=self.me).update(left_at=timezone.now())
+
+        [reply] = async_to_sync(self.send_frame)({'type': 'send', 'client_id': 'local-1', 'body': {'text': '届く？'}})
+
+        self.assertEqual(reply, {'type': 'error', 'client_id': 'local-1', 'detail': 'この会話に参加していません'})
+        self.assertFalse(Message.objects.exists())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, CHAT_OUTBOX_DISPATCH='command')
+class InboxConsumerTests(NoViewersMixin, CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.partner = self.create_user('partner')
+        self.partner_client = APIClient()
+        self.partner_client.force_authenticate(self.partner)
+
+        self.conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+        for user in (self.me, self.partner):
+            Participant.objects.create(user=user, conversation=self.conversation)
+
+        self.presence = {}
+        for name in ('aregister_connection', 'arefresh_connection', 'aunregister_connection'):
+            patcher = mock.patch(f'chat.consumers.{name}', new=mock.AsyncMock())
+            self.presence[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(InboxConsumer.as_asgi(), '/ws/inbox/')
+        communicator.scope['user'] = self.me
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_all(self, communicator):
+        frames = []
+        while not await communicator.receive_nothing():
+            frames.append(await communicator.receive_json_from())
+        return frames
+
+    def test_subscribe_only_to_joined_conversations(self):
+        other = Conversation.objects.create(company=self.company, title='別件', is_group=True)
+
+        async def scenario():
+            communicator = await self.connect()
+            await communicator.send_json_to({'type': 'subscribe', 'conversation_id': str(other.id)})
+            rejected = await communicator.receive_json_from()
+            await communicator.send_json_to({'type': 'subscribe', 'conversation_id': str(self.conversation.id)})
+            accepted = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return rejected, accepted
+
+        rejected, accepted = async_to_sync(scenario)()
+
+        self.assertEqual(rejected['type'], 'error')
+        self.assertEqual(rejected['conversation_id'], str(other.id))
+        self.assertEqual(accepted, {'type': 'subscribed', 'conversation_id': str(self.conversation.id)})
+        self.assertEqual(self.presence['aregister_connection'].await_count, 1)
+        # 切断時は閲覧中の記録を消す
+        self.assertEqual(self.presence['aunregister_connection'].await_count, 1)
+
+    def produce_events(self):
+        url = f'/api/chat/conversation/{self.conversation.id}/message/'
+        Message.objects.create(conversation=self.conversation, sender=self.me, body={'text': '確認お願いします'})
+        # 相手が開いて既読にする → read、相手が送る → message
+        self.partner_client.get(url)
+        self.partner_client.post(url, {'conversation': str(self.conversation.id), 'body': {'text': '確認しました'}}, format='json')
+
+        # 相手が別のグループに招待する → invitation
+        invited = Conversation.objects.create(company=self.company, title='打合せ', is_group=True)
+        Participant.objects.create(user=self.partner, conversation=invited, role='owner')
+        self.partner_client.post(f'/api/chat/conversation/{invited.id}/invite/', {'partners': [self.me.id]}, format='json')
+        return invited
+
+    def test_delivers_group_events_after_dispatch(self):
+        async def scenario():
+            communicator = await self.connect()
+            invited = await database_sync_to_async(self.produce_events)()
+            await database_sync_to_async(outbox.dispatch_pending)()
+            frames = await self.receive_all(communicator)
+            await communicator.disconnect()
+            return invited, frames
+
+        invited, frames = async_to_sync(scenario)()
+        by_type = {frame['type']: frame for frame in frames}
+
+        self.assertEqual(by_type['read']['reader_id'], self.partner.id)
+        self.assertEqual(by_type['read']['conversation_id'], str(self.conversation.id))
+        self.assertEqual(by_type['message']['conversation_id'], str(self.conversation.id))
+        self.assertEqual(by_type['message']['message']['body'], {'text': '確認しました'})
+        self.assertEqual(by_type['invitation']['conversation_id'], str(invited.id))
+        self.assertEqual(by_type['invitation']['invited_by']['id'], self.partner.id)
+
+
+@skipUnless(fakeredis, 'fakeredis が必要です')
+class PresenceTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server)
+        # async 版は呼び出しごとにイベントループが変わるので、その都度クライアントを作る
+        for target, client in (
+            ('chat.presence.get_redis_connection', lambda alias: self.redis),
+            ('chat.presence.get_async_redis', lambda: fakeredis.aioredis.FakeRedis(server=server)),
+        ):
+            patcher = mock.patch(target, side_effect=client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.conversation_id = '00000000-0000-0000-0000-000000000001'
+
+    def viewing(self, *user_ids):
+        return presence.get_viewing_users(self.conversation_id, user_ids)
+
+    def test_user_stays_viewing_while_any_connection_is_open(self):
+        async_to_sync(presence.aregister_connection)(self.conversation_id, 1, 'phone')
+        async_to_sync(presence.aregister_connection)(self.conversation_id, 1, 'desktop')
+        presence.register_connection(self.conversation_id, 2, 'tablet')
+        self.assertEqual(self.viewing(1, 2, 3), [1, 2])
+
+        async_to_sync(presence.aunregister_connection)(self.conversation_id, 1, 'phone')
+        self.assertEqual(self.viewing(1), [1])
+
+        async_to_sync(presence.aunregister_connection)(self.conversation_id, 1, 'desktop')
+        presence.unregister_connection(self.conversation_id, 2, 'tablet')
+        self.assertEqual(self.viewing(1, 2), [])
+
+    def test_connections_past_ttl_are_not_viewing(self):
+        now = time.time()
+        key = presence.viewers_key(self.conversation_id)
+        self.redis.zadd(key, {
+            presence.connection_member(1, 'alive'): now - presence.PRESENCE_TTL + 5,
+            presence.connection_member(2, 'dead'): now - presence.PRESENCE_TTL - 5,
+        })
+
+        self.assertEqual(self.viewing(1, 2), [1])
+        self.assertTrue(presence.is_viewing(self.conversation_id, 1))
+        self.assertFalse(presence.is_viewing(self.conversation_id, 2))
+
+    def test_heartbeat_extends_connection(self):
+        with mock.patch('chat.presence.time.time', return_value=1000.0):
+            async_to_sync(presence.aregister_connection)(self.conversation_id, 1, 'phone')
+
+        # TTL の直前にハートビートが届けば、その時刻から TTL だけ延びる
+        heartbeat_at = 1000.0 + presence.PRESENCE_TTL - 1
+        with mock.patch('chat.presence.time.time', return_value=heartbeat_at):
+            async_to_sync(presence.arefresh_connection)(self.conversation_id, 1, 'phone')
+
+        key = presence.viewers_key(self.conversation_id)
+        self.assertEqual(self.redis.zscore(key, presence.connection_member(1, 'phone')), heartbeat_at)
+        with mock.patch('chat.presence.time.time', return_value=heartbeat_at + presence.PRESENCE_TTL - 1):
+            self.assertEqual(self.viewing(1), [1])
+            self.assertEqual(presence.sweep_stale_connections(), 0)
+
+    def test_sweep_removes_stale_connections_and_empty_rooms(self):
+        other_room = '00000000-0000-0000-0000-000000000002'
+        with mock.patch('chat.presence.time.time', return_value=1000.0):
+            presence.register_connection(self.conversation_id, 1, 'stale')
+            presence.register_connection(other_room, 2, 'stale')
+        with mock.patch('chat.presence.time.time', return_value=1000.0 + presence.PRESENCE_TTL):
+            presence.register_connection(self.conversation_id, 1, 'alive')
+
+        with mock.patch('chat.presence.time.time', return_value=1000.0 + presence.PRESENCE_TTL + 1):
+            self.assertEqual(presence.sweep_stale_connections(), 2)
+            self.assertEqual(presence.sweep_stale_connections(), 0)
+
+        key = presence.viewers_key(self.conversation_id)
+        self.assertEqual(self.redis.zrange(key, 0, -1), [presence.connection_member(1, 'alive').encode()])
+        # 接続が無くなった会話は掃除対象の一覧からも外す
+        self.assertEqual(self.redis.smembers(presence.ROOMS_KEY), {self.conversation_id.encode()})
@@ -0,0 +1,123 @@
+# chat/uploads.py
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import FileUpload
+
+# 1回の PUT で受け付ける最大サイズと、ファイル全体の上限（バイト）
+CHUNK_SIZE = getattr(settings, 'CHAT_UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024)
+MAX_UPLOAD_SIZE = getattr(settings, 'CHAT_UPLOAD_MAX_SIZE', 200 * 1024 * 1024)
+
+# リクエスト本文・ファイルを読む単位。ファイル全体をメモリに載せない
+BLOCK_SIZE = 64 * 1024
+
+# アップロード途中のファイルの置き場所（MEDIA_ROOT 配下）
+PARTIAL_DIR = 'chat_uploads'
+
+
+def clean_filename(filename: str) -> str:
+    name = get_valid_filename(os.path.basename(filename or ""))
+    return name[:255] or "file"
+
+
+def partial_path(upload) -> str:
+    return os.path.join(settings.MEDIA_ROOT, PARTIAL_DIR, f"{upload.pk}.part")
+
+
+@contextmanager
+def chunk_lock(upload):
+    """
+    途中ファイルへの書き込みを1本に限る排他ロック（DB ではなくファイルロック）。
+    同じアップロードへ PUT が重なった場合は待たずに BlockingIOError を送出する。
+    """
+    path = partial_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as f:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_chunk(upload, offset: int, stream, length: int) -> int:
+    """
+    `stream` から最大 `length` バイトを読み、途中ファイルの `offset` の位置から書き込む。
+    通信が途中で切れた場合は届いた分だけ書くので、次回はその続きから再開できる。
+    書き込んだバイト数を返す。
+    """
+    path = partial_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    written = 0
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(offset)
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+        # 再送で前回より短く書いた場合に備え、受信済みの位置で切り詰める
+        f.truncate(offset + written)
+    return written
+
+
+# hashlib の途中状態はリクエストをまたいで保存できないので、完了時にファイルを順に読んで求める
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# 途中ファイルをストレージへコピーし、保存名を返す（途中ファイルは discard で消す）
+def store(upload) -> str:
+    name = f"{FileUpload._meta.get_field('file').upload_to}{upload.pk}/{upload.filename}"
+    with open(partial_path(upload), "rb") as f:
+        return default_storage.save(name, File(f, name=upload.filename))
+
+
+def discard(upload) -> None:
+    try:
+        os.remove(partial_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+# FILE メッセージの本文
+def file_body(upload) -> dict:
+    return {
+        "file": {
+            "upload_id": str(upload.pk),
+            "name": upload.filename,
+            "size": upload.size,
+            "content_type": upload.content_type,
+            "sha256": upload.sha256,
+            "path": upload.file.name,
+            "url": default_storage.url(upload.file.name),
+        }
+    }
+
+
+# 放置されたアップロードの掃除
+def purge_stale(older_than) -> int:
+    stale = list(
+        FileUpload.objects.filter(
+            status=FileUpload.Status.UPLOADING,
+            updated_at__lt=timezone.now() - older_than,
+        )
+    )
+    for upload in stale:
+        discard(upload)
+    FileUpload.objects.filter(pk__in=[upload.pk for upload in stale]).delete()
+    return len(stale)
@@ -1,11 +1,16 @@
 from django.urls import path
-from .views import ConversationListAPIView, ConversationCreateAPIView, MessageListCreateAPIView, InvitationConversationAPIView, ParticipantAPIView, LeaveConversationAPIView
+from .views import ConversationListAPIView, ConversationCreateAPIView, MessageListCreateAPIView, InvitationConversationAPIView, ParticipantAPIView, LeaveConversationAPIView, MessageSearchAPIView, MessageChangesAPIView, FileUploadCreateAPIView, FileUploadAPIView, FileUploadFinalizeAPIView
 
 urlpatterns = [
     path('conversation/', ConversationListAPIView.as_view(), name='conversation-get'),
     path('conversation/create/', ConversationCreateAPIView.as_view(), name='conversation-create'),
     path('conversation/<uuid:conversation_id>/message/', MessageListCreateAPIView.as_view(), name='conversation-message'),
+    path('conversation/<uuid:conversation_id>/changes/', MessageChangesAPIView.as_view(), name='conversation-changes'),
     path('conversation/<uuid:conversation_id>/invite/', InvitationConversationAPIView.as_view(), name='conversation-invite'),
     path('conversation/<uuid:conversation_id>/participant/', ParticipantAPIView.as_view(), name='conversation-participant'),
     path('conversation/<uuid:conversation_id>/delete/', LeaveConversationAPIView.as_view(), name='conversation-delete'),
+    path('conversation/<uuid:conversation_id>/upload/', FileUploadCreateAPIView.as_view(), name='conversation-upload'),
+    path('upload/<uuid:upload_id>/', FileUploadAPIView.as_view(), name='upload-chunk'),
+    path('upload/<uuid:upload_id>/finalize/', FileUploadFinalizeAPIView.as_view(), name='upload-finalize'),
+    path('message/search/', MessageSearchAPIView.as_view(), name='message-search'),
 ]
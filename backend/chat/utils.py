@@ -1,38 +1,30 @@
 # chat/utils.py
+import base64
+import json
+import re
 import ulid
-from typing import List
-from django_redis import get_redis_connection
 
-def generate_ulid():
-    return str(ulid.new())
+# Crockford Base32 の26文字 (I, L, O, U を含まない)
+ULID_RE = re.compile(r"^[0-9A-HJKMNP-TV-Z]{26}$")
 
 
-# WebSocket接続中かの判定(個人)
-def is_user_online(user_id: int, conversation_id: str) -> bool:
-    redis_conn = get_redis_connection('default')
-    
-    is_online = redis_conn.exists(f"online_user:{user_id}") == 1
-    current_chat = redis_conn.get(f"chat_open:{user_id}")
+def generate_ulid():
+    return str(ulid.new())
 
-    if not is_online or current_chat is None:
-        return False
-    
-    return current_chat.decode() == str(conversation_id)
 
+# クエリパラメータ等で受け取った ULID の形式チェック
+def is_valid_ulid(value: str) -> bool:
+    return bool(value) and ULID_RE.match(value.upper()) is not None
 
-# WebSocket接続中かの判定(グループ)
-def get_online_users_in_conversation(user_ids: List[int], conversation_id: str) -> List[int]:
-    redis_conn = get_redis_connection('default')
-    online_user_ids = []
 
-    for user_id in user_ids:
-        is_online = redis_conn.exists(f"online_user:{user_id}") == 1
-        current_chat = redis_conn.get(f"chat_open:{user_id}")
 
-        if not is_online or current_chat is None:
-            continue
+# ページングカーソル（クライアントには中身を意識させない不透明な文字列にする）
+def encode_cursor(values) -> str:
+    raw = json.dumps(values, ensure_ascii=False, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-        if current_chat.decode() == str(conversation_id):
-            online_user_ids.append(user_id)
 
-    return online_user_ids
\ No newline at end of file
+# 壊れたカーソルは ValueError
+def decode_cursor(cursor: str):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
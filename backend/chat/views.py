@@ -1,9 +1,15 @@
-import json
-from .models import Conversation, Message, MessageRead, InvitationConversation, Participant
-from .serializers import ConversationSerializer, ParticipantSerializer, MessageSerializer, InvitationConversationSerializer, ConversationWrapperSerializer, InvitationUpdateSerializer
-from .utils import is_user_online, get_online_users_in_conversation
+from . import uploads
+from .models import Conversation, Message, InvitationConversation, Participant, FileUpload
+from .serializers import ConversationSerializer, ParticipantSerializer, MessageSerializer, InvitationConversationSerializer, ConversationWrapperSerializer, InvitationUpdateSerializer, FileUploadSerializer, schedule_icon_variants
+from .services import create_system_message, invitation_text, mark_conversation_read, notify_invitations, publish_new_message, reactivate_participants, record_last_message
+from .search import search_messages
+from .utils import decode_cursor, encode_cursor, is_valid_ulid
 from timeline.permissions import IsCompanyMember
 from users.serializers import SimpleUserSerializer
+from utils.text import normalize_search_text, prefix_range
+
+import uuid
+from datetime import timedelta
 
 from rest_framework import status
 from rest_framework.views import APIView
@@ -12,11 +18,11 @@ from rest_framework.mixins import UpdateModelMixin
 from rest_framework.serializers import ValidationError
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
+from django.http import HttpResponse
 from django.db import transaction
-from django.db.models import Subquery, OuterRef
+from django.db.models import BooleanField, Exists, F, IntegerField, OuterRef, Prefetch, Q, Value
 from django.utils import timezone
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from django.utils.dateparse import parse_datetime
 from django.shortcuts import get_object_or_404
 
 
@@ -45,158 +51,213 @@ class ConversationCreateAPIView(CreateAPIView):
 
     
     def perform_create(self, serializer):
-        
-        request = self.request
-        data = request.data
-        partner_id = data.get('partner')
-
-        if not serializer.validated_data.get("is_group", False) and not partner_id:
-            raise ValidationError({"partner": "DM相手が指定されていません"})
-
-        existing = (
-            Conversation.objects.filter(
-                is_group=False,
-                company=request.user.company,
-                participants__user__id=request.user.id,
-            )
-            .filter(participants__user__id=partner_id)
-            .distinct()
-            .first()
-        )
-
+        if serializer.validated_data.get("is_group", False):
+            self.perform_create_group(serializer)
+        else:
+            self.perform_create_dm(serializer)
 
-        if existing:
-            # 自分が以前抜けた場合は left_at をリセット
-            participant = Participant.objects.filter(
-                user=request.user, conversation=existing
-            ).first()
+    def perform_create_group(self, serializer):
+        request = self.request
 
-            if participant and participant.left_at:
-                participant.left_at = None
-                participant.save()
-                
-            # すでに会話があるなら、その情報をレスポンスとして返す
-            self.instance = existing
-            return
-        
         with transaction.atomic():
             conversation = serializer.save()
 
-            # 作成者のparticipantを作成
-            if conversation.is_group:
-                # グループだったらオーナー
-                participant_data = {
+            # 作成者はオーナーとして参加
+            participant_serializer = ParticipantSerializer(
+                data={
                     "user": request.user.id,
                     "conversation": str(conversation.id),
                     "role": "owner"
-                }
-            else:
-                participant_data = {
-                # DMだったらメンバー
-                "user": request.user.id,
-                "conversation": str(conversation.id),
-            }
-
-            participant_serializer = ParticipantSerializer(
-                data=participant_data,
+                },
                 context={"request": request, "conversation": conversation}
             )
 
             participant_serializer.is_valid(raise_exception=True)
             participant_serializer.save()
 
-        # DMの場合は相手のoarticipantも作成する
-        if not conversation.is_group:
-            if not partner_id:
-                raise ValidationError({"partner": "DMの相手が指定されていません"})
-            
-            try:
-                partner_user = User.objects.get(id=partner_id)
-            except User.DoesNotExist:
-                raise ValidationError({"partner": "指定されたユーザーが存在しません"})
-            
-            if partner_id == request.user.id:
-                raise ValidationError({"partner": "自分自身とはDMできません"})
-            
-            partner_participant_data = {
-                "user": partner_user.id,
-                "conversation": str(conversation.id),
-            }
+        self.instance = conversation
+
+    def perform_create_dm(self, serializer):
+        request = self.request
+        partner_id = request.data.get('partner')
+
+        if not partner_id:
+            raise ValidationError({"partner": "DM相手が指定されていません"})
 
-            partner_participant_serializer = ParticipantSerializer(
-                data=partner_participant_data,
-                context={
-                    "request": request,
-                    "conversation": conversation,
-                    "user": partner_user,
-                }
+        try:
+            partner_user = User.objects.filter(id=int(partner_id)).first()
+        except (TypeError, ValueError):
+            partner_user = None
+        if partner_user is None:
+            raise ValidationError({"partner": "指定されたユーザーが存在しません"})
+
+        if partner_user.id == request.user.id:
+            raise ValidationError({"partner": "自分自身とはDMできません"})
+
+        if partner_user.company_id != request.user.company_id:
+            raise ValidationError({"user": "会社が一致していません"})
+
+        # 同じ2人の DM は dm_key の一意索引で1つに限定される
+        # 同時に作成されても get_or_create が一意制約違反を拾って既存の会話を返す
+        dm_key = Conversation.build_dm_key(request.user.company_id, request.user.id, partner_user.id)
+        defaults = {**serializer.validated_data, "company": request.user.company}
+        defaults.pop("is_group", None)
+
+        with transaction.atomic():
+            conversation, created = Conversation.objects.get_or_create(
+                dm_key=dm_key,
+                is_group=False,
+                defaults=defaults,
             )
 
-            is_valid = partner_participant_serializer.is_valid(raise_exception=True)
-            partner_participant_serializer.save()
+            if created:
+                Participant.objects.bulk_create([
+                    Participant(user=request.user, conversation=conversation),
+                    Participant(user=partner_user, conversation=conversation),
+                ])
+                # serializer.create を通らないので、アイコンの縮小版はここで予約する
+                schedule_icon_variants(conversation)
+            else:
+                # 自分が以前抜けた場合は left_at をリセット
+                Participant.objects.filter(
+                    user=request.user, conversation=conversation, left_at__isnull=False,
+                ).update(left_at=None)
+
+        self.instance = conversation
 
 
 # --- conversationとinvitationを結合した一覧取得 ---
 class ConversationListAPIView(ListAPIView):
+    """
+    参加中の会話と未回答の招待を、最新メッセージ日時の新しい順に1本の UNION で並べる
+      ?before=<last_message_at>,<conversation_id>&limit=N … 指定位置より古いN件
+    続きがある場合は次ページのカーソルを X-Next-Cursor ヘッダーで返す
+    """
+
     serializer_class = ConversationWrapperSerializer
     permission_classes = [IsCompanyMember,]
 
-    def list(self, request, *args, **kwargs):
-        user = request.user
-        company = user.company
+    page_size = 50
+    max_page_size = 200
 
-        # --- 最新メッセージの定義 ---
-        latest_message = (
-            Message.objects
-            .filter(conversation=OuterRef('pk'))
-            .order_by('-created_at')
-        )
+    def get_page_params(self):
+        params = self.request.query_params
 
-        # --- 自分が参加している会話 ---
-        conversations = (
-            Conversation.objects
-                .filter(company=company, participants__user=user, participants__left_at__isnull=True)
-                .select_related('company')
-                .prefetch_related('participants__user')
-                .annotate(
-                    last_message_content=Subquery(latest_message.values('body')[:1]),
-                    last_message_created_at=Subquery(latest_message.values('created_at')[:1]),
-                )
+        try:
+            limit = int(params.get('limit', self.page_size))
+        except ValueError:
+            raise ValidationError({"limit": "数値で指定してください"})
+        limit = max(1, min(limit, self.max_page_size))
+
+        before = params.get('before')
+        if not before:
+            return None, limit
+
+        # タイムスタンプに "," は含まれないので最後の "," で分ける
+        timestamp, _, conversation_id = before.rpartition(',')
+        try:
+            # 形式は正しいが存在しない日時（13月など）は ValueError になる
+            before_at = parse_datetime(timestamp.replace(' ', '+'))
+            before_id = uuid.UUID(conversation_id)
+        except ValueError:
+            before_at = before_id = None
+
+        if before_at is None or before_id is None:
+            raise ValidationError({"before": "不正なカーソルです"})
+        if timezone.is_naive(before_at):
+            before_at = timezone.make_aware(before_at)
+
+        return (before_at, before_id), limit
+
+    def get_rows(self, before, limit):
+        user = self.request.user
+
+        # 参加中の会話
+        joined = (
+            Participant.objects
+            .filter(user=user, left_at__isnull=True, conversation__company=user.company)
+            .annotate(
+                sort_at=F('conversation__last_message_at'),
+                is_invited=Value(False, output_field=BooleanField()),
+                inviter_id=Value(None, output_field=IntegerField()),
+            )
         )
 
         # 招待されているグループチャット
-        invitations = (
+        invited = (
             InvitationConversation.objects
-                .filter(invitee=user, is_participated=False)
-                .select_related('conversation', 'invited_by')
+            .filter(invitee=user, is_participated=False)
+            .annotate(
+                sort_at=F('conversation__last_message_at'),
+                is_invited=Value(True, output_field=BooleanField()),
+                inviter_id=F('invited_by_id'),
+                unread_count=Value(0, output_field=IntegerField()),
+            )
         )
 
-        result = []
-
-        for conv in conversations:
-            result.append({
-                'conversation': conv,
-                'is_invited': False,
-                'invited_by': None,
-            })
-
-        for invite in invitations:
-            result.append({
-                'conversation': invite.conversation,
-                'is_invited': True,
-                'invited_by': invite.invited_by
-            })
-
-        result.sort(
-            key=lambda item: (
-                getattr(item["conversation"], 'last_message_created_at', None)
-                or item["conversation"].updated_at
-            ),
-            reverse=True
+        # UNION の外側では絞り込めないので、キーセット条件は両側に付ける
+        if before:
+            before_at, before_id = before
+            keyset = (
+                Q(conversation__last_message_at__lt=before_at)
+                | Q(conversation__last_message_at=before_at, conversation_id__lt=before_id)
+            )
+            joined = joined.filter(keyset)
+            invited = invited.filter(keyset)
+
+        columns = ('conversation_id', 'sort_at', 'is_invited', 'inviter_id', 'unread_count')
+        return list(
+            joined.order_by().values_list(*columns)
+            .union(invited.order_by().values_list(*columns), all=True)
+            .order_by('-sort_at', '-conversation_id')[:limit + 1]
         )
 
+    def list(self, request, *args, **kwargs):
+        before, limit = self.get_page_params()
+        rows = self.get_rows(before, limit)
+
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+        # 表示する分だけまとめて読み込む（件数によらずクエリ数は一定）
+        conversations = (
+            Conversation.objects
+            .select_related('company')
+            .prefetch_related(
+                # DM の相手表示用。グループの参加者は読み込まない
+                Prefetch(
+                    'participants',
+                    queryset=(
+                        Participant.objects
+                        .filter(conversation__is_group=False)
+                        .exclude(user=request.user)
+                        .select_related('user')
+                    ),
+                    to_attr='other_participants',
+                )
+            )
+            .in_bulk([row[0] for row in rows])
+        )
+        inviters = User.objects.in_bulk([row[3] for row in rows if row[3] is not None])
+
+        result = [
+            {
+                'conversation': conversations[conversation_id],
+                'is_invited': is_invited,
+                'invited_by': inviters.get(inviter_id),
+                'unread_count': unread_count,
+            }
+            for conversation_id, _, is_invited, inviter_id, unread_count in rows
+            if conversation_id in conversations
+        ]
+
         serializer = ConversationWrapperSerializer(result, many=True, context={'request':request})
-        return Response(serializer.data)
+        response = Response(serializer.data)
+
+        if has_next:
+            conversation_id, sort_at = rows[-1][0], rows[-1][1]
+            response['X-Next-Cursor'] = f"{sort_at.isoformat()},{conversation_id}"
+        return response
     
 
 # conversation退出API
@@ -253,31 +314,40 @@ class ParticipantAPIView(GenericAPIView):
             }
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save()
 
-        Message.objects.create(
-            conversation=conversation,
-            sender=request.user,
-            kind='system',
-            body = {"text": f"{request.user.username}さんが参加しました"}
-        )
+        with transaction.atomic():
+            serializer.save()
+            create_system_message(conversation, request.user, f"{request.user.username}さんが参加しました")
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 class MessageListCreateAPIView(ListCreateAPIView):
+    """
+    メッセージ一覧はULIDをカーソルにしたキーセットページング
+      ?before=<ulid>&limit=N … 指定メッセージより古いN件（省略時は最新N件）
+      ?after=<ulid>&limit=N  … 指定メッセージより新しいN件
+    どちらも古い順で返す。さらに古いメッセージがあれば X-Next-Cursor ヘッダーに
+    次の before（ページ内で最も古い ULID）を入れる
+    """
 
     serializer_class = MessageSerializer
     permission_classes = [IsCompanyMember,]
 
+    page_size = 50
+    max_page_size = 200
+
+    def get_participant(self):
+        if not hasattr(self, '_participant'):
+            self._participant = Participant.objects.filter(
+                user=self.request.user,
+                conversation_id=self.kwargs.get("conversation_id"),
+            ).first()
+        return self._participant
+
     def get_queryset(self):
         conversation_id = self.kwargs.get("conversation_id")
-        user = self.request.user
-
-        participant = Participant.objects.filter(
-            user=user,
-            conversation_id=conversation_id,
-        ).first()
+        participant = self.get_participant()
 
         if not participant:
             return Message.objects.none()
@@ -289,9 +359,47 @@ class MessageListCreateAPIView(ListCreateAPIView):
                 created_at__gte=participant.joined_at  # ← ここがポイント
             )
             .select_related('sender')
-            .order_by('created_at')
+            .order_by('id')
         )
 
+    def get_page_params(self):
+        params = self.request.query_params
+        before = params.get('before')
+        after = params.get('after')
+
+        if before and after:
+            raise ValidationError({"detail": "before と after は同時に指定できません"})
+
+        for key, value in (('before', before), ('after', after)):
+            if value is not None and not is_valid_ulid(value):
+                raise ValidationError({key: "不正なメッセージIDです"})
+
+        try:
+            limit = int(params.get('limit', self.page_size))
+        except ValueError:
+            raise ValidationError({"limit": "数値で指定してください"})
+        limit = max(1, min(limit, self.max_page_size))
+
+        return (before.upper() if before else None), (after.upper() if after else None), limit
+
+    def paginate_messages(self, queryset):
+        """(古い順のページ, 続きの before カーソル) を返す"""
+        before, after, limit = self.get_page_params()
+
+        # (conversation, id) の索引を範囲検索するだけなので履歴の深さに依存しない
+        if after:
+            return list(queryset.filter(id__gt=after).order_by('id')[:limit]), None
+
+        if before:
+            queryset = queryset.filter(id__lt=before)
+
+        # 1件多く読んで、さらに古いメッセージがあるかを判定する
+        page = list(queryset.order_by('-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        page.reverse()
+        return page, (page[0].id if has_more else None)
+
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -299,129 +407,379 @@ class MessageListCreateAPIView(ListCreateAPIView):
         return context
     
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        conversation_id = self.kwargs.get('conversation_id')
+        messages, next_cursor = self.paginate_messages(self.get_queryset())
         user = request.user
 
-        conversation = Conversation.objects.get(id=conversation_id)
-        partner = conversation.participants.exclude(user=user).first()
-
-        # --- WebSocket ---
-        if partner:
-            for message in queryset:
-                if message.sender == user:
-                    continue
-
-                is_read = MessageRead.objects.filter(message=message, user=user).exists()
-                if not is_read:
-                    MessageRead.objects.get_or_create(
-                        message=message,
-                        user=user,
-                    )
-                
-                partner_online = is_user_online(partner.user.id, str(conversation.id))
-                if partner_online:
-                    channel_layer = get_channel_layer()
-                    async_to_sync(channel_layer.group_send)(
-                        f"chat_{conversation.id}",
-                        {
-                            "type": "chat.read",
-                            "message_id": str(message.id),
-                            "reader_id": user.id,
-                        }
-                    )
+        # 表示したページの最新メッセージまでをまとめて既読にする
+        participant = self.get_participant()
+        if participant and messages:
+            mark_conversation_read(user, participant, messages[-1].id)
 
         serializer = self.get_serializer(
-            queryset,
+            messages,
             many=True,
             context={'request': request, 'conversation_id': self.kwargs['conversation_id']},
         )
-        return Response(serializer.data)
+        response = Response(serializer.data)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return response
 
         
     def perform_create(self, serializer):
         user = self.request.user
-        conversation_id = self.kwargs['conversation_id']
-        conversation = get_object_or_404(Conversation, id=conversation_id)
+        conversation = get_object_or_404(Conversation, id=self.kwargs['conversation_id'])
 
-        # グループチャット
-        if conversation.is_group:
-            group_partners = conversation.participants.exclude(user=user)
-            for group_partner in group_partners:
-                # チャットを削除しているユーザーがいれば復帰させる
-                if group_partner.left_at:
-                    group_partner.left_at = None
-                    group_partner.joined_at = timezone.now()
-                    group_partner.save()
+        with transaction.atomic():
+            # チャットを削除している参加者がいれば復帰させる
+            partners = reactivate_participants(conversation, user)
 
             message = serializer.save()
+            record_last_message(message)
 
-            if group_partners:
-                user_ids = []
-                for group_partner in group_partners:
-                    partner_id = group_partner.user.id
-                    user_ids.append(partner_id)
-                    partner_online = is_user_online(partner_id, str(conversation.id))
-
-                    if partner_online:
-                        MessageRead.objects.get_or_create(
-                            message=message,
-                            user=partner.user,
-                        )
+            # 画面を開いている参加者はその場で既読にし、配信イベントをアウトボックスに積む
+            self.payload = publish_new_message(
+                message,
+                [partner.user_id for partner in partners],
+                context={"request": self.request},
+            )
 
-                # グループチャットのオンラインユーザーリスト(ID)
-                users_online = get_online_users_in_conversation(user_ids, conversation_id)
-                # 一人でもオンラインのユーザーがいればWebSocketでメッセージを通知
-                if users_online:
-                    channel_layer = get_channel_layer()
-                    safe_message = json.loads(
-                        json.dumps(MessageSerializer(message, context={"request": self.request}).data, default=str)
-                    )
-                    async_to_sync(channel_layer.group_send)(
-                        f"chat_{conversation.id}",
-                        {
-                            "type": "chat.message",  # Consumer 内で定義されているメソッド名に対応
-                            "message": safe_message # 送るメッセージ内容（シリアライズされた辞書）
-                        }
-                    )
-                    
-        # DM
-        else:
-            partner = conversation.participants.exclude(user=user).first()
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
 
-            # DM相手がチャットを削除していたら再度復帰させる
-            if partner and partner.left_at:
-                partner.left_at = None
-                partner.joined_at = timezone.now()
-                partner.save()
+        # WebSocket へ配信したものと同じ JSON 文字列を返す（シリアライズし直さない）
+        return HttpResponse(self.payload, status=status.HTTP_201_CREATED, content_type='application/json')
 
-            message = serializer.save()
 
-            if partner:
-                partner_id = partner.user.id
-                partner_online = is_user_online(partner_id, str(conversation.id))
-
-                if partner_online:
-                    MessageRead.objects.get_or_create(
-                        message=message,
-                        user=partner.user,
-                    )
-
-                    channel_layer = get_channel_layer()
-                    safe_message = json.loads(
-                        json.dumps(MessageSerializer(message, context={"request": self.request}).data, default=str)
-                    )
-                    async_to_sync(channel_layer.group_send)(
-                        f"chat_{conversation.id}",
-                        {
-                            "type": "chat.message",  # Consumer 内で定義されているメソッド名に対応
-                            "message": safe_message # 送るメッセージ内容（シリアライズされた辞書）
-                        }
-                    )
-            else:
-                partner_id = None
-                print("パートナーが見つかりませんでした")
+# --- メッセージの差分同期 ---
+class MessageChangesAPIView(APIView):
+    """
+    前回の同期以降に作成・編集・削除されたメッセージだけを返す（更新順）
+      ?since=<token>&limit=N … token は前回のレスポンスの next（省略時は参加時点から）
+    レスポンス
+      messages … 新着・編集されたメッセージ
+      deleted  … 削除されたメッセージの id と deleted_at（本文は返さない）
+      next     … 次回の since。has_more が true の間は続けて取得する
+    クライアントは id で上書き（upsert）する。同じメッセージが重複して返ることがある
+    """
 
+    permission_classes = [IsCompanyMember,]
+
+    page_size = 100
+    max_page_size = 500
+
+    # 採番（保存）とコミットの順序は前後するので、直近の数秒は次回も読み直す
+    settle_delay = timedelta(seconds=5)
+
+    def get_since(self):
+        token = self.request.query_params.get('since')
+        if not token:
+            return None
+
+        try:
+            updated_at, message_id = decode_cursor(token)
+            updated_at = parse_datetime(updated_at)
+        except (TypeError, ValueError):
+            raise ValidationError({"since": "不正な同期トークンです"})
+        if updated_at is None or not isinstance(message_id, str):
+            raise ValidationError({"since": "不正な同期トークンです"})
+        if timezone.is_naive(updated_at):
+            updated_at = timezone.make_aware(updated_at)
+        return updated_at, message_id
+
+    def get(self, request, *args, **kwargs):
+        participant = get_object_or_404(
+            Participant,
+            user=request.user,
+            conversation_id=self.kwargs['conversation_id'],
+        )
+
+        try:
+            limit = int(request.query_params.get('limit', self.page_size))
+        except ValueError:
+            raise ValidationError({"limit": "数値で指定してください"})
+        limit = max(1, min(limit, self.max_page_size))
+
+        # (conversation, updated_at, id) の索引を範囲検索する
+        changes = Message.objects.filter(
+            conversation_id=participant.conversation_id,
+            created_at__gte=participant.joined_at,
+        )
+        since = self.get_since()
+        if since:
+            updated_at, message_id = since
+            changes = changes.filter(
+                Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=message_id)
+            )
+
+        page = list(changes.select_related('sender').order_by('updated_at', 'id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        position = (page[-1].updated_at, page[-1].id) if page else since
+        if not has_more:
+            settled = (timezone.now() - self.settle_delay, "")
+            position = min(position, settled) if position else settled
+
+        messages = [message for message in page if message.deleted_at is None]
+        serializer = MessageSerializer(
+            messages,
+            many=True,
+            context={'request': request, 'conversation_id': participant.conversation_id},
+        )
+
+        return Response({
+            'messages': serializer.data,
+            'deleted': [
+                {'id': message.id, 'deleted_at': message.deleted_at}
+                for message in page if message.deleted_at is not None
+            ],
+            'next': encode_cursor([position[0].isoformat(), position[1]]),
+            'has_more': has_more,
+        })
+
+
+# --- 添付ファイルの分割アップロード ---
+class FileUploadCreateAPIView(APIView):
+    """
+    アップロードを開始する
+      POST {filename, size, content_type} → {id, offset: 0, chunk_size, ...}
+    続けて upload/<id>/?offset=N へ chunk_size 以下のチャンクを PUT し、最後に finalize する
+    """
+
+    permission_classes = [IsCompanyMember,]
+
+    def post(self, request, *args, **kwargs):
+        participant = get_object_or_404(
+            Participant,
+            user=request.user,
+            conversation_id=self.kwargs['conversation_id'],
+            left_at__isnull=True,
+        )
+
+        serializer = FileUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(conversation_id=participant.conversation_id, uploader=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class FileUploadAPIView(APIView):
+    """
+    GET                  … 受信済みの位置 (offset) を返す。中断後はここから再開する
+    PUT ?offset=<バイト> … 本文（application/octet-stream）を offset の位置に書き込む
+                           offset が受信済みの位置と違う場合は 409 と現在の offset を返す
+    """
+
+    permission_classes = [IsCompanyMember,]
+
+    def get_queryset(self):
+        return FileUpload.objects.filter(uploader=self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        upload = get_object_or_404(self.get_queryset(), pk=self.kwargs['upload_id'])
+        return Response(FileUploadSerializer(upload).data)
+
+    def put(self, request, *args, **kwargs):
+        try:
+            offset = int(request.query_params.get('offset', ''))
+        except ValueError:
+            raise ValidationError({"offset": "数値で指定してください"})
+
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length <= 0:
+            raise ValidationError({"detail": "チャンクが空です"})
+        if length > uploads.CHUNK_SIZE:
+            raise ValidationError({"detail": f"1回に送れるのは {uploads.CHUNK_SIZE} バイトまでです"})
+
+        upload = get_object_or_404(self.get_queryset(), pk=self.kwargs['upload_id'])
+        if upload.status != FileUpload.Status.UPLOADING:
+            raise ValidationError({"detail": "このアップロードは完了しています"})
+        if offset + length > upload.size:
+            raise ValidationError({"detail": "ファイルサイズを超えています"})
+
+        # 通信を待つ間は DB のトランザクション・行ロックを持たない。
+        # 同じアップロードへの書き込みはファイルロックで1本に限り、重なった PUT は 409 で現在位置を返す
+        try:
+            with uploads.chunk_lock(upload):
+                upload.refresh_from_db(fields=['received', 'status'])
+                if upload.status != FileUpload.Status.UPLOADING or offset != upload.received:
+                    return Response({"offset": upload.received}, status=status.HTTP_409_CONFLICT)
+
+                # 本文はパースせず、ストリームから読んだ分をそのままディスクへ書く
+                received = offset + uploads.write_chunk(upload, offset, request.stream, length)
+
+                # 受信位置は書き込み後に条件付き UPDATE で進める（短い1文だけ）
+                advanced = FileUpload.objects.filter(
+                    pk=upload.pk, received=offset, status=FileUpload.Status.UPLOADING,
+                ).update(received=received, updated_at=timezone.now())
+        except BlockingIOError:
+            advanced = 0
+
+        upload.refresh_from_db()
+        if not advanced:
+            return Response({"offset": upload.received}, status=status.HTTP_409_CONFLICT)
+        return Response(FileUploadSerializer(upload).data)
+
+
+class FileUploadFinalizeAPIView(APIView):
+    """
+    全チャンクの受信後に呼ぶ。SHA-256 を求めて保存し、FILE メッセージを作る
+      POST {sha256?} … sha256 を送った場合は一致を確認する（不一致なら最初からやり直し）
+    レスポンスは作成したメッセージ。再送された場合は作成済みのメッセージを返す
+    """
+
+    permission_classes = [IsCompanyMember,]
+
+    def post(self, request, *args, **kwargs):
+        user = request.user
+
+        upload = get_object_or_404(
+            FileUpload.objects.select_related('conversation'),
+            pk=self.kwargs['upload_id'],
+            uploader=user,
+        )
+        if upload.status == FileUpload.Status.COMPLETED:
+            return self.completed(upload)
+
+        if upload.received != upload.size:
+            raise ValidationError({"detail": "すべてのチャンクを受信していません", "offset": upload.received})
+
+        if not Participant.objects.filter(
+            user=user, conversation_id=upload.conversation_id, left_at__isnull=True,
+        ).exists():
+            raise ValidationError({"detail": "この会話に参加していません"})
+
+        # ファイル全体を読むハッシュ計算・ストレージへのコピーはトランザクションの外で行う
+        # （受信し終えたファイルは PUT で書き換えられない。同時の finalize は同じ blob を保存するだけ）
+        digest = uploads.file_sha256(uploads.partial_path(upload))
+        expected = str(request.data.get('sha256') or '').lower()
+        if expected and expected != digest:
+            uploads.discard(upload)
+            FileUpload.objects.filter(
+                pk=upload.pk, status=FileUpload.Status.UPLOADING,
+            ).update(received=0, updated_at=timezone.now())
+            return Response(
+                {"sha256": "ファイルが破損しています。最初からアップロードし直してください", "offset": 0},
+                status=status.HTTP_409_CONFLICT,
+            )
+        stored_name = uploads.store(upload)
+
+        # メッセージ作成だけを短いトランザクションで行う
+        with transaction.atomic():
+            upload = get_object_or_404(
+                FileUpload.objects.select_for_update().select_related('conversation'), pk=upload.pk,
+            )
+            if upload.status == FileUpload.Status.COMPLETED:
+                # 同時に送られた finalize が先に完了した
+                return self.completed(upload)
+
+            upload.sha256 = digest
+            upload.file.name = stored_name
+            # 途中ファイルはコミットできてから消す（失敗したら finalize をやり直せる）
+            transaction.on_commit(lambda: uploads.discard(upload))
+
+            try:
+                partners = reactivate_participants(upload.conversation, user)
+                message = Message.objects.create(
+                    conversation=upload.conversation,
+                    sender=user,
+                    kind=Message.Kind.FILE,
+                    body=uploads.file_body(upload),
+                )
+                record_last_message(message)
+
+                payload = publish_new_message(
+                    message,
+                    [partner.user_id for partner in partners],
+                    context={"request": request},
+                )
+
+                upload.status = FileUpload.Status.COMPLETED
+                upload.message = message
+                upload.save(update_fields=['sha256', 'file', 'status', 'message', 'updated_at'])
+            except Exception:
+                # メッセージを作れなかった場合は保存したファイルを残さない
+                upload.file.delete(save=False)
+                raise
+
+        return HttpResponse(payload, status=status.HTTP_201_CREATED, content_type='application/json')
+
+    def completed(self, upload):
+        message = get_object_or_404(Message.objects.select_related('sender'), pk=upload.message_id)
+        return Response(MessageSerializer(message, context={'request': self.request}).data)
+
+
+
+# --- メッセージ検索 ---
+class MessageSearchAPIView(APIView):
+    """
+    参加中の会話のメッセージを本文で検索する（新しい順）
+      ?q=<語 語...>        … 空白区切りの語をすべて含むメッセージ
+      ?conversation=<id>   … 会話を指定して絞り込む
+      ?before=<ulid>&limit=N … 指定メッセージより古いN件（続きは X-Next-Cursor ヘッダーの ULID）
+    snippet は HTML エスケープ済みで、一致部分だけを <mark> で囲む
+    """
+
+    permission_classes = [IsCompanyMember,]
+
+    page_size = 20
+    max_page_size = 100
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+
+        query = params.get('q', '').strip()
+        if not query:
+            raise ValidationError({"q": "検索語を入力してください"})
+
+        before = params.get('before')
+        if before is not None and not is_valid_ulid(before):
+            raise ValidationError({"before": "不正なメッセージIDです"})
+
+        conversation_id = params.get('conversation')
+        if conversation_id:
+            try:
+                conversation_id = uuid.UUID(conversation_id)
+            except ValueError:
+                raise ValidationError({"conversation": "不正な会話IDです"})
+
+        try:
+            limit = int(params.get('limit', self.page_size))
+        except ValueError:
+            raise ValidationError({"limit": "数値で指定してください"})
+        limit = max(1, min(limit, self.max_page_size))
+
+        hits = search_messages(
+            request.user,
+            query,
+            before=before.upper() if before else None,
+            limit=limit + 1,
+            conversation_id=conversation_id,
+        )
+        has_next = len(hits) > limit
+        hits = hits[:limit]
+
+        messages = Message.objects.select_related('sender').in_bulk([hit.message_id for hit in hits])
+        serializer_context = {'request': request}
+
+        results = [
+            {
+                'message': MessageSerializer(messages[hit.message_id], context=serializer_context).data,
+                'snippet': hit.snippet,
+            }
+            for hit in hits
+            if hit.message_id in messages
+        ]
+
+        response = Response(results)
+        if has_next:
+            response['X-Next-Cursor'] = hits[-1].message_id
+        return response
 
 
 # --- グループチャット招待処理 ---
@@ -433,22 +791,53 @@ class InvitationConversationAPIView(UpdateModelMixin, GenericAPIView):
             return InvitationUpdateSerializer
         return InvitationConversationSerializer
     
+    candidate_page_size = 50
+
     # グループに参加していないユーザー一覧取得
+    #   ?q=<文字列>   … username / account_id の前方一致（全角半角・カナ・大小文字を区別しない）
+    #   ?cursor=<値>  … 前のレスポンスの X-Next-Cursor ヘッダーの値
     def get(self, request, *args, **kwargs):
         conversation_id = self.kwargs.get('conversation_id')
         conversation = get_object_or_404(Conversation, id=conversation_id)
 
-        # 会社内の全ユーザー
-        company_users = User.objects.filter(company=request.user.company)
+        # 会社内の全ユーザーから、参加済みのユーザーを NOT EXISTS で除く
+        candidates = (
+            User.objects
+            .filter(company=request.user.company)
+            .filter(~Exists(Participant.objects.filter(conversation=conversation, user=OuterRef('pk'))))
+        )
+
+        query = normalize_search_text(request.query_params.get('q', ''))
+        if query:
+            name_from, name_to = prefix_range(query)
+            account_from, account_to = prefix_range(query.lstrip('@'))
+            candidates = candidates.filter(
+                Q(search_username__gte=name_from, search_username__lt=name_to)
+                | Q(search_account_id__gte=account_from, search_account_id__lt=account_to)
+            )
 
-        # すでに参加済みのユーザー
-        joined_user_ids = conversation.participants.values_list('user_id', flat=True)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                name, user_id = decode_cursor(cursor)
+            except (TypeError, ValueError):
+                raise ValidationError({"cursor": "不正なカーソルです"})
+            # 形は正しくても [名前, ID] でないもの（[1, 2] など）は受け付けない
+            if not isinstance(name, str) or isinstance(user_id, bool) or not isinstance(user_id, int):
+                raise ValidationError({"cursor": "不正なカーソルです"})
+            candidates = candidates.filter(
+                Q(search_username__gt=name) | Q(search_username=name, id__gt=user_id)
+            )
 
-        # 未参加のユーザーのみ返す
-        candidates = company_users.exclude(id__in=joined_user_ids).order_by('username')
+        page = list(candidates.order_by('search_username', 'id')[:self.candidate_page_size + 1])
+        has_next = len(page) > self.candidate_page_size
+        page = page[:self.candidate_page_size]
 
-        serializer = SimpleUserSerializer(candidates, many=True)
-        return Response(serializer.data)
+        serializer = SimpleUserSerializer(page, many=True)
+        response = Response(serializer.data)
+        if has_next:
+            response['X-Next-Cursor'] = encode_cursor([page[-1].search_username, page[-1].id])
+        return response
 
 
     def post(self, request, *args, **kwargs):
@@ -459,43 +848,46 @@ class InvitationConversationAPIView(UpdateModelMixin, GenericAPIView):
         conversation = get_object_or_404(Conversation, id=conversation_id)
 
         invited_by = request.user
-        partner_ids = serializer.validated_data["partners"]
+        partner_ids = list(dict.fromkeys(serializer.validated_data["partners"]))
 
-        created = []
-        already_invited = []
-
-        for partner_id in partner_ids:
-            if InvitationConversation.objects.filter(conversation=conversation, invitee__id=partner_id).exists():
-                already_invited.append(partner_id)
-                continue
-
-            try:
-                invitee = User.objects.get(id=partner_id)
-            except User.DoesNotExist:
-                #後々ログを追加してください
-                continue
+        # 招待対象をクエリ1本で取得（存在しない ID は無視）
+        users = User.objects.filter(id__in=partner_ids).in_bulk()
+        invitees = [users[partner_id] for partner_id in partner_ids if partner_id in users]
 
-            if invitee.company != request.user.company:
-                raise ValidationError('会社が違います')
+        if any(invitee.company_id != request.user.company_id for invitee in invitees):
+            raise ValidationError('会社が違います')
 
-            InvitationConversation.objects.create(
-                conversation=conversation,
-                invited_by=invited_by,
-                invitee=invitee,
+        with transaction.atomic():
+            # 同じ会話への招待を直列にし、招待済みかどうかはロックを取ってから確かめる
+            # （同時に同じ人を招待しても、招待とシステムメッセージは先に来た1回だけ）
+            Conversation.objects.select_for_update().filter(pk=conversation.pk).first()
+            invited_ids = set(
+                InvitationConversation.objects
+                .filter(conversation=conversation, invitee_id__in=[invitee.id for invitee in invitees])
+                .values_list('invitee_id', flat=True)
             )
-            created.append(partner_id)
-
-            if created:
-                Message.objects.create(
-                    conversation=conversation,
-                    sender=invited_by,
-                    kind='system',
-                    body={'text': f"{invited_by.username}さんが{invitee.username}さんを招待しました"}
+            new_invitees = [invitee for invitee in invitees if invitee.id not in invited_ids]
+
+            if new_invitees:
+                InvitationConversation.objects.bulk_create(
+                    [
+                        InvitationConversation(
+                            conversation=conversation,
+                            invited_by=invited_by,
+                            invitee=invitee,
+                        )
+                        for invitee in new_invitees
+                    ],
+                    ignore_conflicts=True,
                 )
 
+                # 何人招待してもシステムメッセージ・WebSocket 通知は1回
+                create_system_message(conversation, invited_by, invitation_text(invited_by, new_invitees))
+                notify_invitations(conversation, invited_by, [invitee.id for invitee in new_invitees])
+
         return Response({
-            "created": created,
-            "already_invited": already_invited
+            "created": [invitee.id for invitee in new_invitees],
+            "already_invited": [invitee.id for invitee in invitees if invitee.id in invited_ids],
         }, status=status.HTTP_201_CREATED)
     
 
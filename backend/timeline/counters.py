@@ -0,0 +1,64 @@
+# timeline/counters.py
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Like, Post, PostReadStatus
+
+# Post の集計列 → 数える元の表
+COUNTERS = {
+    "likes_count": Like,
+    "comments_count": Comment,
+    "read_count": PostReadStatus,
+}
+
+
+def adjust(post_id, field: str, delta: int) -> None:
+    """
+    集計列を UPDATE ... SET x = x + delta で増減する（読み出してから書かないので同時更新でずれない）。
+    いいね・コメント・既読の作成/削除と同じトランザクションで呼ぶ。
+    """
+    qs = Post.objects.filter(pk=post_id)
+    if delta < 0:
+        # 何かの理由でずれていても負にはしない（reconcile_post_counters で直る）
+        qs = qs.filter(**{f"{field}__gte": -delta})
+    qs.update(**{field: F(field) + delta})
+
+
+def actual_counts():
+    """集計列ごとに、元の表を数え直す相関サブクエリ"""
+    return {
+        field: Coalesce(
+            Subquery(
+                model.objects.filter(post=OuterRef('pk'))
+                .order_by()
+                .values('post')
+                .annotate(n=Count('pk'))
+                .values('n'),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+        for field, model in COUNTERS.items()
+    }
+
+
+def reconcile(queryset=None, dry_run: bool = False) -> int:
+    """
+    集計列を元の表と突き合わせ、ずれている投稿だけ書き直す。直した（直すべき）件数を返す。
+    ユーザー削除の CASCADE など、ビューを通らない削除でずれた分を直す。
+    """
+    queryset = Post.objects.all() if queryset is None else queryset
+    actual = {f"actual_{field}": expr for field, expr in actual_counts().items()}
+    mismatch = Q()
+    for field in COUNTERS:
+        mismatch |= ~Q(**{field: F(f"actual_{field}")})
+
+    drifted = list(
+        queryset.order_by().annotate(**actual).filter(mismatch).values('pk', *actual)
+    )
+    if not dry_run:
+        for row in drifted:
+            Post.objects.filter(pk=row['pk']).update(
+                **{field: row[f"actual_{field}"] for field in COUNTERS}
+            )
+    return len(drifted)
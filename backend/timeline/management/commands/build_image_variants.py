@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from timeline.models import Post, PostImage
+from timeline.variants import POST_IMAGE_VARIANTS
+
+
+class Command(BaseCommand):
+    help = "縮小版の無い投稿画像（導入前の投稿など）のサムネイル・中サイズを作る"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="作成済みのものも作り直す")
+        parser.add_argument('--workers', type=int, default=None, help="並列に処理するプロセス数")
+
+    def handle(self, *args, **options):
+        failed = []
+
+        def on_error(model, pk, source_name, exc):
+            failed.append(pk)
+            self.stderr.write(f"{model._meta.label} pk={pk} {source_name}: {exc}")
+
+        built = sum(
+            POST_IMAGE_VARIANTS.backfill(
+                model.objects.all(), rebuild=options['all'], workers=options['workers'], on_error=on_error,
+            )
+            for model in (Post, PostImage)
+        )
+        self.stdout.write(f"{built} 枚作成しました" + (f"（失敗 {len(failed)} 枚）" if failed else ""))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from timeline.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "投稿のいいね数・コメント数・既読数を元の表から数え直し、ずれていれば直す"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="件数を表示するだけで書き換えない")
+
+    def handle(self, *args, **options):
+        fixed = reconcile(dry_run=options['dry_run'])
+        verb = "ずれています" if options['dry_run'] else "直しました"
+        self.stdout.write(f"{fixed} 件の投稿の集計が{verb}")
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timeline', '0008_alter_postimage_post'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='postimage',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:03
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    # 既存の投稿の集計を1回の UPDATE（相関サブクエリ）で埋める
+    Post = apps.get_model('timeline', 'Post')
+
+    def count(model_name):
+        model = apps.get_model('timeline', model_name)
+        rows = (
+            model.objects.filter(post=OuterRef('pk'))
+            .order_by()
+            .values('post')
+            .annotate(n=Count('pk'))
+            .values('n')
+        )
+        return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+    Post.objects.update(
+        likes_count=count('Like'),
+        comments_count=count('Comment'),
+        read_count=count('PostReadStatus'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timeline', '0009_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='read_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -32,12 +32,21 @@ class Post(models.Model):
     image = models.ImageField(
         upload_to='post_images/', null=True, blank=True
     )
+    # 1枚目の縮小版 {"thumb": {"width", "height", "webp", "jpeg"}, "medium": {...}}（保存名。timeline.variants が作る）
+    image_variants = models.JSONField(default=dict, blank=True)
 
     # ---- メタ情報 ----
     views = models.PositiveIntegerField(default=0)
+    # いいね・コメント・既読の数（timeline.counters が F() で増減する。ずれは reconcile_post_counters で直す）
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+    read_count = models.PositiveIntegerField(default=0)
     is_important = models.BooleanField(default=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # 縮小版の保存名も blob の参照として数える
+    blob_json_fields = ("image_variants",)
+
     class Meta:
         indexes = [
             models.Index(fields=['company', '-created_at']),
@@ -60,6 +69,19 @@ class Post(models.Model):
 
         return urls
 
+    @cached_property
+    def all_image_variants(self):
+        # all_image_urls と同じ順番。縮小版がまだ無い画像は None
+        variants = []
+
+        if self.image:
+            variants.append(self.image_variants or None)
+
+        for s in self.sub_images.all()[:3]:
+            variants.append(s.image_variants or None)
+
+        return variants
+
     
 
 class PostImage(models.Model):
@@ -72,8 +94,12 @@ class PostImage(models.Model):
         related_name='sub_images',
     )
     image = models.ImageField(upload_to="post_images/")
+    image_variants = models.JSONField(default=dict, blank=True)
     order = models.PositiveSmallIntegerField(default=1)  # 1〜3
 
+    # 縮小版の保存名も blob の参照として数える
+    blob_json_fields = ("image_variants",)
+
     class Meta:
         ordering = ["order"]
         unique_together = ("post", "order")  # 同じ順序の重複防止
@@ -1,11 +1,13 @@
 from rest_framework import serializers
 from .models import Post, Comment, PostImage       # ★ PostImage を追加
+from .variants import variant_urls
+from users.avatars import AvatarField
 
 class PostSerializer(serializers.ModelSerializer):
     # ------- ユーザー情報 -------
     user_username   = serializers.CharField(source='user.username', read_only=True)
     user_account_id = serializers.CharField(source='user.account_id', read_only=True)
-    user_iconimg    = serializers.ImageField(source='user.iconimg', read_only=True)
+    user_iconimg    = AvatarField(source='user.iconimg', read_only=True)
 
     # ------- ログインユーザー -------
     user_id = serializers.IntegerField(source='user.id', read_only=True)
@@ -14,15 +16,15 @@ class PostSerializer(serializers.ModelSerializer):
     is_important = serializers.BooleanField(required=False, default=False)
 
     # ------- いいね -------
-    likes_count = serializers.IntegerField(read_only=True, default=0)
+    likes_count = serializers.IntegerField(read_only=True)
     is_liked    = serializers.BooleanField(read_only=True, default=False)
 
     # ------- コメント数 -------
-    comments_count = serializers.IntegerField(read_only=True, default=0)
+    comments_count = serializers.IntegerField(read_only=True)
 
     # ------- 既読 -------
     is_read    = serializers.BooleanField(read_only=True, default=False)
-    read_count = serializers.IntegerField(read_only=True, default=0)
+    read_count = serializers.IntegerField(read_only=True)
 
     # ------- 画像(2〜4枚目) ------- ★追加
     images = serializers.SerializerMethodField()
@@ -31,6 +33,16 @@ class PostSerializer(serializers.ModelSerializer):
         """1枚目＋サブ画像の URL 一覧を順番付きで返す"""
         return obj.all_image_urls
 
+    # ------- 画像の縮小版 -------
+    image_variants = serializers.SerializerMethodField()
+
+    def get_image_variants(self, obj):
+        """
+        images と同じ順番で {"thumb": {width, height, webp, jpeg}, "medium": {...}} を返す
+        （作成前の画像は null。クライアントは images の原寸 URL を使う）
+        """
+        return [variant_urls(variants) for variants in obj.all_image_variants]
+
     class Meta:
         model  = Post
         fields = [
@@ -43,6 +55,7 @@ class PostSerializer(serializers.ModelSerializer):
             'content',
             'image',          # 1枚目（後方互換）
             'images',         # 1〜4 枚の URL 配列  ←★
+            'image_variants', # images と同じ順番の縮小版 URL
             'views',
             'likes_count',
             'is_liked',
@@ -67,7 +80,7 @@ class PostSerializer(serializers.ModelSerializer):
 class CommentSerializer(serializers.ModelSerializer):
     user_username   = serializers.CharField(source='user.username',   read_only=True)
     user_account_id = serializers.CharField(source='user.account_id', read_only=True)
-    user_iconimg    = serializers.ImageField(source='user.iconimg',   read_only=True)
+    user_iconimg    = AvatarField(source='user.iconimg',   read_only=True)
 
     class Meta:
         model  = Comment
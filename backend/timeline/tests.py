@@ -1,3 +1,91 @@
-from django.test import TestCase
+import io
 
-# Create your tests here.
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from utils.testing import CompanyMemberMixin, TempMediaRootMixin
+from .models import Like, Post
+
+
+def camera_jpeg(size=(2400, 1800)):
+    """向き (Orientation=6: 90度回転) と撮影情報の EXIF が付いた JPEG"""
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    exif[0x010F] = "TestCamera"
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 120, 40)).save(buffer, "JPEG", exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@override_settings(IMAGE_VARIANTS_MODE='inline')
+class PostImageVariantTests(TempMediaRootMixin, CompanyMemberMixin, TestCase):
+
+    def test_variants_are_resized_and_stripped(self):
+        data = camera_jpeg()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/posts/create/', {
+                'content': '現場写真',
+                'images[0]': SimpleUploadedFile('scaled_PXL_1.jpg', data, content_type='image/jpeg'),
+                'images': [SimpleUploadedFile('PXL_2.jpg', camera_jpeg((600, 400)), content_type='image/jpeg')],
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        post = self.client.get('/api/posts/').json()[0]
+        self.assertEqual(len(post['image_variants']), len(post['images']))
+
+        thumb = post['image_variants'][0]['thumb']
+        # EXIF の向きを反映した縦長で、幅は 320px
+        self.assertEqual((thumb['width'], thumb['height']), (320, 427))
+        for fmt in ('webp', 'jpeg'):
+            name = thumb[fmt][len('/media/'):]
+            with default_storage.open(name) as f, Image.open(f) as img:
+                self.assertEqual(img.size, (320, 427))
+                self.assertNotIn('exif', img.info)
+
+        # 元画像より大きな縮小版は作らない
+        medium = post['image_variants'][-1]['medium']
+        self.assertEqual((medium['width'], medium['height']), (400, 600))
+
+        variants = Post.objects.get().image_variants
+        self.assertEqual(set(variants), {'thumb', 'medium'})
+
+
+class PostCounterTests(CompanyMemberMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = self.create_user('other')
+        self.post = Post.objects.create(user=self.other, company=self.company, content='朝礼')
+
+    def counts(self):
+        self.post.refresh_from_db()
+        return self.post.likes_count, self.post.comments_count, self.post.read_count
+
+    def test_counters_follow_likes_comments_and_reads(self):
+        self.assertEqual(self.client.post(f'/api/posts/{self.post.pk}/like/').json()['likes_count'], 1)
+        self.client.post(f'/api/posts/{self.post.pk}/read/')
+        self.assertEqual(self.client.post(f'/api/posts/{self.post.pk}/read/').json()['read_count'], 1)
+        comment_id = self.client.post(f'/api/posts/{self.post.pk}/comments/', {'content': '了解'}).json()['id']
+        self.client.post(f'/api/posts/{self.post.pk}/comments/', {'content': '確認しました'})
+        self.assertEqual(self.counts(), (1, 2, 1))
+
+        self.assertEqual(self.client.post(f'/api/posts/{self.post.pk}/like/').json()['likes_count'], 0)
+        self.assertEqual(self.client.delete(f'/api/posts/comments/{comment_id}/').status_code, 204)
+        self.assertEqual(self.counts(), (0, 1, 1))
+
+        # 一覧は集計列をそのまま返す（いいね・コメント・既読の表を JOIN しない）
+        with self.assertNumQueries(2):
+            post = self.client.get('/api/posts/').json()[0]
+        self.assertEqual((post['likes_count'], post['comments_count'], post['read_count']), (0, 1, 1))
+
+    def test_reconcile_fixes_drift(self):
+        # ビューを通らない作成・削除でずれた集計
+        Like.objects.create(post=self.post, user=self.me)
+        Post.objects.filter(pk=self.post.pk).update(comments_count=5)
+
+        out = io.StringIO()
+        call_command('reconcile_post_counters', stdout=out)
+        self.assertIn('1 件', out.getvalue())
+        self.assertEqual(self.counts(), (1, 0, 0))
@@ -0,0 +1,21 @@
+# timeline/variants.py
+from django.conf import settings
+
+from utils.image_variants import ImageVariants
+
+# フィード用の縮小版（幅 px）。元画像より大きくはしない
+POST_IMAGE_VARIANTS = ImageVariants(
+    field='image',
+    widths=getattr(settings, 'TIMELINE_IMAGE_WIDTHS', {"thumb": 320, "medium": 1080}),
+    directory='post_variants/',
+)
+
+
+# 投稿（1枚目）とサブ画像の縮小版をコミット後に作る
+def schedule_post_variants(post, sub_images=()) -> None:
+    POST_IMAGE_VARIANTS.schedule([post, *sub_images])
+
+
+# 保存名 → URL（シリアライザー用）
+def variant_urls(variants):
+    return POST_IMAGE_VARIANTS.urls(variants)
@@ -6,8 +6,11 @@ from django.shortcuts import get_object_or_404
 from .permissions import IsCompanyMember, IsCommentAuthorOrCompanyAdmin
 from .models import Post, Like, Comment, PostReadStatus, PostImage 
 from .serializers import PostSerializer, CommentSerializer
+from .variants import schedule_post_variants
+from . import counters
 from drf_spectacular.utils import extend_schema
-from django.db.models import Count, Exists, OuterRef, Prefetch
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
 
 # --- 投稿一覧API ---
 @extend_schema(
@@ -36,10 +39,8 @@ class PostListView(generics.ListAPIView):
                         queryset=PostImage.objects.order_by('order')
                     )
                 )
+                # いいね・コメント・既読の数は Post の集計列をそのまま使う（JOIN しない）
                 .annotate(
-                    likes_count    = Count('likes'),
-                    comments_count = Count('comments'),
-                    read_count     = Count('read_statuses'),
                     is_liked       = Exists(Like.objects.filter(post=OuterRef('pk'), user=user)),
                     is_read        = Exists(PostReadStatus.objects.filter(post=OuterRef('pk'), user=user)),
                 )
@@ -79,12 +80,17 @@ class PostCreateView(generics.CreateAPIView):
         # --------------- 2〜4枚目 ---------------
         extras = [f for f in files.getlist('images') if f != first_image][:3]
 
-        for idx, img in enumerate(extras, start=1):      # order=1,2,3
+        sub_images = [
             PostImage.objects.create(
                 post  = post,
                 image = img,
                 order = idx,
             )
+            for idx, img in enumerate(extras, start=1)   # order=1,2,3
+        ]
+
+        # サムネイル・中サイズはコミット後にプロセスプールで作る
+        schedule_post_variants(post, sub_images)
 
 
 # ------- いいねトグル -------
@@ -99,20 +105,21 @@ class PostLikeToggleView(APIView):
         post = generics.get_object_or_404(
             Post, pk=pk, company=request.user.company
         )
-        like, created = Like.objects.get_or_create(
-            post=post, user=request.user
-        )
-        if not created:
-            # すでに存在 → いいね解除
-            like.delete()
+        with transaction.atomic():
+            like, created = Like.objects.get_or_create(
+                post=post, user=request.user
+            )
+            if created:
+                counters.adjust(post.pk, 'likes_count', +1)
+            # すでに存在 → いいね解除（同時に解除されていたら数えない）
+            elif Like.objects.filter(pk=like.pk).delete()[0]:
+                counters.adjust(post.pk, 'likes_count', -1)
 
         # 最新状態を返す（likes_count / is_liked 付き）
         post_refresh = (
             Post.objects
             .filter(pk=pk)
             .annotate(
-                likes_count=Count('likes'),
-                comments_count=Count('comments'),
                 is_liked=Exists(
                     Like.objects.filter(post=OuterRef('pk'), user=request.user)
                 )
@@ -148,11 +155,13 @@ class CommentListCreateView(generics.ListCreateAPIView):
         post = get_object_or_404(
             Post, id=self.kwargs['post_id'], company=self.request.user.company
         )
-        serializer.save(
-            user=self.request.user,
-            post=post,
-            company=post.company,
-        )
+        with transaction.atomic():
+            serializer.save(
+                user=self.request.user,
+                post=post,
+                company=post.company,
+            )
+            counters.adjust(post.pk, 'comments_count', +1)
 
 
 # ------- 詳細 / 更新 / 削除 -------
@@ -171,6 +180,15 @@ class CommentRetrieveUpdateDestroyView(
     def get_queryset(self):
         company = self.request.user.company
         return Comment.objects.filter(company=company).select_related('user')
+
+    def delete(self, request, *args, **kwargs):
+        return self.destroy(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # 同時に削除されていたら数えない
+            if Comment.objects.filter(pk=instance.pk).delete()[0]:
+                counters.adjust(instance.post_id, 'comments_count', -1)
     
 
 
@@ -188,7 +206,10 @@ class PostReadView(APIView):
         )
 
         # ★ 既読レコードを作成（同一ユーザ・投稿ペアは unique_together）
-        PostReadStatus.objects.get_or_create(post=post, user=request.user)
+        with transaction.atomic():
+            _, created = PostReadStatus.objects.get_or_create(post=post, user=request.user)
+            if created:
+                counters.adjust(post.pk, 'read_count', +1)
 
         # 最新状態（is_read / read_count）を返す
         post_refresh = (
@@ -200,7 +221,6 @@ class PostReadView(APIView):
                         post=OuterRef('pk'), user=request.user
                     )
                 ),
-                read_count=Count('read_statuses'),
             )
             .select_related('user')
             .get()
@@ -0,0 +1,39 @@
+# users/avatars.py
+from django.db.models.fields.files import FieldFile
+from rest_framework import serializers
+
+from utils.image_variants import ImageVariants
+
+# アイコンは中央を正方形に切り抜き、辺の長さ px ごとに WebP で持つ
+AVATAR_SIZES = {"64": 64, "128": 128, "256": 256}
+# 一覧・メッセージの丸アイコン（40dp × 端末の倍率）に使う大きさ
+AVATAR_SMALL = "128"
+
+
+def avatar_variants(field: str) -> ImageVariants:
+    return ImageVariants(field=field, widths=AVATAR_SIZES, directory='avatar_variants/', formats=("webp",), square=True)
+
+
+USER_ICON_VARIANTS = avatar_variants('iconimg')
+CONVERSATION_ICON_VARIANTS = avatar_variants('icon')
+
+
+class AvatarField(serializers.ImageField):
+    """
+    アイコン画像を `size` の縮小版の URL で返す（縮小版がまだ無ければ元画像）。
+    縮小版は同じモデルの `<画像フィールド>_variants` から引く。書き込みは ImageField と同じ。
+    """
+
+    def __init__(self, size: str = AVATAR_SMALL, **kwargs):
+        self.size = size
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        file = super().get_attribute(instance)
+        if not file:
+            return None
+
+        owner = file.instance
+        variants = getattr(owner, f"{file.field.name}_variants", None) or {}
+        name = variants.get(self.size, {}).get("webp")
+        return FieldFile(owner, file.field, name) if name else file
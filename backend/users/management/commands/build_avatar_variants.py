@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import Conversation
+from users.avatars import CONVERSATION_ICON_VARIANTS, USER_ICON_VARIANTS
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "縮小版の無いユーザーアイコン・チャットアイコン（導入前のものなど）の 64/128/256px 版を作る"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="作成済みのものも作り直す")
+        parser.add_argument('--workers', type=int, default=None, help="並列に処理するプロセス数")
+
+    def handle(self, *args, **options):
+        failed = []
+
+        def on_error(model, pk, source_name, exc):
+            failed.append(pk)
+            self.stderr.write(f"{model._meta.label} pk={pk} {source_name}: {exc}")
+
+        built = sum(
+            variants.backfill(
+                model.objects.all(), rebuild=options['all'], workers=options['workers'], on_error=on_error,
+            )
+            for model, variants in ((CustomUser, USER_ICON_VARIANTS), (Conversation, CONVERSATION_ICON_VARIANTS))
+        )
+        self.stdout.write(f"{built} 件作成しました" + (f"（失敗 {len(failed)} 件）" if failed else ""))
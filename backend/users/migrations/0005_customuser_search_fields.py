@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:41
+
+from django.db import migrations, models
+
+from utils.text import normalize_search_text
+
+
+# 既存ユーザーの検索用カラムを埋める
+def backfill_search_fields(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+
+    users = list(CustomUser.objects.only('id', 'username', 'account_id'))
+    for user in users:
+        user.search_username = normalize_search_text(user.username)[:50]
+        user.search_account_id = normalize_search_text(user.account_id).lstrip('@')[:30]
+    CustomUser.objects.bulk_update(users, ['search_username', 'search_account_id'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('companies', '0003_invitecode'),
+        ('users', '0004_alter_customuser_username'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='search_account_id',
+            field=models.CharField(blank=True, default='', editable=False, max_length=30),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='search_username',
+            field=models.CharField(blank=True, default='', editable=False, max_length=50),
+        ),
+        migrations.RunPython(backfill_search_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['company', 'search_username'], name='user_company_search_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['company', 'search_account_id'], name='user_company_search_acct_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_customuser_search_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='iconimg_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -3,6 +3,7 @@ from django.db import models
 from companies.models import Company
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.base_user import BaseUserManager
+from utils.text import normalize_search_text
 
 # ユーザーの役職を表す列挙型
 class Role(models.TextChoices):
@@ -26,6 +27,8 @@ class CustomUser(AbstractUser):
 
     # プロフィールアイコン
     iconimg = models.ImageField(upload_to='profile_icons/', null=True, blank=True)
+    # 正方形に切り抜いた縮小版（users.avatars。{"64": {"width", "height", "webp"}, ...}）
+    iconimg_variants = models.JSONField(default=dict, blank=True)
 
     # 自己紹介文
     bio = models.TextField(blank=True)
@@ -42,11 +45,42 @@ class CustomUser(AbstractUser):
     # 登録日時
     date_joined = models.DateTimeField(auto_now_add=True)
 
+    # 検索用に正規化した username / account_id（全角半角・カナ・大小文字を吸収、save 時に更新）
+    search_username = models.CharField(max_length=50, blank=True, default="", editable=False)
+    search_account_id = models.CharField(max_length=30, blank=True, default="", editable=False)
+
     # ログイン認証で使うフィールド
     USERNAME_FIELD = 'email'
     # ユーザー作成時に必要なフィールド
     REQUIRED_FIELDS = ['account_id', 'username']
 
+    # blobs の参照数に数える JSONField
+    blob_json_fields = ("iconimg_variants",)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # 社内ユーザーの前方一致検索用
+            models.Index(fields=("company", "search_username"), name="user_company_search_name_idx"),
+            models.Index(fields=("company", "search_account_id"), name="user_company_search_acct_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        # NFKC で文字数が増えることがあるので列の長さで切る
+        self.search_username = normalize_search_text(self.username)[:50]
+        # 検索時は先頭の @ を付けても付けなくても一致させる
+        self.search_account_id = normalize_search_text(self.account_id).lstrip("@")[:30]
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if "username" in update_fields:
+                update_fields.add("search_username")
+            if "account_id" in update_fields:
+                update_fields.add("search_account_id")
+            kwargs["update_fields"] = update_fields
+
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.email
 
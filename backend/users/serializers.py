@@ -16,6 +16,7 @@ from rest_framework_simplejwt.tokens import RefreshToken
 
 from companies.models import Company  # 明示インポート
 from companies.serializers import CompanyCreateSerializer
+from .avatars import USER_ICON_VARIANTS, AvatarField
 
 User = get_user_model()
 
@@ -35,7 +36,8 @@ def normalize_email(value: str) -> str:
 # 1. ユーザー情報シリアライザ（参照用）
 # --------------------------------------------------
 class SimpleUserSerializer(serializers.ModelSerializer):
-    iconimg = serializers.ImageField(use_url=True)
+    # 一覧・メッセージ用の小さいアイコン
+    iconimg = AvatarField(use_url=True)
 
     class Meta:
         model = User
@@ -43,7 +45,8 @@ class SimpleUserSerializer(serializers.ModelSerializer):
 
 
 class FullUserSerializer(serializers.ModelSerializer):
-    iconimg = serializers.ImageField(use_url=True)
+    # プロフィール画面用の大きいアイコン
+    iconimg = AvatarField(size="256", use_url=True)
     company = CompanyCreateSerializer(read_only=True)
 
     class Meta:
@@ -165,6 +168,7 @@ class CustomUserCreateSerializer(serializers.ModelSerializer):
 
         user.set_password(password)
         user.save(update_fields=["password"])
+        USER_ICON_VARIANTS.schedule([user])
 
         refresh = RefreshToken.for_user(user)
         return {
@@ -194,5 +198,8 @@ class UserUpdateSerializer(serializers.ModelSerializer):
         instance.account_id = validated_data.get('account_id', instance.account_id)
         instance.iconimg = validated_data.get('iconimg', instance.iconimg)
         instance.save()
+        if 'iconimg' in validated_data:
+            # 正方形の縮小版をコミット後に作る（それまでは元画像を返す）
+            USER_ICON_VARIANTS.schedule([instance])
         return instance
 
@@ -1,3 +1,80 @@
-from django.test import TestCase
+import io
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+from chat.models import Conversation
+from chat.serializers import ConversationSerializer
+from utils.testing import CompanyMemberMixin, TempMediaRootMixin
+from .serializers import SimpleUserSerializer
+
+
+def photo(size=(1200, 800), fmt="JPEG"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (40, 120, 200)).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+@override_settings(IMAGE_VARIANTS_MODE='inline')
+class AvatarVariantTests(TempMediaRootMixin, CompanyMemberMixin, TestCase):
+
+    def assertSquareWebp(self, url, edge):
+        with default_storage.open(url[len('/media/'):]) as f, Image.open(f) as img:
+            self.assertEqual(img.format, 'WEBP')
+            self.assertEqual(img.size, (edge, edge))
+
+    def test_profile_icon_upload_builds_square_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/users/current/update/', {
+                'iconimg': SimpleUploadedFile('icon.jpg', photo(), content_type='image/jpeg'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+
+        self.me.refresh_from_db()
+        self.assertEqual(set(self.me.iconimg_variants), {'64', '128', '256'})
+        icon = SimpleUserSerializer(self.me).data['iconimg']
+        self.assertNotEqual(icon, self.me.iconimg.url)
+        self.assertSquareWebp(icon, 128)
+
+        # 差し替えたら古い縮小版は返さない
+        self.me.iconimg_variants = {}
+        self.assertEqual(SimpleUserSerializer(self.me).data['iconimg'], self.me.iconimg.url)
+
+    def test_dm_created_with_icon_builds_variants(self):
+        partner = self.create_user('partner')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/chat/conversation/create/', {
+                'is_group': False,
+                'partner': partner.id,
+                'icon': SimpleUploadedFile('dm.png', photo((300, 300), 'PNG')),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+
+        conversation = Conversation.objects.get(pk=response.json()['id'])
+        self.assertEqual(set(conversation.icon_variants), {'64', '128', '256'})
+
+    def test_conversation_icon_and_backfill(self):
+        conversation = Conversation.objects.create(company=self.company, title='現場', is_group=True)
+        serializer = ConversationSerializer(
+            conversation, data={'icon': SimpleUploadedFile('g.png', photo((300, 500), 'PNG'))}, partial=True,
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+
+        conversation.refresh_from_db()
+        # 元画像より大きい版は作らない
+        self.assertEqual(conversation.icon_variants['256']['width'], 256)
+        self.assertSquareWebp(ConversationSerializer(conversation).data['icon'], 128)
+
+        # 導入前のアイコンはコマンドでまとめて作る
+        self.me.iconimg.save('old.jpg', ContentFile(photo()))
+        self.assertEqual(self.me.iconimg_variants, {})
+        call_command('build_avatar_variants', workers=1, stdout=io.StringIO())
+
+        self.me.refresh_from_db()
+        self.assertEqual(self.me.iconimg_variants['64']['height'], 64)
+        self.assertSquareWebp(SimpleUserSerializer(self.me).data['iconimg'], 128)
@@ -0,0 +1,160 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+
+from utils.images import render_variants
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg"}
+
+
+class ImageVariants:
+    """
+    画像フィールド `field` の縮小版を作り、保存名を JSONField `<field>_variants` に記録する。
+      {"thumb": {"width": 320, "height": 240, "webp": "blobs/...", "jpeg": "blobs/..."}, ...}
+    作成はコミット後に行い、CPU を使う処理はプロセスプールで実行する（IMAGE_VARIANTS_MODE）。
+    """
+
+    def __init__(self, field: str, widths: dict, directory: str, formats=("webp", "jpeg"), square: bool = False):
+        self.field = field
+        self.variants_field = f"{field}_variants"
+        self.widths = widths
+        self.directory = directory
+        self.formats = formats
+        self.square = square
+
+    # --- 作成 ---
+    def schedule(self, instances) -> None:
+        """保存した `instances` の縮小版をコミット後に作る（画像の無いものは空にする）"""
+        targets = []
+        for instance in instances:
+            source = getattr(instance, self.field)
+            if source:
+                targets.append((type(instance), instance.pk, source.name))
+            elif getattr(instance, self.variants_field):
+                type(instance).objects.filter(pk=instance.pk).update(**{self.variants_field: {}})
+        if targets:
+            transaction.on_commit(partial(self.generate, targets))
+
+    def generate(self, targets) -> None:
+        """`targets` は (モデル, pk, 元画像の保存名) の並び"""
+        mode = getattr(settings, 'IMAGE_VARIANTS_MODE', 'process')
+
+        for model, pk, source_name in targets:
+            if mode == 'inline':
+                self.store(model, pk, source_name, self.render(source_name))
+            elif mode == 'process':
+                future = submit(render_variants, *self.render_args(source_name))
+                future.add_done_callback(partial(self._on_rendered, model, pk, source_name))
+
+    def render_args(self, source_name):
+        return default_storage.path(source_name), self.widths, self.formats, self.square
+
+    def render(self, source_name: str) -> dict:
+        return render_variants(*self.render_args(source_name))
+
+    def store(self, model, pk, source_name, rendered) -> dict:
+        """縮小版を保存し、元画像が差し替わっていなければ記録する"""
+        variants = {}
+        for size, data in rendered.items():
+            variants[size] = {"width": data["width"], "height": data["height"]}
+            for fmt in self.formats:
+                variants[size][fmt] = default_storage.save(
+                    f"{self.directory}{size}{EXTENSIONS[fmt]}", ContentFile(data[fmt]),
+                )
+
+        instance = model.objects.filter(pk=pk).only('pk', self.field, self.variants_field).first()
+        if instance is None or getattr(instance, self.field).name != source_name:
+            # 削除・差し替え済み。保存した縮小版は参照されないので gc_blobs が消す
+            return {}
+
+        setattr(instance, self.variants_field, variants)
+        instance.save(update_fields=[self.variants_field])
+        return variants
+
+    def _on_rendered(self, model, pk, source_name, future) -> None:
+        # プールの管理スレッドで呼ばれる
+        try:
+            self.store(model, pk, source_name, future.result())
+        except Exception:
+            logger.exception("image variants failed: %s pk=%s", model._meta.label, pk)
+        finally:
+            close_old_connections()
+
+    # --- 既存画像の一括作成（管理コマンド用） ---
+    def backfill(self, queryset, rebuild: bool = False, workers: int = None, on_error=None) -> int:
+        """
+        `queryset` のうち縮小版の無い画像（`rebuild` なら全部）の縮小版を、
+        プロセスプールで並列に作る。作成した件数を返す。
+        """
+        queryset = queryset.exclude(**{f"{self.field}__isnull": True}).exclude(**{self.field: ""})
+        if not rebuild:
+            queryset = queryset.filter(**{self.variants_field: {}})
+        rows = list(queryset.order_by('pk').values_list('pk', self.field))
+        if not rows:
+            return 0
+
+        model = queryset.model
+        built = 0
+        with ProcessPoolExecutor(max_workers=workers or WORKERS, mp_context=_mp_context()) as pool:
+            futures = [
+                (pk, source_name, pool.submit(render_variants, *self.render_args(source_name)))
+                for pk, source_name in rows
+            ]
+            for pk, source_name, future in futures:
+                try:
+                    self.store(model, pk, source_name, future.result())
+                    built += 1
+                except Exception as exc:  # 壊れた画像・見つからないファイルは飛ばす
+                    if on_error:
+                        on_error(model, pk, source_name, exc)
+        return built
+
+    # --- シリアライザー用 ---
+    def urls(self, variants):
+        """保存名を URL に置き換えて返す（縮小版が無ければ None）"""
+        if not variants:
+            return None
+        return {
+            size: {
+                "width": entry["width"],
+                "height": entry["height"],
+                **{fmt: default_storage.url(entry[fmt]) for fmt in self.formats if entry.get(fmt)},
+            }
+            for size, entry in variants.items()
+        }
+
+
+# --- プロセスプール ---
+# ワーカーは Django を読み込まない utils.images だけを使うので spawn で起動する
+WORKERS = getattr(settings, 'IMAGE_VARIANT_WORKERS', 2)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _mp_context():
+    return multiprocessing.get_context('spawn')
+
+
+def submit(fn, *args):
+    global _pool
+    with _pool_lock:
+        for _ in range(2):
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=_mp_context())
+            try:
+                return _pool.submit(fn, *args)
+            except BrokenProcessPool:
+                # ワーカーが落ちた（メモリ不足など）。作り直して1回だけやり直す
+                _pool = None
+        raise BrokenProcessPool("image worker pool is not available")
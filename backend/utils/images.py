@@ -0,0 +1,73 @@
+import io
+
+from PIL import Image, ImageOps
+
+# 出力形式ごとの保存オプション。EXIF / ICC は渡さないので出力には残らない
+ENCODE_OPTIONS = {
+    "webp": {"format": "WEBP", "quality": 75, "method": 4},
+    "jpeg": {"format": "JPEG", "quality": 80, "optimize": True, "progressive": True},
+}
+
+
+def open_for_resize(path: str, max_edge: int) -> Image.Image:
+    """
+    `max_edge` 以上の大きさがあれば十分な画像として開く。
+    JPEG は draft モードで 1/2〜1/8 に縮小しながらデコードするので、原寸をメモリに展開しない。
+    EXIF の向きは画素に反映してから返す。
+    """
+    with Image.open(path) as src:
+        # 回転で縦横が入れ替わっても足りるよう、正方形で要求する
+        src.draft("RGB", (max_edge, max_edge))
+        # 画素を読み込んだコピーが返るので、ファイルはここで閉じてよい
+        img = ImageOps.exif_transpose(src)
+
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+    return img
+
+
+def crop_square(img: Image.Image) -> Image.Image:
+    """中央を正方形に切り抜く"""
+    edge = min(img.size)
+    left = (img.width - edge) // 2
+    top = (img.height - edge) // 2
+    return img.crop((left, top, left + edge, top + edge))
+
+
+def resize_to_width(img: Image.Image, width: int) -> Image.Image:
+    """幅 `width` に縮小する（元の方が小さければ拡大はしない）"""
+    if img.width <= width:
+        return img.copy()
+    height = max(1, round(img.height * width / img.width))
+    return img.resize((width, height), Image.LANCZOS)
+
+
+def encode(img: Image.Image, fmt: str) -> bytes:
+    if fmt == "jpeg" and img.mode == "RGBA":
+        # JPEG は透過を持てないので白背景に合成する
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+
+    buffer = io.BytesIO()
+    img.save(buffer, **ENCODE_OPTIONS[fmt])
+    return buffer.getvalue()
+
+
+def render_variants(path: str, widths: dict, formats=("webp", "jpeg"), square: bool = False) -> dict:
+    """
+    `widths` ({"thumb": 320, ...}) の各幅・各形式の画像を作る。
+    戻り値は {"thumb": {"width": 320, "height": 240, "webp": b"...", "jpeg": b"..."}, ...}
+    Django に依存しないので ProcessPoolExecutor のワーカーでそのまま実行できる。
+    """
+    img = open_for_resize(path, max(widths.values()))
+    if square:
+        img = crop_square(img)
+
+    variants = {}
+    for name, width in widths.items():
+        resized = resize_to_width(img, width)
+        variants[name] = {"width": resized.width, "height": resized.height}
+        for fmt in formats:
+            variants[name][fmt] = encode(resized, fmt)
+    return variants
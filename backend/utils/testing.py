@@ -0,0 +1,42 @@
+import shutil
+import tempfile
+
+from rest_framework.test import APIClient
+
+from companies.models import Company
+from users.models import CustomUser
+
+
+class TempMediaRootMixin:
+    """テスト中だけ MEDIA_ROOT を一時ディレクトリに差し替える（終わったら消す）"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class CompanyMemberMixin:
+    """
+    テスト用の会社 `self.company` と、その社員 `self.me` を作る。
+    `self.client` は `self.me` でログイン済み。
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.company = Company.objects.create(name='テスト建設', is_approved=True)
+        self.me = self.create_user('me')
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def create_user(self, name: str, company=None, **fields) -> CustomUser:
+        return CustomUser.objects.create(
+            email=f'{name}@example.com',
+            account_id=f'@{name}',
+            username=name,
+            company=self.company if company is None else company,
+            **fields,
+        )
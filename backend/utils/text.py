@@ -0,0 +1,23 @@
+import unicodedata
+
+# カタカナ（ァ〜ヶ）とひらがな（ぁ〜ゖ）のコードポイントの差
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord("ァ"), ord("ヶ") + 1)}
+
+
+def normalize_search_text(value: str) -> str:
+    """
+    検索用に表記ゆれを吸収する。
+    全角/半角 (NFKC)・カタカナ/ひらがな・大文字/小文字を同一視する。
+    """
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFKC", value)
+    return value.translate(_KATAKANA_TO_HIRAGANA).lower().strip()
+
+
+def prefix_range(prefix: str):
+    """
+    前方一致を範囲検索 (>= prefix, < prefix + 最大文字) に置き換える。
+    LIKE と違い、通常の B-tree 索引がそのまま使える。
+    """
+    return prefix, prefix + "\U0010ffff"
@@ -4,9 +4,19 @@ import 'package:dio/dio.dart';
 import 'package:frontend/models/convInvi_model.dart';
 import 'package:frontend/models/conversation_model.dart';
 
-Future<List<ConvInviModel>> fetchConversation(Dio dio) async {
+// 会話一覧は新しい順のページ単位で返る
+// nextCursor が null なら最後のページ
+Future<({List<ConvInviModel> items, String? nextCursor})> fetchConversation(
+  Dio dio, {
+  String? before,
+}) async {
     try {
-        final response = await dio.get('chat/conversation/');
+        final response = await dio.get(
+          'chat/conversation/',
+          queryParameters: {
+            if (before != null) 'before': before,
+          },
+        );
 
         // 明示的にList<Map<String, dynamic>>にキャスト
         final List<dynamic> rawData = response.data;
@@ -14,7 +24,10 @@ Future<List<ConvInviModel>> fetchConversation(Dio dio) async {
             .map((json) => ConvInviModel.fromJson(json as Map<String, dynamic>))
             .toList();
         
-        return conversations;
+        return (
+          items: conversations,
+          nextCursor: response.headers.value('x-next-cursor'),
+        );
     } on DioException catch (e) {
         print('📛 fetchConversation error: ${e.message}');
         throw Exception('会話一覧の取得に失敗しました');
@@ -49,20 +49,31 @@ Future<Map<String, dynamic>> acceptGroupInvitation({
 }
 
 // --- グループに未参加のユーザー一覧取得 ---
-Future<List<SimpleUserModel>> fetchInviteCandidatesUsers({
+// query を指定すると username / @ID の前方一致で絞り込む
+// 名前順のページ単位で返る。nextCursor を cursor に渡すと続きを取得（null なら最後のページ）
+Future<({List<SimpleUserModel> items, String? nextCursor})> fetchInviteCandidatesUsers({
   required Dio dio,
   required String conversationId,
+  String query = '',
+  String? cursor,
 }) async {
   try {
     final response = await dio.get(
       'chat/conversation/$conversationId/invite/',
+      queryParameters: {
+        if (query.isNotEmpty) 'q': query,
+        if (cursor != null) 'cursor': cursor,
+      },
       options: Options(
         headers: {'Content-Type': 'application/json'}, // ← 安全・推奨
       ),
     );
 
     final List<dynamic> rawList = response.data;
-    return rawList.map((item) => SimpleUserModel.fromJson(item)).toList();
+    return (
+      items: rawList.map((item) => SimpleUserModel.fromJson(item)).toList(),
+      nextCursor: response.headers.value('x-next-cursor'),
+    );
   } on DioException catch (e) {
     print('📛 fetchInviteUsers error: ${e.response?.data}');
     throw Exception('グループ未参加ユーザー一覧取得に失敗しました');
@@ -1,12 +1,25 @@
 import 'package:dio/dio.dart';
 import 'package:frontend/models/message_model.dart';
 
-// メッセージ一覧取得
-Future<List<MessageModel>> fetchMessage(Dio dio, String conversation_id) async {
+// メッセージ一覧取得（古い順。before を渡すとそれより古いページ）
+// nextCursor が null なら最も古いメッセージまで読み込み済み
+Future<({List<MessageModel> items, String? nextCursor})> fetchMessage(
+  Dio dio,
+  String conversation_id, {
+  String? before,
+}) async {
   try {
-    final response = await dio.get('chat/conversation/$conversation_id/message/');
+    final response = await dio.get(
+      'chat/conversation/$conversation_id/message/',
+      queryParameters: {
+        if (before != null) 'before': before,
+      },
+    );
     final List<dynamic> data = response.data;
-    return data.map((json) => MessageModel.fromJson(json)).toList();
+    return (
+      items: data.map((json) => MessageModel.fromJson(json)).toList(),
+      nextCursor: response.headers.value('x-next-cursor'),
+    );
   } on DioException catch (e) {
     print('📛 fetchMessage error: ${e.message}');
     throw Exception('メッセージの取得に失敗しました');
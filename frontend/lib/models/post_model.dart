@@ -14,6 +14,8 @@ class PostModel {
   final bool isRead;
   final int readCount;
   final List<String> images;
+  // images と同じ順番のフィード用サムネイル（縮小版が未作成なら原寸の URL）
+  final List<String> thumbnails;
 
   PostModel({
     required this.id,
@@ -31,7 +33,8 @@ class PostModel {
     required this.isRead,
     required this.readCount,
     required this.images,
-  });
+    List<String>? thumbnails,
+  }) : thumbnails = thumbnails ?? images;
 
   factory PostModel.fromJson(Map<String, dynamic> json) {
     return PostModel(
@@ -51,9 +54,20 @@ class PostModel {
       isRead: json['is_read'] == true || json['is_read'] == 'true',
       readCount: (json['read_count'] ?? 0) as int,
       images: List<String>.from(json['images'] ?? []),
+      thumbnails: _thumbnails(json),
     );
   }
 
+  static List<String> _thumbnails(Map<String, dynamic> json) {
+    final images = List<String>.from(json['images'] ?? []);
+    final variants = (json['image_variants'] as List?) ?? const [];
+    return [
+      for (var i = 0; i < images.length; i++)
+        (i < variants.length ? variants[i]?['thumb']?['webp'] as String? : null) ??
+            images[i],
+    ];
+  }
+
   PostModel copyWith({
     int? id,
     int? userId,
@@ -70,6 +84,7 @@ class PostModel {
     bool? isRead,
     int? readCount,
     List<String>? images,
+    List<String>? thumbnails,
   }) {
     return PostModel(
       id: id ?? this.id,
@@ -87,6 +102,7 @@ class PostModel {
       isRead: isRead ?? this.isRead,
       readCount: readCount ?? this.readCount,
       images: images ?? this.images,
+      thumbnails: thumbnails ?? (images == null ? this.thumbnails : null),
     );
   }
 }
@@ -24,16 +24,45 @@ class ConversationListNotifier extends StateNotifier<AsyncValue<List<ConvInviMod
     return items;
   }
 
+  // 次ページのカーソル（null なら最後まで読み込み済み）
+  String? _nextCursor;
+  bool _isFetchingMore = false;
+
+  bool get hasMore => _nextCursor != null;
+
   Future<void> fetch() async {
     try {
       final dio = ref.read(dioProvider);
-      final data = await fetchConversation(dio);
-      state = AsyncValue.data(_sortByRecent(data));
+      final page = await fetchConversation(dio);
+      _nextCursor = page.nextCursor;
+      state = AsyncValue.data(_sortByRecent(page.items));
     } catch (e, st) {
       state = AsyncValue.error(e, st);
     }
   }
 
+  // 一覧の末尾までスクロールしたら続きを読み込む
+  Future<void> fetchMore() async {
+    final cursor = _nextCursor;
+    final current = state.valueOrNull;
+    if (cursor == null || current == null || _isFetchingMore) return;
+
+    _isFetchingMore = true;
+    try {
+      final dio = ref.read(dioProvider);
+      final page = await fetchConversation(dio, before: cursor);
+      _nextCursor = page.nextCursor;
+
+      final loadedIds = current.map((c) => c.conversation?.id).toSet();
+      final added = page.items.where((c) => !loadedIds.contains(c.conversation?.id));
+      state = AsyncValue.data(_sortByRecent([...current, ...added]));
+    } catch (e) {
+      print('❌ 会話一覧の追加読み込みエラー: $e');
+    } finally {
+      _isFetchingMore = false;
+    }
+  }
+
   void addConversation(ConvInviModel conversation) {
     final newId = conversation.conversation?.id;
     if (newId == null) return;
@@ -3,7 +3,68 @@ import 'package:frontend/api/invitation_api.dart';
 import 'package:frontend/models/simple_user_model.dart';
 import 'package:frontend/providers/dio_provider.dart';
 
-final inviteCandidatesUserProvider = FutureProvider.family<List<SimpleUserModel>, String>((ref, conversationId) async {
-  final dio = ref.read(dioProvider);
-  return fetchInviteCandidatesUsers(dio: dio, conversationId: conversationId);
-});
\ No newline at end of file
+typedef InviteCandidatesArgs = ({String conversationId, String query});
+
+class InviteCandidatesNotifier extends StateNotifier<AsyncValue<List<SimpleUserModel>>> {
+  final Ref ref;
+  final InviteCandidatesArgs args;
+
+  InviteCandidatesNotifier(this.ref, this.args) : super(const AsyncValue.loading()) {
+    fetch();
+  }
+
+  // 次ページのカーソル（null なら最後まで読み込み済み）
+  String? _nextCursor;
+  bool _isFetchingMore = false;
+
+  bool get hasMore => _nextCursor != null;
+
+  Future<void> fetch() async {
+    try {
+      final dio = ref.read(dioProvider);
+      final page = await fetchInviteCandidatesUsers(
+        dio: dio,
+        conversationId: args.conversationId,
+        query: args.query,
+      );
+      _nextCursor = page.nextCursor;
+      state = AsyncValue.data(page.items);
+    } catch (e, st) {
+      state = AsyncValue.error(e, st);
+    }
+  }
+
+  // 一覧の末尾までスクロールしたら続きを読み込む
+  Future<void> fetchMore() async {
+    final cursor = _nextCursor;
+    final current = state.valueOrNull;
+    if (cursor == null || current == null || _isFetchingMore) return;
+
+    _isFetchingMore = true;
+    try {
+      final dio = ref.read(dioProvider);
+      final page = await fetchInviteCandidatesUsers(
+        dio: dio,
+        conversationId: args.conversationId,
+        query: args.query,
+        cursor: cursor,
+      );
+      if (!mounted) return;
+      _nextCursor = page.nextCursor;
+
+      final loadedIds = current.map((u) => u.id).toSet();
+      final added = page.items.where((u) => !loadedIds.contains(u.id));
+      state = AsyncValue.data([...current, ...added]);
+    } catch (e) {
+      print('❌ 招待候補の追加読み込みエラー: $e');
+    } finally {
+      _isFetchingMore = false;
+    }
+  }
+}
+
+// 検索文字列ごとに結果を持つ（空文字なら全員を名前順に）
+final inviteCandidatesUserProvider = StateNotifierProvider.autoDispose
+    .family<InviteCandidatesNotifier, AsyncValue<List<SimpleUserModel>>, InviteCandidatesArgs>(
+  (ref, args) => InviteCandidatesNotifier(ref, args),
+);
@@ -11,16 +11,48 @@ class MessageListNotifier extends StateNotifier<AsyncValue<List<MessageModel>>>
     _fetch();
   }
 
+  // さらに古いページのカーソル（null なら最も古いメッセージまで読み込み済み）
+  String? _nextCursor;
+  bool _isFetchingOlder = false;
+
+  bool get hasOlder => _nextCursor != null;
+
   Future<void> _fetch() async {
     final dio = ref.read(dioProvider);
     try {
-      final message = await messageApi.fetchMessage(dio, conversation_id);
-      state = AsyncValue.data(message);
+      final page = await messageApi.fetchMessage(dio, conversation_id);
+      _nextCursor = page.nextCursor;
+      state = AsyncValue.data(page.items);
     } catch (e, st) {
       state = AsyncValue.error(e, st);
     }
   }
 
+  // 一覧の先頭までスクロールしたら古いメッセージを読み込んで前に足す
+  // 読み込んだ場合は true を返す
+  Future<bool> fetchOlder() async {
+    final cursor = _nextCursor;
+    final current = state.valueOrNull;
+    if (cursor == null || current == null || _isFetchingOlder) return false;
+
+    _isFetchingOlder = true;
+    try {
+      final dio = ref.read(dioProvider);
+      final page = await messageApi.fetchMessage(dio, conversation_id, before: cursor);
+      _nextCursor = page.nextCursor;
+
+      final loadedIds = current.map((m) => m.id).toSet();
+      final older = page.items.where((m) => !loadedIds.contains(m.id));
+      state = AsyncValue.data([...older, ...current]);
+      return true;
+    } catch (e) {
+      print('❌ メッセージの追加読み込みエラー: $e');
+      return false;
+    } finally {
+      _isFetchingOlder = false;
+    }
+  }
+
   Future<MessageModel> addMessage({
     required String kind,
     required String bodyText,
@@ -61,6 +93,19 @@ class MessageListNotifier extends StateNotifier<AsyncValue<List<MessageModel>>>
           msg
     ]);
   }
+
+  // 相手が lastReadId (ULID) まで読んだ → 自分が送ったメッセージのうちそこまでをまとめて既読にする
+  void markMessagesAsReadUpTo(String lastReadId, dynamic myId) {
+    final current = state.value ?? [];
+
+    state = AsyncValue.data([
+      for (final msg in current)
+        if (msg.sender.id.toString() == myId.toString() && msg.id.compareTo(lastReadId) <= 0)
+          msg.copyWith(isRead: true)
+        else
+          msg
+    ]);
+  }
 }
 
 final messageListProvider = StateNotifierProvider.family<
@@ -51,6 +51,11 @@ class _ChatListPage extends ConsumerState<ChatListPage> {
                     itemBuilder: (context, index) {
                       final item = conversationItems[index];
 
+                      // 末尾まで表示したら次のページを読み込む
+                      if (index == conversationItems.length - 1) {
+                        ref.read(conversationListProvider.notifier).fetchMore();
+                      }
+
                       return item.conversation!.isGroup
                         ? item.isInvited
                           ? ListTile(
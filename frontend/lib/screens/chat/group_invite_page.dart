@@ -1,3 +1,5 @@
+import 'dart:async';
+
 import 'package:flutter/material.dart';
 import 'package:flutter_riverpod/flutter_riverpod.dart';
 import 'package:frontend/models/conversation_model.dart';
@@ -14,6 +16,22 @@ class GroupInvitePage extends ConsumerStatefulWidget {
 }
 
 class _GroupInvitePage extends ConsumerState<GroupInvitePage> {
+  String _query = '';
+  Timer? _debounce;
+
+  // 入力のたびに通信しないよう、少し待ってから検索する
+  void _onQueryChanged(String value) {
+    _debounce?.cancel();
+    _debounce = Timer(const Duration(milliseconds: 300), () {
+      setState(() => _query = value.trim());
+    });
+  }
+
+  @override
+  void dispose() {
+    _debounce?.cancel();
+    super.dispose();
+  }
 
   String resolveImageUrl(String? path) {
     if (path == null || path.isEmpty) return '';
@@ -24,7 +42,9 @@ class _GroupInvitePage extends ConsumerState<GroupInvitePage> {
 
   @override
   Widget build(BuildContext context) {
-    final candidatesAsync = ref.watch(inviteCandidatesUserProvider(widget.conversation.id));
+    final candidatesProvider =
+        inviteCandidatesUserProvider((conversationId: widget.conversation.id, query: _query));
+    final candidatesAsync = ref.watch(candidatesProvider);
 
     return Scaffold(
       appBar: AppBar(
@@ -41,27 +61,49 @@ class _GroupInvitePage extends ConsumerState<GroupInvitePage> {
         ),
       ),
 
-      body: candidatesAsync.when(
-        loading: () => const Center(child: CircularProgressIndicator()),
-        error: (err, stack) => Center(child: Text('エラー: $err')),
-        data:(users) => ListView.builder(
-          itemCount: users.length,
-          itemBuilder: (context, index) {
-            final user = users[index];
-            return Padding(
-              padding: const EdgeInsets.symmetric(horizontal: 16.0, vertical: 12.0),
-              child: ListTile(
-                leading: user.iconimg != null
-                    ? CircleAvatar(backgroundImage: NetworkImage(resolveImageUrl(user.iconimg!)))
-                    : CircleAvatar(
-                        backgroundColor: Theme.of(context).primaryColor,
-                        child: const Icon(Icons.person, color: Colors.white),
-                      ),
-                title: Text(user.username),
+      body: Column(
+        children: [
+          Padding(
+            padding: const EdgeInsets.fromLTRB(16, 12, 16, 0),
+            child: TextField(
+              decoration: const InputDecoration(
+                prefixIcon: Icon(Icons.search),
+                hintText: '名前・IDで検索',
               ),
-            );
-          },
-        ),
+              onChanged: _onQueryChanged,
+            ),
+          ),
+          Expanded(
+            child: candidatesAsync.when(
+              loading: () => const Center(child: CircularProgressIndicator()),
+              error: (err, stack) => Center(child: Text('エラー: $err')),
+              data:(users) => ListView.builder(
+                itemCount: users.length,
+                itemBuilder: (context, index) {
+                  final user = users[index];
+
+                  // 末尾まで表示したら次のページを読み込む
+                  if (index == users.length - 1) {
+                    ref.read(candidatesProvider.notifier).fetchMore();
+                  }
+
+                  return Padding(
+                    padding: const EdgeInsets.symmetric(horizontal: 16.0, vertical: 12.0),
+                    child: ListTile(
+                      leading: user.iconimg != null
+                          ? CircleAvatar(backgroundImage: NetworkImage(resolveImageUrl(user.iconimg!)))
+                          : CircleAvatar(
+                              backgroundColor: Theme.of(context).primaryColor,
+                              child: const Icon(Icons.person, color: Colors.white),
+                            ),
+                      title: Text(user.username),
+                    ),
+                  );
+                },
+              ),
+            ),
+          ),
+        ],
       ),
     );
   }
@@ -1,3 +1,4 @@
+import 'dart:async';
 import 'dart:convert';
 
 import 'package:flutter/material.dart';
@@ -29,6 +30,10 @@ class MessagePage extends ConsumerStatefulWidget {
 class _MessagePageState extends ConsumerState<MessagePage> {
   final ScrollController _scrollController = ScrollController();
   late WebSocketChannel _channel;
+  Timer? _heartbeatTimer;
+
+  // 最後に末尾までスクロールしたときの最新メッセージ（古いページを足したときは動かさない）
+  String? _newestMessageId;
 
   @override
   void initState() {
@@ -50,13 +55,21 @@ class _MessagePageState extends ConsumerState<MessagePage> {
 
       final data = jsonDecode(event);
 
+      // ハートビートの応答は何もしない
+      if (data['type'] == 'pong') {
+        return;
+      }
+
       // --- 既読通知の処理を追加 ---
       if (data['type'] == 'read') {
-        final messageId = data['message_id'];
+        // 自分が開いた・読み進めたときの通知は相手の既読ではない
+        if (isMyMessage(data['reader_id'])) return;
+
+        final lastReadId = data['last_read_id'] ?? data['message_id'];
 
         ref
           .read(messageListProvider(widget.conversation.id).notifier)
-          .markMessageAsRead(messageId);
+          .markMessagesAsReadUpTo(lastReadId, ref.read(userProvider)?.id);
 
         return;
       }
@@ -75,12 +88,18 @@ class _MessagePageState extends ConsumerState<MessagePage> {
       print('🔌 WebSocket接続終了');
     });
 
+    // 閲覧中状態がサーバー側で期限切れにならないよう定期的に送る
+    _heartbeatTimer = Timer.periodic(const Duration(seconds: 30), (_) {
+      _channel.sink.add(jsonEncode({'type': 'ping'}));
+    });
+
     print('✅ WebSocketに接続しました');
   }
 
 
   @override
   void dispose() {
+    _heartbeatTimer?.cancel();
     _channel.sink.close();
     _scrollController.dispose();
     super.dispose();
@@ -91,6 +110,23 @@ class _MessagePageState extends ConsumerState<MessagePage> {
     return senderId.toString() == myId.toString();
   }
 
+  // 古いメッセージを前に足しても、見ている位置がずれないようにする
+  Future<void> _loadOlder() async {
+    if (!_scrollController.hasClients) return;
+    final extentBefore = _scrollController.position.maxScrollExtent;
+
+    final loaded = await ref
+        .read(messageListProvider(widget.conversation.id).notifier)
+        .fetchOlder();
+    if (!loaded) return;
+
+    WidgetsBinding.instance.addPostFrameCallback((_) {
+      if (!_scrollController.hasClients) return;
+      final added = _scrollController.position.maxScrollExtent - extentBefore;
+      _scrollController.jumpTo(_scrollController.offset + added);
+    });
+  }
+
   void _scrollToBottom() {
     WidgetsBinding.instance.addPostFrameCallback((_) {
       if (!_scrollController.hasClients) return;
@@ -168,7 +204,12 @@ class _MessagePageState extends ConsumerState<MessagePage> {
                       decoratedMessages.add({'type': 'message', 'message': msg});
                     }
 
-                  _scrollToBottom();
+                  // 新着があったときだけ末尾へ（古いページの読み込みでは動かさない）
+                  final newestId = messages.isEmpty ? null : messages.last.id;
+                  if (newestId != _newestMessageId) {
+                    _newestMessageId = newestId;
+                    _scrollToBottom();
+                  }
                   return ListView.builder(
                     controller: _scrollController,
                     padding: EdgeInsets.only(
@@ -183,6 +224,11 @@ class _MessagePageState extends ConsumerState<MessagePage> {
 
                       final item = decoratedMessages[index];
 
+                      // 先頭まで表示したら古いページを読み込む
+                      if (index == 0) {
+                        _loadOlder();
+                      }
+
                       if (item['type'] == 'date') {
                         final date = item['date'] as DateTime;
 
@@ -160,7 +160,7 @@ class TimelineTabPage extends ConsumerWidget {
                                           childAspectRatio: 1,
                                         ),
                                         itemBuilder: (_, i) {
-                                          final imageUrl = resolveImageUrl(post.images[i]);
+                                          final imageUrl = resolveImageUrl(post.thumbnails[i]);
                                           return GestureDetector(
                                             onTap: () {
                                               final pageController = PageController(initialPage: i);
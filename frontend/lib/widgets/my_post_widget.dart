@@ -107,7 +107,7 @@ class MyPostList extends ConsumerWidget {
                             childAspectRatio: 1,
                           ),
                           itemBuilder: (context, index) {
-                            final url = resolveImageUrl(post.images[index]);
+                            final url = resolveImageUrl(post.thumbnails[index]);
                             return GestureDetector(
                               onTap: () {
                                 final pageController = PageController(initialPage: i);